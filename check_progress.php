@@ -0,0 +1,11 @@
+<?php
+$task_id = $_GET['task_id'];
+$progress_file = "task_status/{$task_id}.progress.json";
+
+header('Content-Type: application/json');
+if (file_exists($progress_file)) {
+    echo file_get_contents($progress_file);
+} else {
+    echo "{}";
+}
+?>
\ No newline at end of file
@@ -0,0 +1,248 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+# DPS-Tool.py is loaded by the dps_tool package, the parent directory of this script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dps_tool import baseline, load_dps_tool
+
+# Output tables compared with those of the original implementation
+COMPARED_TABLES = ['Gene_pairs_table.csv', 'DP_score_table.csv']
+
+# ==============================
+#       Synthetic cohort
+# ==============================
+def make_cohort(genes_num, samples_num, positive_fraction=0.5, planted_pairs_num=200, seed=0):
+    """
+    make_cohort: Function to generate a synthetic expression matrix and sample information matrix with planted reversed gene pairs
+
+    Input Parameters:
+    genes_num: Number of genes
+    samples_num: Number of samples
+    positive_fraction: Fraction of positive samples
+    planted_pairs_num: Number of planted reversed gene pairs; in each pair Gene1 is below Gene2 in negative samples and above it in positive samples
+    seed: Random seed
+
+    Output:
+    expr_df: Expression matrix (Symbol, then one column per sample), rounded to 2 decimals so that ties occur
+    sample_df: Sample information matrix (Sample, Class, Rank), 'Normal' negative samples (Rank 0) and 'Disease' positive samples (Rank 1)
+    planted_pairs: Dataframe of the planted pairs (Gene1, Gene2)
+    """
+    rng = np.random.default_rng(seed)
+    positive_samples_num = int(round(samples_num * positive_fraction))
+    negative_samples_num = samples_num - positive_samples_num
+    if negative_samples_num < 1 or positive_samples_num < 1:
+        raise ValueError("Both classes need at least one sample!")
+    if 2 * planted_pairs_num > genes_num:
+        raise ValueError("Too many planted gene pairs for the number of genes!")
+
+    # Log-scale background expression: a gene level plus sample noise
+    values = rng.gamma(2.0, 2.0, size=(genes_num, 1)) + rng.normal(0.0, 1.0, size=(genes_num, samples_num))
+
+    # Planted pairs use disjoint genes: Gene2 follows Gene1 with an offset whose sign flips between the classes
+    planted_genes = rng.permutation(genes_num)[:2 * planted_pairs_num].reshape(planted_pairs_num, 2)
+    offsets = rng.uniform(1.0, 3.0, size=(planted_pairs_num, 1))
+    sign = np.where(np.arange(samples_num) < negative_samples_num, 1.0, -1.0)
+    values[planted_genes[:, 1]] = values[planted_genes[:, 0]] + offsets * sign + rng.normal(0.0, 0.3, size=(planted_pairs_num, samples_num))
+
+    symbols = np.array([f'GENE{i:05d}' for i in range(genes_num)])
+    samples = [f'S{i:04d}' for i in range(samples_num)]
+    expr_df = pd.DataFrame(np.round(values, 2), columns=samples)
+    expr_df.insert(0, 'Symbol', symbols)
+
+    sample_df = pd.DataFrame({
+        'Sample': samples,
+        'Class': ['Normal'] * negative_samples_num + ['Disease'] * positive_samples_num,
+        'Rank': [0] * negative_samples_num + [1] * positive_samples_num
+    })
+    planted_pairs = pd.DataFrame({'Gene1': symbols[planted_genes[:, 0]], 'Gene2': symbols[planted_genes[:, 1]]})
+    return expr_df, sample_df, planted_pairs
+
+# ==============================
+#          Benchmark runs
+# ==============================
+def run_pipeline(expression_matrix_input, sample_info_input, folder_path, options, result_file):
+    """
+    run_pipeline: Function run in a fresh process, so that its peak RSS only covers this run; runs DPS_Tool and writes its stage records to result_file
+    """
+    dps_tool = load_dps_tool()
+    progress_file = os.path.join(folder_path, 'progress.json')
+    start = time.perf_counter()
+    error = None
+    try:
+        dps_tool.DPS_Tool(expression_matrix_input, sample_info_input, 'Normal', 'Disease', folder_path, progress_file=progress_file, **options)
+    except Exception as e:
+        error = str(e)
+    wall_time = time.perf_counter() - start
+
+    stages = []
+    if os.path.exists(progress_file):
+        with open(progress_file) as f:
+            stages = json.load(f)['stages']
+    with open(result_file, 'w') as f:
+        json.dump({'wall_time': wall_time, 'peak_rss_mb': dps_tool.peak_rss_mb(), 'stages': stages, 'error': error}, f)
+
+def benchmark_run(expression_matrix_input, sample_info_input, folder_path, options):
+    """
+    benchmark_run: Function to run the pipeline once in a separate process
+
+    Output:
+    result: Wall time, peak RSS (MB), stage records and error message of the run
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    result_file = os.path.join(folder_path, 'benchmark.json')
+    process = multiprocessing.get_context('spawn').Process(
+        target=run_pipeline, args=(expression_matrix_input, sample_info_input, folder_path, options, result_file))
+    process.start()
+    process.join()
+    if not os.path.exists(result_file):
+        return {'wall_time': None, 'peak_rss_mb': None, 'stages': [], 'error': f'benchmark process exited with code {process.exitcode}'}
+    with open(result_file) as f:
+        return json.load(f)
+
+def write_baseline_tables(expression_matrix_input, sample_info_input, folder_path, args):
+    """
+    write_baseline_tables: Function to write the tables of the original implementation (see dps_tool/baseline.py) on a cohort, the golden
+                           outputs every run is compared with
+    
+    Output:
+    wall_time: Run time of the original implementation (s)
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    start = time.perf_counter()
+    gene_pairs, scores = baseline.baseline_tables(pd.read_csv(expression_matrix_input, sep=','), pd.read_csv(sample_info_input, sep=','), 'Normal', 'Disease',
+                                                  args.threshold, args.deduplicate)
+    wall_time = time.perf_counter() - start
+    
+    # Written as the original DPS_Tool wrote them
+    scores.to_csv(os.path.join(folder_path, 'DP_score_table.csv'))
+    gene_pairs.to_csv(os.path.join(folder_path, 'Gene_pairs_table.csv'))
+    return wall_time
+
+def compare_outputs(folder_path, baseline_folder_path):
+    """
+    compare_outputs: Function to check that the output tables of a run are identical to the golden tables, see write_baseline_tables
+
+    Output:
+    mismatch: None if identical, otherwise the first difference found
+    """
+    for table_name in COMPARED_TABLES:
+        try:
+            pd.testing.assert_frame_equal(pd.read_csv(os.path.join(folder_path, table_name)),
+                                          pd.read_csv(os.path.join(baseline_folder_path, table_name)), check_exact=True)
+        except (AssertionError, OSError) as e:
+            return f"{table_name}: {str(e).strip()}"
+    return None
+
+def planted_pairs_recall(folder_path, planted_pairs):
+    """
+    planted_pairs_recall: Function to get the fraction of planted gene pairs found in the gene pairs table
+    """
+    gene_pairs = pd.read_csv(os.path.join(folder_path, 'Gene_pairs_table.csv'))
+    found = set(zip(gene_pairs['Gene1'], gene_pairs['Gene2'])) | set(zip(gene_pairs['Gene2'], gene_pairs['Gene1']))
+    return sum(pair in found for pair in zip(planted_pairs['Gene1'], planted_pairs['Gene2'])) / planted_pairs.shape[0]
+
+def benchmark_cohort(genes_num, samples_num, args, work_dir):
+    """
+    benchmark_cohort: Function to benchmark every backend on one synthetic cohort
+
+    Output:
+    cohort_result: Cohort settings, run time of the original implementation (None if it was not run) and one result per backend and repeat
+    """
+    expr_df, sample_df, planted_pairs = make_cohort(genes_num, samples_num, args.positive_fraction, args.planted_pairs, args.seed)
+    cohort_dir = os.path.join(work_dir, f'cohort_{genes_num}x{samples_num}')
+    os.makedirs(cohort_dir, exist_ok=True)
+    expression_matrix_input = os.path.join(cohort_dir, 'expression_matrix.csv')
+    sample_info_input = os.path.join(cohort_dir, 'sample_info.csv')
+    expr_df.to_csv(expression_matrix_input, index=False)
+    sample_df.to_csv(sample_info_input, index=False)
+
+    # Every backend is checked against the tables of the original implementation, which compares one gene at a time and is only run on
+    # the smaller cohorts
+    baseline_folder_path, baseline_wall_time = None, None
+    if genes_num <= args.baseline_max_genes:
+        baseline_folder_path = os.path.join(cohort_dir, 'baseline')
+        baseline_wall_time = write_baseline_tables(expression_matrix_input, sample_info_input, baseline_folder_path, args)
+        print(f"{genes_num} genes x {samples_num} samples, original implementation: {baseline_wall_time:.2f} s", file=sys.stderr)
+
+    results = []
+    for backend in args.backends:
+        for repeat in range(args.repeats):
+            folder_path = os.path.join(cohort_dir, f'{backend}_{repeat}')
+            options = {
+                'reversal_ratio_threshold': args.threshold,
+                'remove_duplicate_gene_pairs': args.deduplicate,
+                'backend': backend,
+                'n_jobs': args.workers,
+                'plots': args.plots,
+                'pruning': args.pruning
+            }
+            result = benchmark_run(expression_matrix_input, sample_info_input, folder_path, options)
+            result.update({'backend': backend, 'repeat': repeat})
+            if result['error'] is None:
+                result['planted_pairs_recall'] = planted_pairs_recall(folder_path, planted_pairs)
+                if baseline_folder_path is not None:
+                    result['baseline_mismatch'] = compare_outputs(folder_path, baseline_folder_path)
+                    result['matches_baseline'] = result['baseline_mismatch'] is None
+            results.append(result)
+            print(f"{genes_num} genes x {samples_num} samples, {backend} #{repeat}: "
+                  + (f"{result['wall_time']:.2f} s" if result['error'] is None else f"failed: {result['error']}"), file=sys.stderr)
+
+    return {'genes_num': genes_num, 'samples_num': samples_num, 'baseline_wall_time': baseline_wall_time, 'results': results}
+
+def parse_counts(text):
+    """
+    parse_counts: Function to parse a comma-separated list of counts, e.g. "1000,5000,20000"
+    """
+    return [int(value) for value in text.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser(description='DPS-Tool benchmark on synthetic cohorts')
+    parser.add_argument('--genes', type=parse_counts, default=[1000], help='Comma-separated gene counts (optional)')
+    parser.add_argument('--samples', type=parse_counts, default=[100], help='Comma-separated sample counts (optional)')
+    parser.add_argument('--positive_fraction', type=float, default=0.5, help='Fraction of positive samples (optional)')
+    parser.add_argument('--planted_pairs', type=int, default=200, help='Number of planted reversed gene pairs (optional)')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Reversal ratio threshold (optional)')
+    parser.add_argument('--deduplicate', action='store_true', help='Remove duplicate gene pairs (optional)')
+    parser.add_argument('--backends', type=lambda text: text.split(','), default=['tiled', 'bitpacked'], help='Comma-separated pair search backends (optional)')
+    parser.add_argument('--baseline_max_genes', type=int, default=2000, help='Check the outputs against the original implementation up to this number of genes (optional)')
+    parser.add_argument('--pruning', choices=['exact', 'approximate'], default=None, help='Pair search pruning mode (optional)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes (optional)')
+    parser.add_argument('--plots', action='store_true', help='Also time the figures (optional)')
+    parser.add_argument('--repeats', type=int, default=1, help='Number of runs per backend (optional)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic cohorts (optional)')
+    parser.add_argument('--work_dir', default=None, help='Directory of the cohorts and outputs, kept after the run (optional)')
+    parser.add_argument('--output', default=None, help='Path of the JSON results (optional, default: standard output)')
+
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='dps-benchmark-')
+    try:
+        cohorts = [benchmark_cohort(genes_num, samples_num, args, work_dir) for genes_num in args.genes for samples_num in args.samples]
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'settings': {key: value for key, value in vars(args).items() if key not in ('work_dir', 'output')},
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                    'numpy': np.__version__, 'pandas': pd.__version__},
+        'cohorts': cohorts
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,1346 @@
 import argparse
+import contextlib
+import gzip
+import hashlib
+import io
+import json
 import os
+import re
+import shutil
 import sys
+import tempfile
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-from scipy.stats import spearmanr
 
-mpl.rcParams['pdf.fonttype'] = 42 
-plt.rcParams['font.family'] = 'Arial' 
-plt.rcParams['font.size'] = 12
-plt.rcParams['text.color'] = 'black'
+def import_pyplot():
+    """
+    import_pyplot: Function to import matplotlib and apply the figure style; matplotlib is only imported when a figure is plotted
+    
+    Output:
+    plt: matplotlib.pyplot
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+
+    mpl.rcParams['pdf.fonttype'] = 42 
+    plt.rcParams['font.family'] = 'Arial' 
+    plt.rcParams['font.size'] = 12
+    plt.rcParams['text.color'] = 'black'
+    return plt
+
+# Figure file formats and their default resolution (dpi)
+FIGURE_DPI = {'pdf': 600, 'png': 300, 'svg': 300}
+FIGURE_FORMATS = ('pdf', 'png')
+
+# Above this number of samples, the DP_Score bar chart shows the score distribution of each class instead of one bar per sample
+BAR_CHART_MAX_SAMPLES = 1000
+
+def save_figure(plt, folder_path, figure_name, figure_formats=FIGURE_FORMATS, dpi=None):
+    """
+    save_figure: Function to save the current figure in each of the requested formats
+    
+    Input Parameters:
+    figure_name: File name without extension
+    figure_formats: File formats, among 'pdf', 'png' and 'svg'
+    dpi: Resolution of every format; by default 600 dpi for PDF and 300 dpi for PNG and SVG
+    """
+    for figure_format in figure_formats:
+        file_path = os.path.join(folder_path, f"{figure_name}.{figure_format}")
+        plt.savefig(file_path, format=figure_format, dpi=dpi or FIGURE_DPI[figure_format], bbox_inches='tight')
+
+def use_agg_backend():
+    """
+    use_agg_backend: Initializer of the figure rendering processes, which never open a window
+    """
+    import_pyplot().switch_backend('Agg')
+
+def render_figure(plot_function, args, figure_formats=FIGURE_FORMATS, dpi=None):
+    """
+    render_figure: Function to plot and save one figure, then release it
+    
+    Output:
+    wall_time, peak_rss: Rendering time (seconds) and peak memory (MB) of the rendering process
+    """
+    start = time.perf_counter()
+    plot_function(*args, figure_formats=figure_formats, dpi=dpi)
+    import_pyplot().close()
+    return time.perf_counter() - start, peak_rss_mb()
+
+def render_figures(figures, figure_formats=FIGURE_FORMATS, dpi=None, n_jobs=1, recorder=None):
+    """
+    render_figures: Function to plot figures, concurrently in a process pool if n_jobs > 1
+    
+    Input Parameters:
+    figures: List of (plot function, positional arguments)
+    figure_formats, dpi: See save_figure
+    n_jobs: Number of rendering processes
+    recorder: StageRecorder receiving one stage per figure, named after its plot function (optional)
+    """
+    recorder = recorder or StageRecorder()
+    if n_jobs <= 1:
+        for plot_function, args in figures:
+            with recorder.stage(plot_function.__name__):
+                render_figure(plot_function, args, figure_formats, dpi)
+        return
+    
+    with ProcessPoolExecutor(max_workers=min(n_jobs, len(figures)), initializer=use_agg_backend) as executor:
+        futures = [executor.submit(render_figure, plot_function, args, figure_formats, dpi) for plot_function, args in figures]
+        # Raise the first error, e.g. an invalid sample information category
+        for (plot_function, args), future in zip(figures, futures):
+            recorder.add_stage(plot_function.__name__, *future.result())
+
+# Default size limit of the expression matrix cache (bytes)
+CACHE_SIZE_LIMIT = 10 * 1024 ** 3
+
+# ==============================
+#     Stage instrumentation
+# ==============================
+# Minimum number of seconds between two progress file updates within a stage
+PROGRESS_INTERVAL = 1.0
+
+def peak_rss_mb():
+    """
+    peak_rss_mb: Function to get the peak resident memory (MB) of this process and of its finished child processes, or None if unknown
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    unit = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return max(self_rss, children_rss) / unit
+
+class StageRecorder:
+    """
+    StageRecorder: Records the wall time, peak RSS and number of items processed by every stage of a run
+    
+    Input Parameters:
+    progress_file: Path of a JSON progress file (optional), rewritten when a stage starts, progresses or ends
+    
+    The progress file holds the current stage, its fraction done, the elapsed time, the fraction of the time spent
+    in the pair search and the list of stage records (see summary)
+    """
+    def __init__(self, progress_file=None):
+        self.progress_file = progress_file
+        self.stages = []
+        self.start_time = time.perf_counter()
+        self.last_write = 0.0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        stage: Context manager recording one stage; yields the stage record, whose 'items' can be set inside the block
+        """
+        record = {'stage': name, 'status': 'running', 'fraction': 0.0, 'items': None, 'wall_time': None, 'peak_rss_mb': None}
+        self.stages.append(record)
+        self.write()
+        stage_start = time.perf_counter()
+        try:
+            yield record
+            record['status'] = 'done'
+            record['fraction'] = 1.0
+        except BaseException:
+            record['status'] = 'failed'
+            raise
+        finally:
+            record['wall_time'] = time.perf_counter() - stage_start
+            record['peak_rss_mb'] = peak_rss_mb()
+            self.write()
+
+    def add_stage(self, name, wall_time, peak_rss, items=None):
+        """
+        add_stage: Function to record a stage that ran in another process
+        """
+        self.stages.append({'stage': name, 'status': 'done', 'fraction': 1.0, 'items': items, 'wall_time': wall_time, 'peak_rss_mb': peak_rss})
+        self.write()
+
+    def progress(self, record, done, total):
+        """
+        progress: Function to update the fraction done of a running stage (the progress file is rewritten at most every PROGRESS_INTERVAL seconds)
+        """
+        record['fraction'] = done / total if total else 1.0
+        if time.perf_counter() - self.last_write >= PROGRESS_INTERVAL:
+            self.write()
+
+    def summary(self):
+        """
+        summary: Function to summarize the recorded stages
+        """
+        elapsed = time.perf_counter() - self.start_time
+        running = [record for record in self.stages if record['status'] == 'running']
+        pair_search_time = sum(record['wall_time'] or 0.0 for record in self.stages if record['stage'] == 'pair_search')
+        return {
+            'stage': running[-1]['stage'] if running else None,
+            'fraction': running[-1]['fraction'] if running else None,
+            'elapsed': elapsed,
+            'pair_search_time_fraction': pair_search_time / elapsed if elapsed > 0 else 0.0,
+            'stages': self.stages
+        }
+
+    def write(self):
+        """
+        write: Function to write the summary to the progress file, replacing it atomically
+        """
+        if self.progress_file is None:
+            return
+        tmp_file = self.progress_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.summary(), f)
+        os.replace(tmp_file, self.progress_file)
+        self.last_write = time.perf_counter()
+
+# ==============================
+#   Expression matrix loading
+# ==============================
+def file_hash(file_path):
+    """
+    file_hash: Function to compute the SHA-256 hash of a file's content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def directory_size(path):
+    """
+    directory_size: Function to compute the total size of the files in a directory and its subdirectories
+    """
+    return sum(os.path.getsize(os.path.join(root, file_name)) for root, _, file_names in os.walk(path) for file_name in file_names)
+
+def evict_cache_entries(cache_dir, cache_size_limit):
+    """
+    evict_cache_entries: Function to remove the least recently used cache entries until the cache fits into cache_size_limit bytes
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_dir() and not entry.name.startswith('.'):
+            size = directory_size(entry.path)
+            entries.append((entry.stat().st_mtime, size, entry.path))
+    
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= cache_size_limit:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_size -= size
+
+# File extensions of sparse expression matrices: MatrixMarket and scipy.sparse.save_npz
+SPARSE_MATRIX_SUFFIXES = ('.mtx', '.mtx.gz', '.npz')
+
+def is_sparse_matrix_file(expression_matrix_input):
+    """
+    is_sparse_matrix_file: Function to check whether an expression matrix file is a sparse matrix (see SPARSE_MATRIX_SUFFIXES)
+    """
+    return str(expression_matrix_input).lower().endswith(SPARSE_MATRIX_SUFFIXES)
+
+def read_names(file_path):
+    """
+    read_names: Function to read one name per line, e.g. gene symbols or sample names (only the first tab-separated field is kept, as in features.tsv files)
+    """
+    opener = gzip.open if file_path.endswith('.gz') else open
+    with opener(file_path, 'rt', encoding='utf-8') as f:
+        return [line.rstrip('\r\n').split('\t')[0] for line in f if line.strip()]
+
+def load_sparse_expression_matrix(expression_matrix_input, symbols_input, samples_input):
+    """
+    load_sparse_expression_matrix: Function to load a sparse expression matrix without densifying it
+    
+    Input Parameters:
+    expression_matrix_input: Path to a MatrixMarket (.mtx, .mtx.gz) or scipy sparse (.npz) matrix, genes x samples (samples x genes is transposed)
+    symbols_input: Path to the gene symbols, one per line
+    samples_input: Path to the sample names, one per line
+    
+    Output:
+    expr_df: Expression dataframe, the first column being Symbol, then one sparse column (pandas SparseDtype, fill value 0) per sample
+    """
+    import scipy.io
+    import scipy.sparse
+    if symbols_input is None or samples_input is None:
+        raise ValueError("A sparse expression matrix requires a gene symbols file and a sample names file!")
+    symbols = read_names(symbols_input)
+    samples = read_names(samples_input)
+    
+    if expression_matrix_input.lower().endswith('.npz'):
+        matrix = scipy.sparse.load_npz(expression_matrix_input)
+    else:
+        matrix = scipy.io.mmread(expression_matrix_input)
+    return sparse_expression_frame(matrix, symbols, samples)
+
+def sparse_expression_frame(matrix, symbols, samples):
+    """
+    sparse_expression_frame: Function to build a sparse expression dataframe from a scipy sparse matrix without densifying it
+    
+    Input Parameters:
+    matrix: Scipy sparse matrix, genes x samples (samples x genes is transposed)
+    symbols, samples: Gene symbols and sample names
+    
+    Output:
+    expr_df: Expression dataframe, the first column being Symbol, then one sparse column (pandas SparseDtype, fill value 0) per sample
+    """
+    import scipy.sparse
+    matrix = scipy.sparse.csc_matrix(matrix, dtype=np.float64)
+    if matrix.shape != (len(symbols), len(samples)) and matrix.shape == (len(samples), len(symbols)):
+        matrix = matrix.T.tocsc()
+    if matrix.shape != (len(symbols), len(samples)):
+        raise ValueError("The sparse expression matrix does not match the numbers of gene symbols and samples!")
+    matrix.eliminate_zeros()
+    
+    # Columns are built one sample at a time, so that only one dense column exists at once
+    columns = {}
+    column = np.zeros(matrix.shape[0])
+    for sample_idx, sample in enumerate(samples):
+        entries = slice(matrix.indptr[sample_idx], matrix.indptr[sample_idx + 1])
+        column[matrix.indices[entries]] = matrix.data[entries]
+        columns[sample] = pd.arrays.SparseArray(column, fill_value=0.0)
+        column[matrix.indices[entries]] = 0.0
+    expr_df = pd.DataFrame(columns)
+    expr_df.insert(0, 'Symbol', symbols)
+    return expr_df
+
+def is_sparse_frame(expr_df):
+    """
+    is_sparse_frame: Function to check whether all the columns of a dataframe are sparse
+    """
+    return expr_df.shape[1] > 0 and all(isinstance(dtype, pd.SparseDtype) for dtype in expr_df.dtypes)
+
+def expression_values(expr_df):
+    """
+    expression_values: Function to get the values of an expression matrix indexed by Symbol, as a CSR matrix if its columns are sparse
+    """
+    if is_sparse_frame(expr_df):
+        return expr_df.sparse.to_coo().tocsr().astype(np.float64)
+    # Rank matrices keep their compact dtype (see RankMatrix)
+    return expr_df.to_numpy()
+
+def is_sparse_matrix(values):
+    """
+    is_sparse_matrix: Function to check whether values are a scipy sparse matrix (without importing scipy)
+    """
+    return 'scipy.sparse' in sys.modules and sys.modules['scipy.sparse'].issparse(values)
+
+def dense_rows(values, genes):
+    """
+    dense_rows: Function to get the dense rows of the given genes from an array or a sparse matrix
+    """
+    if is_sparse_matrix(values):
+        return values[genes].toarray()
+    return values[genes]
+
+def load_expression_matrix(expression_matrix_input, cache_dir=None, cache_size_limit=CACHE_SIZE_LIMIT, symbols_input=None, samples_input=None):
+    """
+    load_expression_matrix: Function to load the expression matrix, optionally through a binary cache
+    
+    Input Parameters:
+    expression_matrix_input: Path to the expression matrix CSV file, or to a sparse matrix (see load_sparse_expression_matrix)
+    cache_dir: Cache directory; if provided, the parsed matrix is stored there as a column-major binary (keyed on the file content hash)
+               and later loads memory-map it, so only the sample columns actually used are read from disk (CSV files only)
+    cache_size_limit: Maximum total size of the cache directory (bytes), least recently used entries are evicted
+    symbols_input, samples_input: Gene symbols and sample names files of a sparse matrix
+    
+    Output:
+    expr_df: Expression dataframe, the first column being Symbol
+    """
+    if is_sparse_matrix_file(expression_matrix_input):
+        return load_sparse_expression_matrix(expression_matrix_input, symbols_input, samples_input)
+    if cache_dir is None:
+        return pd.read_csv(expression_matrix_input, sep=',')
+    
+    entry_dir = os.path.join(cache_dir, file_hash(expression_matrix_input))
+    if not os.path.isdir(entry_dir):
+        expr_df = pd.read_csv(expression_matrix_input, sep=',')
+        
+        # Only numeric matrices can be cached
+        value_columns = expr_df.columns[1:]
+        if not all(pd.api.types.is_numeric_dtype(dtype) for dtype in expr_df.dtypes.iloc[1:]):
+            return expr_df
+        values = expr_df[value_columns].to_numpy(dtype=np.float64)
+        
+        # Store float32 only when it represents every value exactly, so that comparisons are unchanged
+        values_float32 = values.astype(np.float32)
+        if np.array_equal(values_float32.astype(np.float64), values, equal_nan=True):
+            values = values_float32
+        
+        # Write the entry into a temporary directory first so that a partially written entry is never used
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=cache_dir)
+        np.save(os.path.join(tmp_dir, 'values.npy'), np.asfortranarray(values))
+        with open(os.path.join(tmp_dir, 'index.json'), 'w') as f:
+            json.dump({'columns': [str(column) for column in expr_df.columns],
+                       'symbols': expr_df.iloc[:, 0].tolist()}, f)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another run stored the same matrix in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        evict_cache_entries(cache_dir, cache_size_limit)
+        
+        # The values just parsed are reused instead of reading the new entry back
+        if os.path.isdir(entry_dir):
+            os.utime(entry_dir)
+        return expr_df
+    
+    # Cache hit: mark the entry as recently used and memory-map it
+    os.utime(entry_dir)
+    with open(os.path.join(entry_dir, 'index.json')) as f:
+        index = json.load(f)
+    values = np.load(os.path.join(entry_dir, 'values.npy'), mmap_mode='r')
+    
+    expr_df = pd.DataFrame(values, columns=index['columns'][1:], copy=False)
+    expr_df.insert(0, index['columns'][0], index['symbols'])
+    return expr_df
+
+def expression_frame(expression, symbols=None, samples=None):
+    """
+    expression_frame: Function to wrap an expression matrix held in memory into an expression dataframe without copying its values
+    
+    Input Parameters:
+    expression: Expression matrix (genes x samples), one of:
+                - a dataframe whose first column is Symbol, then one column per sample (as the expression matrix file)
+                - a dataframe of values (columns: sample names) indexed by gene symbol, or with the gene symbols in symbols
+                - a NumPy array or a scipy sparse matrix, with symbols and samples
+    symbols, samples: Gene symbols and sample names, if expression does not hold them
+    
+    Output:
+    expr_df: Expression dataframe, the first column being Symbol
+    """
+    if isinstance(expression, pd.DataFrame):
+        if symbols is None and expression.shape[1] > 0 and expression.columns[0] == 'Symbol':
+            return expression
+        symbols = expression.index if symbols is None else symbols
+        if len(symbols) != expression.shape[0]:
+            raise ValueError("The expression matrix does not match the number of gene symbols!")
+        expr_df = expression.copy(deep=False)
+        expr_df.insert(0, 'Symbol', np.asarray(symbols))
+        return expr_df
+    
+    if symbols is None or samples is None:
+        raise ValueError("An expression matrix without labels requires the gene symbols and the sample names!")
+    symbols, samples = list(symbols), list(samples)
+    if is_sparse_matrix(expression):
+        return sparse_expression_frame(expression, symbols, samples)
+    expression = np.asarray(expression)
+    if expression.shape != (len(symbols), len(samples)):
+        raise ValueError("The expression matrix does not match the numbers of gene symbols and samples!")
+    expr_df = pd.DataFrame(expression, columns=samples, copy=False)
+    expr_df.insert(0, 'Symbol', symbols)
+    return expr_df
+
+# ==============================
+#          Rank matrix
+# ==============================
+# Number of samples ranked at once, which bounds the temporary memory of the ranking
+RANK_CHUNK_SAMPLES = 256
+
+def dense_ranks(values, dtype):
+    """
+    dense_ranks: Function to rank the genes within every sample (column) of an array, equal values sharing a rank
+    
+    Input Parameters:
+    values: Expression values (genes x samples), float64
+    dtype: Dtype of the ranks; missing values stay NaN, so a floating dtype is required if there are any
+    
+    Output:
+    ranks: Dense ranks starting from 0 (genes x samples)
+    """
+    order = np.argsort(values, axis=0, kind='stable')
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    new_value = np.ones(values.shape, dtype=bool)
+    new_value[1:] = sorted_values[1:] != sorted_values[:-1]
+    ranks = np.empty(values.shape, dtype=dtype)
+    np.put_along_axis(ranks, order, np.cumsum(new_value, axis=0) - 1, axis=0)
+    
+    # Missing values are sorted last and compare neither lower nor greater than any value
+    missing = np.isnan(values)
+    if missing.any():
+        ranks[missing] = np.nan
+    return ranks
+
+class RankMatrix:
+    """
+    RankMatrix: Expression matrix stored as the dense rank of every gene within each sample
+    
+    Every step of the pipeline only asks whether one gene is below another within a sample (Gene1 < Gene2 or Gene1 >= Gene2),
+    so the ranks give the same results as the expression values, ties included. Ranks are stored as uint16 up to 65536 genes and
+    as uint32 above; a matrix with missing values keeps them as NaN in float32 ranks (float64 above 2 ** 24 genes).
+    
+    Attributes:
+    ranks: C-contiguous ranks (genes x samples)
+    symbols: Gene symbols
+    samples: Sample names
+    """
+    __slots__ = ('ranks', 'symbols', 'samples')
+
+    def __init__(self, ranks, symbols, samples):
+        self.ranks = ranks
+        self.symbols = pd.Index(symbols)
+        self.samples = pd.Index(samples)
+
+    @classmethod
+    def from_frame(cls, expr_df, samples=None):
+        """
+        from_frame: Function to rank an expression matrix (Symbol, then one column per sample; sparse columns are ranked as dense), a few samples at a time;
+                    with samples, only these sample columns are ranked, and read, in that order
+        """
+        if samples is None:
+            positions = np.arange(1, expr_df.shape[1])
+        else:
+            positions = expr_df.columns.get_indexer(samples)
+            if (positions < 1).any():
+                raise ValueError("Some samples do not exist in the expression matrix!")
+        genes_num, samples_num = expr_df.shape[0], len(positions)
+        # Missing values are looked for a few samples at a time, so that a large matrix is never copied
+        if any(expr_df.iloc[:, positions[start:start + RANK_CHUNK_SAMPLES]].isna().to_numpy().any() for start in range(0, samples_num, RANK_CHUNK_SAMPLES)):
+            dtype = np.float32 if genes_num <= 2 ** 24 else np.float64
+        else:
+            dtype = np.uint16 if genes_num <= 2 ** 16 else np.uint32
+        
+        ranks = np.empty((genes_num, samples_num), dtype=dtype)
+        for start in range(0, samples_num, RANK_CHUNK_SAMPLES):
+            columns = slice(start, start + RANK_CHUNK_SAMPLES)
+            ranks[:, columns] = dense_ranks(expr_df.iloc[:, positions[columns]].to_numpy(dtype=np.float64), dtype)
+        return cls(ranks, expr_df.iloc[:, 0].to_numpy(), expr_df.columns[positions])
+
+    def frame(self):
+        """
+        frame: Function to view the ranks as an expression matrix (Symbol, then one column per sample) without copying them
+        """
+        rank_df = pd.DataFrame(self.ranks, columns=self.samples, copy=False)
+        rank_df.insert(0, 'Symbol', self.symbols.to_numpy())
+        return rank_df
+
+def rank_expression_matrix(expr_df, recorder=None):
+    """
+    rank_expression_matrix: Function to replace the expression values of every sample by the ranks of the genes within the sample, once
+    
+    Input Parameters:
+    expr_df: Expression matrix (Symbol, then one column per sample)
+    recorder: StageRecorder timing the ranking (optional)
+    
+    Output:
+    rank_df: Rank matrix (Symbol, then one column per sample), see RankMatrix; sparse matrices are returned unchanged
+    
+    The pair search, DP_Score, the ImportanceScore and the permutation test only compare genes within a sample, so they all run on the
+    ranks, which hold a quarter of the memory of float64 values (an eighth up to 65536 genes); the caller drops the expression values.
+    """
+    if is_sparse_frame(expr_df.iloc[:, 1:]):
+        return expr_df
+    with (recorder or StageRecorder()).stage('ranks') as stage:
+        rank_df = RankMatrix.from_frame(expr_df).frame()
+        stage['items'] = rank_df.shape[1] - 1
+    return rank_df
+
+
+# Number of genes per row/column tile in the pair search engine
+TILE_SIZE = 256
+
+# Number of samples per packed word in the bit-packed backend
+WORD_BITS = 64
+
+# Number of set bits of every byte value, used when np.bitwise_count is unavailable
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# ==============================
+#      Pair search engine
+# ==============================
+def count_lower_samples(row_values, col_values, negative_samples_num):
+    """
+    count_lower_samples: Function to count the samples in which a row gene is expressed lower than a column gene
+    
+    Input Parameters:
+    row_values: Expression values of the row tile (genes x samples, negative samples first)
+    col_values: Expression values of the column tile (genes x samples, negative samples first)
+    negative_samples_num: Number of negative samples
+    
+    Output:
+    neg_counts: Counts over negative samples (row genes x column genes)
+    pos_counts: Counts over positive samples (row genes x column genes)
+    """
+    row_values_t = np.ascontiguousarray(row_values.T)
+    col_values_t = np.ascontiguousarray(col_values.T)
+    neg_counts = np.zeros((row_values.shape[0], col_values.shape[0]), dtype=np.int64)
+    pos_counts = np.zeros((row_values.shape[0], col_values.shape[0]), dtype=np.int64)
+    
+    # Accumulate one boolean gene x gene block per sample
+    for sample_idx in range(row_values_t.shape[0]):
+        lower = row_values_t[sample_idx][:, None] < col_values_t[sample_idx][None, :]
+        if sample_idx < negative_samples_num:
+            neg_counts += lower
+        else:
+            pos_counts += lower
+    
+    return neg_counts, pos_counts
+
+# Maximum number of (row gene, column gene, sample) entries compared at once by the sparse kernel
+SPARSE_KERNEL_ENTRIES = 1 << 22
+
+# Above this fraction of (row gene, column gene, sample) comparisons with both genes stored, the sparse kernel compares dense tiles instead
+SPARSE_KERNEL_MAX_FILL = 0.01
+
+def count_lower_nonzero(row_values, col_values):
+    """
+    count_lower_nonzero: Function to count the samples in which a row gene is lower than a column gene, over the samples where both are stored
+    
+    Input Parameters:
+    row_values, col_values: CSC tiles (genes x samples) of the same samples
+    
+    Output:
+    counts: Counts (row genes x column genes)
+    """
+    rows_num, cols_num = row_values.shape[0], col_values.shape[0]
+    counts = np.zeros(rows_num * cols_num, dtype=np.int64)
+    row_entries_num = np.diff(row_values.indptr)
+    col_entries_num = np.diff(col_values.indptr)
+    
+    # Samples are grouped so that the pairs of stored entries of a group stay below SPARSE_KERNEL_ENTRIES
+    pairs_cumsum = np.concatenate([[0], np.cumsum(row_entries_num * col_entries_num)])
+    bounds = np.unique(np.concatenate([np.searchsorted(pairs_cumsum, np.arange(0, pairs_cumsum[-1], SPARSE_KERNEL_ENTRIES), side='right') - 1,
+                                       [len(row_entries_num)]]))
+    for group_start, group_stop in zip(bounds[:-1], bounds[1:]):
+        # Every stored row entry of the group is repeated once per stored column entry of its sample
+        row_entries = np.arange(row_values.indptr[group_start], row_values.indptr[group_stop])
+        entry_samples = np.repeat(np.arange(group_start, group_stop), row_entries_num[group_start:group_stop])
+        repeats = col_entries_num[entry_samples]
+        row_entries = np.repeat(row_entries, repeats)
+        offsets = np.arange(len(row_entries)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        col_entries = np.repeat(col_values.indptr[entry_samples], repeats) + offsets
+        
+        lower = row_values.data[row_entries] < col_values.data[col_entries]
+        counts += np.bincount(row_values.indices[row_entries[lower]] * cols_num + col_values.indices[col_entries[lower]], minlength=rows_num * cols_num)
+    
+    return counts.reshape(rows_num, cols_num)
+
+def count_lower_samples_sparse(row_values, col_values, negative_samples_num):
+    """
+    count_lower_samples_sparse: Sparse version of count_lower_samples, for CSR tiles
+    
+    A sample where both genes are zero never counts, so zero/zero ties are skipped in bulk; a zero row gene is lower than a
+    positive column gene, and a negative row gene is lower than a zero column gene, which are counted with sparse products of the
+    stored entries. Only the samples where both genes are stored are compared one by one.
+    """
+    import scipy.sparse
+    row_values = scipy.sparse.csc_matrix(row_values)
+    col_values = scipy.sparse.csc_matrix(col_values)
+    stored_pairs_num = np.dot(np.diff(row_values.indptr).astype(np.int64), np.diff(col_values.indptr))
+    if stored_pairs_num > SPARSE_KERNEL_MAX_FILL * row_values.shape[0] * col_values.shape[0] * row_values.shape[1]:
+        # Dense tiles are faster when most genes of the tiles are expressed
+        return count_lower_samples(row_values.toarray(), col_values.toarray(), negative_samples_num)
+    
+    counts = []
+    for segment in (slice(0, negative_samples_num), slice(negative_samples_num, row_values.shape[1])):
+        row_segment = row_values[:, segment]
+        col_segment = col_values[:, segment]
+        row_stored = row_segment.copy()
+        row_stored.data = np.ones_like(row_stored.data)
+        col_stored = col_segment.copy()
+        col_stored.data = np.ones_like(col_stored.data)
+        row_negative = row_segment.copy()
+        row_negative.data = (row_negative.data < 0).astype(np.float64)
+        col_positive = col_segment.copy()
+        col_positive.data = (col_positive.data > 0).astype(np.float64)
+        
+        # Zero row gene and positive column gene
+        zero_lower = np.asarray(col_positive.sum(axis=1)).T - (row_stored @ col_positive.T).toarray()
+        # Negative row gene and zero column gene
+        zero_lower += np.asarray(row_negative.sum(axis=1)) - (row_negative @ col_stored.T).toarray()
+        counts.append(np.rint(zero_lower).astype(np.int64) + count_lower_nonzero(row_segment, col_segment))
+    
+    return counts[0], counts[1]
+
+def popcount(words):
+    """
+    popcount: Function to count the set bits of every uint64 word
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return POPCOUNT_TABLE[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+def pack_sample_bits(lower):
+    """
+    pack_sample_bits: Function to pack boolean comparison results along the sample axis into uint64 words
+    
+    Input Parameters:
+    lower: Boolean array whose last axis holds at most 64 samples
+    
+    Output:
+    words: uint64 array with the last axis packed into one word (sample k stored in bit k)
+    """
+    packed = np.packbits(lower, axis=-1, bitorder='little')
+    pad = 8 - packed.shape[-1]
+    if pad:
+        packed = np.concatenate([packed, np.zeros(packed.shape[:-1] + (pad,), dtype=np.uint8)], axis=-1)
+    return packed.view(np.uint64)[..., 0]
+
+def pack_comparison_bits(row_values, col_values, negative_samples_num):
+    """
+    pack_comparison_bits: Function to store, for each row gene, its per-sample comparisons against the column genes as packed bitsets
+    
+    Input Parameters:
+    row_values: Expression values of the row tile (genes x samples, negative samples first)
+    col_values: Expression values of the column tile (genes x samples, negative samples first)
+    negative_samples_num: Number of negative samples
+    
+    Output:
+    bits: uint64 array (row genes x column genes x words), one segment of words for negative samples followed by one for positive samples
+    neg_words_num: Number of words in the negative segment
+    """
+    samples_num = row_values.shape[1]
+    words = []
+    for segment_start, segment_stop in [(0, negative_samples_num), (negative_samples_num, samples_num)]:
+        # Only 64 samples are compared at once, so the boolean block stays small
+        for word_start in range(segment_start, segment_stop, WORD_BITS):
+            word_stop = min(word_start + WORD_BITS, segment_stop)
+            lower = row_values[:, None, word_start:word_stop] < col_values[None, :, word_start:word_stop]
+            words.append(pack_sample_bits(lower))
+    
+    neg_words_num = -(-negative_samples_num // WORD_BITS)
+    return np.stack(words, axis=-1), neg_words_num
+
+def count_lower_samples_bitpacked(row_values, col_values, negative_samples_num):
+    """
+    count_lower_samples_bitpacked: Bit-packed version of count_lower_samples, counting with popcounts
+    """
+    bits, neg_words_num = pack_comparison_bits(row_values, col_values, negative_samples_num)
+    counts = popcount(bits)
+    neg_counts = counts[..., :neg_words_num].sum(axis=-1, dtype=np.int64)
+    pos_counts = counts[..., neg_words_num:].sum(axis=-1, dtype=np.int64)
+    return neg_counts, pos_counts
+
+# Sample comparison kernels of the pair search backends
+PAIR_COUNT_KERNELS = {
+    'tiled': count_lower_samples,
+    'bitpacked': count_lower_samples_bitpacked
+}
+
+# Available pair search backends
+PAIR_SEARCH_BACKENDS = list(PAIR_COUNT_KERNELS) + ['reference']
+
+def reversal_ratios(neg_counts, pos_counts, negative_samples_num, positive_samples_num):
+    """
+    reversal_ratios: Function to convert per-class counts into signed reversal ratios
+    
+    Input Parameters:
+    neg_counts: Number of negative samples in which Gene1 is lower than Gene2
+    pos_counts: Number of positive samples in which Gene1 is lower than Gene2
+    negative_samples_num: Number of negative samples
+    positive_samples_num: Number of positive samples
+    
+    Output:
+    ratios: Signed reversal ratios (negative values mean that the genes have to be swapped)
+    """
+    return neg_counts / negative_samples_num - pos_counts / positive_samples_num
+
+def search_pair_block(values, row_genes, col_genes, negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend='tiled', tile_size=TILE_SIZE):
+    """
+    search_pair_block: Function to search reversed gene pairs between a block of row genes and a set of column genes
+    
+    Input Parameters:
+    values: Expression values (genes x samples, negative samples first), an array or a CSR matrix
+    row_genes: Sorted indices of the row genes
+    col_genes: Sorted indices of the column genes
+    negative_samples_num: Number of negative samples
+    positive_samples_num: Number of positive samples
+    reversal_ratio_threshold: Reversal proportion threshold
+    backend: Sample comparison kernel, 'tiled' or 'bitpacked'
+    tile_size: Number of column genes compared at once
+    
+    Output:
+    row_genes, col_genes: Gene indices of the pairs above the threshold (row gene index < column gene index), in row-major order
+    neg_counts, pos_counts: Per-class counts of the samples in which the row gene is lower than the column gene
+    """
+    # Sparse matrices have their own kernel for both backends
+    count_kernel = count_lower_samples_sparse if is_sparse_matrix(values) else PAIR_COUNT_KERNELS[backend]
+    row_values = values[row_genes]
+    neg_counts = np.empty((len(row_genes), len(col_genes)), dtype=np.int64)
+    pos_counts = np.empty((len(row_genes), len(col_genes)), dtype=np.int64)
+    
+    # Compare the row block with the column genes tile by tile
+    for col_start in range(0, len(col_genes), tile_size):
+        cols = slice(col_start, col_start + tile_size)
+        neg_counts[:, cols], pos_counts[:, cols] = count_kernel(row_values, values[col_genes[cols]], negative_samples_num)
+    
+    # Keep each unordered pair once and filter by threshold
+    ratios = reversal_ratios(neg_counts, pos_counts, negative_samples_num, positive_samples_num)
+    keep = (np.abs(ratios) > reversal_ratio_threshold) & (col_genes[None, :] > row_genes[:, None])
+    rows, cols = np.nonzero(keep)
+    
+    return row_genes[rows], col_genes[cols], neg_counts[rows, cols], pos_counts[rows, cols]
+
+def concatenate_pair_blocks(blocks):
+    """
+    concatenate_pair_blocks: Function to merge (row_genes, col_genes, neg_counts, pos_counts) blocks in order
+    """
+    if not blocks:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, empty
+    return tuple(np.concatenate(arrays) for arrays in zip(*blocks))
+
+def iter_gene_rows(values, row_genes, col_genes, negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend='tiled', tile_size=TILE_SIZE):
+    """
+    iter_gene_rows: Generator searching the reversed gene pairs of the given row genes against the column genes below them, one row block at a time
+    
+    Input Parameters:
+    values: Expression values (genes x samples, negative samples first)
+    row_genes: Sorted indices of the row genes
+    col_genes: Sorted indices of the column genes
+    (other parameters: see search_pair_block)
+    
+    Output:
+    Yields (row_genes, col_genes, neg_counts, pos_counts) of each row block, see search_pair_block
+    """
+    for block_start in range(0, len(row_genes), tile_size):
+        block_genes = row_genes[block_start:block_start + tile_size]
+        block_col_genes = col_genes[np.searchsorted(col_genes, block_genes[0], side='right'):]
+        yield search_pair_block(values, block_genes, block_col_genes,
+                                negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend, tile_size)
+
+def search_gene_rows(values, row_genes, col_genes, negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend='tiled', tile_size=TILE_SIZE):
+    """
+    search_gene_rows: Function to search the reversed gene pairs of the given row genes against the column genes below them, see iter_gene_rows
+    """
+    return concatenate_pair_blocks(list(iter_gene_rows(values, row_genes, col_genes, negative_samples_num, positive_samples_num,
+                                                       reversal_ratio_threshold, backend, tile_size)))
+
+def row_pairs_num(row_genes, col_genes):
+    """
+    row_pairs_num: Function to count the pairs compared for each row gene, which is paired with the column genes below it
+    """
+    return len(col_genes) - np.searchsorted(col_genes, row_genes, side='right')
+
+# Number of search blocks submitted per worker process ahead of the block being merged, which bounds the results held by the parent
+PAIR_SEARCH_WINDOW = 2
+
+def ordered_pool_results(executor, function, tasks, window, *args):
+    """
+    ordered_pool_results: Generator running function(task, *args) in a process pool, yielding (task, result) in task order
+    
+    Input Parameters:
+    executor: Process pool
+    function: Worker function
+    tasks: List of tasks
+    window: Maximum number of submitted tasks whose results are not yielded yet
+    args: Other arguments of function
+    
+    Output:
+    Yields (task, result) pairs; results are requested only as the window moves, so the parent holds at most window results at once
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append((task, executor.submit(function, task, *args)))
+        if len(pending) >= window:
+            task, future = pending.popleft()
+            yield task, future.result()
+    while pending:
+        task, future = pending.popleft()
+        yield task, future.result()
+
+# Expression matrix attached from shared memory in pair search worker processes
+WORKER_STATE = {}
+
+def attach_shared_values(shm_name, shape, dtype):
+    """
+    attach_shared_values: Process pool initializer attaching the shared expression matrix without copying it
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    WORKER_STATE['shm'] = shm
+    WORKER_STATE['values'] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def set_worker_values(values):
+    """
+    set_worker_values: Process pool initializer receiving a sparse expression matrix, which is copied once per worker
+    """
+    WORKER_STATE['values'] = values
+
+def search_shard(shard, negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend, tile_size):
+    """
+    search_shard: Worker function searching one (row genes, column genes) block of the shared expression matrix
+    """
+    return search_gene_rows(WORKER_STATE['values'], shard[0], shard[1],
+                            negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend, tile_size)
+
+def gene_set_searches(all_genes, gene_set=None):
+    """
+    gene_set_searches: Function to list the (row genes, column genes) searches covering the pairs of the whole matrix or of a gene set
+    """
+    if gene_set is None:
+        return [(all_genes, all_genes)]
+    
+    # Gene set pairs are either (set gene, any gene below it) or (other gene, set gene below it), so only set rows and set columns are compared
+    in_gene_set = np.zeros(len(all_genes), dtype=bool)
+    in_gene_set[gene_set] = True
+    return [(gene_set, all_genes), (all_genes[~in_gene_set], gene_set)]
+
+def iter_pair_search(values, negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend='tiled', tile_size=TILE_SIZE, n_jobs=1, gene_set=None, on_progress=None):
+    """
+    iter_pair_search: Generator searching reversed gene pairs with gene x gene tiles, yielding results as tiles complete
+    
+    Input Parameters:
+    values: Expression values (genes x samples, negative samples first)
+    negative_samples_num: Number of negative samples
+    positive_samples_num: Number of positive samples
+    reversal_ratio_threshold: Reversal proportion threshold
+    backend: Sample comparison kernel, 'tiled' or 'bitpacked'
+    tile_size: Number of genes per tile
+    n_jobs: Number of worker processes sharing the expression matrix
+    gene_set: Sorted gene indices; if provided, only pairs with at least one gene in the set are searched
+    on_progress: If provided, called with (pairs compared so far, pairs to compare) before each block is yielded
+    
+    Output:
+    Yields (row_genes, col_genes, neg_counts, pos_counts) blocks, see search_pair_block; blocks are in row-major order unless gene_set is provided
+    """
+    if not is_sparse_matrix(values):
+        values = np.ascontiguousarray(values)
+    searches = gene_set_searches(np.arange(values.shape[0]), gene_set)
+    
+    # Progress is counted in compared pairs
+    pairs_total = sum(int(row_pairs_num(row_genes, col_genes).sum()) for row_genes, col_genes in searches)
+    pairs_done = 0
+    def report(row_genes, col_genes):
+        nonlocal pairs_done
+        pairs_done += int(row_pairs_num(row_genes, col_genes).sum())
+        if on_progress is not None:
+            on_progress(pairs_done, pairs_total)
+    
+    if n_jobs <= 1:
+        for row_genes, col_genes in searches:
+            blocks = iter_gene_rows(values, row_genes, col_genes, negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend, tile_size)
+            for block_start, block in zip(range(0, len(row_genes), tile_size), blocks):
+                report(row_genes[block_start:block_start + tile_size], col_genes)
+                yield block
+        return
+    
+    # Place the expression matrix in shared memory once so that workers never copy it (sparse matrices are sent to every worker)
+    shm = None
+    if is_sparse_matrix(values):
+        initializer, initargs = set_worker_values, (values,)
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+        initializer, initargs = attach_shared_values, (shm.name, values.shape, values.dtype)
+    try:
+        # One task per row block keeps the pool balanced, and merging the blocks in row order restores the serial result; only a window of
+        # blocks is in flight, so the parent holds about as many pairs as the serial search however many pairs pass the threshold
+        shards = [(row_genes[block_start:block_start + tile_size], col_genes) for row_genes, col_genes in searches
+                  for block_start in range(0, len(row_genes), tile_size)]
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=initializer, initargs=initargs) as executor:
+            for shard, block in ordered_pool_results(executor, search_shard, shards, n_jobs * PAIR_SEARCH_WINDOW,
+                                                     negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend, tile_size):
+                report(*shard)
+                yield block
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+def row_major_order(row_genes, col_genes, neg_counts, pos_counts):
+    """
+    row_major_order: Function to sort pairs by (row gene, column gene), the order of a serial whole-matrix search
+    """
+    order = np.lexsort((col_genes, row_genes))
+    return row_genes[order], col_genes[order], neg_counts[order], pos_counts[order]
+
+def top_pairs(pairs, max_pairs, negative_samples_num, positive_samples_num):
+    """
+    top_pairs: Function to keep the max_pairs pairs with the highest reversal ratio, ties broken by row-major position
+    """
+    if len(pairs[0]) <= max_pairs:
+        return pairs
+    ratios = np.abs(reversal_ratios(pairs[2], pairs[3], negative_samples_num, positive_samples_num))
+    order = np.lexsort((pairs[1], pairs[0], -ratios))[:max_pairs]
+    return tuple(array[order] for array in pairs)
+
+def select_top_pairs(blocks, max_pairs, negative_samples_num, positive_samples_num):
+    """
+    select_top_pairs: Function to stream over search blocks while keeping only the top max_pairs pairs in a bounded buffer
+    
+    Input Parameters:
+    blocks: Iterable of (row_genes, col_genes, neg_counts, pos_counts) blocks
+    max_pairs: Maximum number of pairs to keep
+    negative_samples_num: Number of negative samples
+    positive_samples_num: Number of positive samples
+    
+    Output:
+    pairs: (row_genes, col_genes, neg_counts, pos_counts) of the top pairs
+    pairs_num: Number of pairs above the threshold seen in the stream
+    """
+    pairs = concatenate_pair_blocks([])
+    pairs_num = 0
+    for block in blocks:
+        pairs_num += len(block[0])
+        pairs = concatenate_pair_blocks([pairs, block])
+        
+        # Compact once the buffer holds twice the requested number of pairs, so memory stays bounded by max_pairs and the tile size
+        if len(pairs[0]) >= 2 * max_pairs:
+            pairs = top_pairs(pairs, max_pairs, negative_samples_num, positive_samples_num)
+    
+    return top_pairs(pairs, max_pairs, negative_samples_num, positive_samples_num), pairs_num
+
+def observe_blocks(blocks, on_block):
+    """
+    observe_blocks: Generator passing search blocks through after handing each one to on_block
+    """
+    for block in blocks:
+        on_block(block)
+        yield block
+
+# Number of per-sample expression quantiles used as cutpoints by the pruning bounds
+PRUNING_CUTPOINTS = 16
+
+# Approximate pruning: samples per class screened before the exact comparison, and margin below the threshold (in standard errors) still compared exactly
+PRUNING_SUBSAMPLE = 32
+PRUNING_MARGIN_SE = 2.0
+
+# Approximate pruning: fraction of the pairs compared on all samples at random, to estimate the recall
+PRUNING_RECALL_FRACTION = 0.01
+
+# Number of gene pairs compared at once on all samples after the approximate screening
+PRUNING_CHUNK_PAIRS = 65536
+
+# Pruning modes of the pair search
+PRUNING_MODES = ('exact', 'approximate')
+
+def pruning_summary(values, negative_samples_num, positive_samples_num, pruning='exact', seed=0):
+    """
+    pruning_summary: Function to summarize every gene by the number of samples of each class where it is below or above per-sample cutpoints
+    
+    Input Parameters:
+    values: Expression values (genes x samples, negative samples first)
+    negative_samples_num: Number of negative samples
+    positive_samples_num: Number of positive samples
+    pruning: 'exact' or 'approximate'
+    seed: Random seed of the samples screened by the approximate mode
+    
+    Output:
+    summary: Dictionary of the counts 'less', 'greater' and 'greater_equal' (genes x 2 classes x cutpoints), the expression 'level' of every gene,
+             the class sizes 'samples_num', and the screened sample columns 'subsample' (None unless the approximate mode leaves samples out)
+    
+    For any per-sample cutpoint q, the samples where x_i < x_j are among those where x_i < q or x_j > q, and include those where x_i < q <= x_j,
+    so the counts bound the number of samples of each class where x_i < x_j from above and below, whatever the missing values and ties.
+    """
+    if pruning not in PRUNING_MODES:
+        raise ValueError("Invalid pruning mode, please enter one of: " + ", ".join(PRUNING_MODES) + "!")
+    genes_num = values.shape[0]
+    classes = [slice(0, negative_samples_num), slice(negative_samples_num, negative_samples_num + positive_samples_num)]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        cutpoints = np.nanquantile(values, np.arange(1, PRUNING_CUTPOINTS + 1) / (PRUNING_CUTPOINTS + 1), axis=0)
+    
+    summary = {key: np.empty((genes_num, 2, PRUNING_CUTPOINTS), dtype=np.int64) for key in ('less', 'greater', 'greater_equal')}
+    for cutpoint_idx, cutpoint in enumerate(cutpoints):
+        for key, compare in (('less', np.less), ('greater', np.greater), ('greater_equal', np.greater_equal)):
+            below_or_above = compare(values, cutpoint[None, :])
+            for class_idx, columns in enumerate(classes):
+                summary[key][:, class_idx, cutpoint_idx] = below_or_above[:, columns].sum(axis=1)
+    summary['level'] = -summary['less'].sum(axis=(1, 2))
+    summary['samples_num'] = (negative_samples_num, positive_samples_num)
+    
+    summary['subsample'] = None
+    if pruning == 'approximate' and max(negative_samples_num, positive_samples_num) > PRUNING_SUBSAMPLE:
+        rng = np.random.default_rng(seed)
+        summary['subsample'] = np.concatenate([np.sort(rng.permutation(class_samples_num)[:PRUNING_SUBSAMPLE]) + class_start
+                                               for class_start, class_samples_num in ((0, negative_samples_num), (negative_samples_num, positive_samples_num))])
+    return summary
+
+def ratio_bound(upper_row_less, lower_row_less, col_greater, col_greater_equal, samples_num):
+    """
+    ratio_bound: Function to bound the reversal ratio of (row gene, column gene) pairs from the cutpoint counts, see pruning_summary
+    
+    Input Parameters:
+    upper_row_less, lower_row_less: 'less' counts of the row genes used for the upper and lower count bounds (the same counts for a single row gene)
+    col_greater, col_greater_equal: 'greater' and 'greater_equal' counts of the column genes (... x 2 classes x cutpoints)
+    samples_num: Numbers of negative and positive samples
+    
+    Output:
+    bound: Upper bound of the absolute reversal ratio of every pair
+    """
+    upper, lower = [], []
+    for class_idx, class_samples_num in enumerate(samples_num):
+        upper.append(np.minimum((upper_row_less[..., class_idx, :] + col_greater[..., class_idx, :]).min(axis=-1), class_samples_num) / class_samples_num)
+        lower.append(np.maximum((lower_row_less[..., class_idx, :] + col_greater_equal[..., class_idx, :]).max(axis=-1) - class_samples_num, 0) / class_samples_num)
+    return np.maximum(upper[0] - lower[1], upper[1] - lower[0])
 
-# ==============================
-#       Reverse_gene_pairs
-# ==============================
-def Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, reversal_ratio_threshold, remove_duplicate_gene_pairs, gene_set_input):
+def candidate_columns(summary, row_genes, col_genes, reversal_ratio_threshold):
     """
-    Reverse_gene_pairs: Function to extract reversed gene pairs
+    candidate_columns: Function to select the column genes that may reach the threshold with at least one gene of a row block
+    """
+    bound = ratio_bound(summary['less'][row_genes].max(axis=0), summary['less'][row_genes].min(axis=0),
+                        summary['greater'][col_genes], summary['greater_equal'][col_genes], summary['samples_num'])
+    
+    # A small tolerance keeps the columns whose bound equals the threshold up to rounding
+    return col_genes[bound > reversal_ratio_threshold - 1e-9]
+
+def pair_search_blocks(summary, row_genes, col_genes, reversal_ratio_threshold, tile_size=TILE_SIZE):
+    """
+    pair_search_blocks: Function to split a search into row blocks of genes with close expression levels, each with the column genes it may pair with
     
     Input Parameters:
-    expr_df: An expression matrix sorted by Symbol, negative samples, and positive samples
+    summary: See pruning_summary
+    row_genes: Sorted indices of the row genes
+    col_genes: Sorted indices of the column genes
+    reversal_ratio_threshold: Reversal proportion threshold
+    tile_size: Number of genes per row block
+    
+    Output:
+    blocks: List of (block row genes, candidate column genes, pairs of the search space covered by the block)
+    """
+    blocks = []
+    level_order = row_genes[np.argsort(summary['level'][row_genes], kind='stable')]
+    for block_start in range(0, len(level_order), tile_size):
+        block_genes = np.sort(level_order[block_start:block_start + tile_size])
+        block_col_genes = col_genes[np.searchsorted(col_genes, block_genes[0], side='right'):]
+        blocks.append((block_genes, candidate_columns(summary, block_genes, block_col_genes, reversal_ratio_threshold),
+                       int(row_pairs_num(block_genes, col_genes).sum())))
+    return blocks
+
+def count_pair_samples(values, row_genes, col_genes, negative_samples_num, chunk_pairs=PRUNING_CHUNK_PAIRS):
+    """
+    count_pair_samples: Function to count, pair by pair, the negative and positive samples in which the row gene is lower than the column gene
+    """
+    neg_counts = np.empty(len(row_genes), dtype=np.int64)
+    pos_counts = np.empty(len(row_genes), dtype=np.int64)
+    for start in range(0, len(row_genes), chunk_pairs):
+        lower = values[row_genes[start:start + chunk_pairs]] < values[col_genes[start:start + chunk_pairs]]
+        neg_counts[start:start + chunk_pairs] = lower[:, :negative_samples_num].sum(axis=1)
+        pos_counts[start:start + chunk_pairs] = lower[:, negative_samples_num:].sum(axis=1)
+    return neg_counts, pos_counts
+
+def screen_pair_block(values, row_genes, col_genes, negative_samples_num, positive_samples_num, reversal_ratio_threshold, subsample,
+                      backend='tiled', tile_size=TILE_SIZE):
+    """
+    screen_pair_block: Function to search a row block in the approximate mode: pairs are first compared on a subsample of every class,
+                       and only those whose estimated ratio is within a margin of the threshold are compared on all samples
+    
+    Input Parameters:
+    subsample: Sorted sample columns screened, negative samples first (see pruning_summary)
+    (other parameters: see search_pair_block)
+    
+    Output:
+    block: (row_genes, col_genes, neg_counts, pos_counts), see search_pair_block
+    stats: Pairs compared on all samples, pairs found, pairs checked at random and checked pairs above the threshold that the screening missed
+    """
+    subsample_negative_num = int(np.searchsorted(subsample, negative_samples_num))
+    subsample_positive_num = len(subsample) - subsample_negative_num
+    margin = PRUNING_MARGIN_SE * np.sqrt(0.25 / subsample_negative_num + 0.25 / subsample_positive_num)
+    
+    # 1. Screen the block on the subsample
+    screen_row_values = values[row_genes][:, subsample]
+    screen_col_values = values[col_genes][:, subsample]
+    count_kernel = PAIR_COUNT_KERNELS[backend]
+    neg_estimate = np.empty((len(row_genes), len(col_genes)), dtype=np.int64)
+    pos_estimate = np.empty((len(row_genes), len(col_genes)), dtype=np.int64)
+    for col_start in range(0, len(col_genes), tile_size):
+        cols = slice(col_start, col_start + tile_size)
+        neg_estimate[:, cols], pos_estimate[:, cols] = count_kernel(screen_row_values, screen_col_values[cols], subsample_negative_num)
+    estimate = np.abs(reversal_ratios(neg_estimate, pos_estimate, subsample_negative_num, subsample_positive_num))
+    below = col_genes[None, :] > row_genes[:, None]
+    likely = (estimate > reversal_ratio_threshold - margin) & below
+    
+    # 2. Check a random fraction of the pairs on all samples, seeded by the block so that the report does not depend on n_jobs
+    rng = np.random.default_rng([int(row_genes[0]), len(row_genes), len(col_genes)])
+    checked = (rng.random(likely.shape) < PRUNING_RECALL_FRACTION) & below
+    rows, cols = np.nonzero(checked)
+    checked_num = len(rows)
+    neg_counts, pos_counts = count_pair_samples(values, row_genes[rows], col_genes[cols], negative_samples_num)
+    missed = (np.abs(reversal_ratios(neg_counts, pos_counts, negative_samples_num, positive_samples_num)) > reversal_ratio_threshold) & ~likely[rows, cols]
+    
+    # 3. Compare the likely pairs on all samples
+    rows, cols = np.nonzero(likely)
+    neg_counts, pos_counts = count_pair_samples(values, row_genes[rows], col_genes[cols], negative_samples_num)
+    keep = np.abs(reversal_ratios(neg_counts, pos_counts, negative_samples_num, positive_samples_num)) > reversal_ratio_threshold
+    
+    stats = np.array([len(rows) + checked_num, keep.sum(), checked_num, missed.sum()], dtype=np.int64)
+    return (row_genes[rows[keep]], col_genes[cols[keep]], neg_counts[keep], pos_counts[keep]), stats
+
+def search_pruned_blocks(values, blocks, negative_samples_num, positive_samples_num, reversal_ratio_threshold, subsample=None, backend='tiled', tile_size=TILE_SIZE):
+    """
+    search_pruned_blocks: Function to search (block row genes, candidate column genes, covered pairs) blocks, see pair_search_blocks
+    
+    Input Parameters:
+    subsample: Screened sample columns of the approximate mode, or None to compare the candidate pairs on all samples
+    (other parameters: see search_pair_block)
+    
+    Output:
+    results: List of (block, stats), see screen_pair_block
+    """
+    results = []
+    for block_genes, block_col_genes, _ in blocks:
+        if subsample is None:
+            block = search_pair_block(values, block_genes, block_col_genes, negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend, tile_size)
+            stats = np.array([row_pairs_num(block_genes, block_col_genes).sum(), len(block[0]), 0, 0], dtype=np.int64)
+            results.append((block, stats))
+        else:
+            results.append(screen_pair_block(values, block_genes, block_col_genes, negative_samples_num, positive_samples_num, reversal_ratio_threshold,
+                                             subsample, backend, tile_size))
+    return results
+
+def search_pruned_shard(blocks, negative_samples_num, positive_samples_num, reversal_ratio_threshold, subsample, backend, tile_size):
+    """
+    search_pruned_shard: Worker function searching a shard of pruned blocks of the shared expression matrix
+    """
+    return search_pruned_blocks(WORKER_STATE['values'], blocks, negative_samples_num, positive_samples_num, reversal_ratio_threshold, subsample, backend, tile_size)
+
+def iter_pruned_pair_search(values, negative_samples_num, positive_samples_num, reversal_ratio_threshold, pruning='exact', backend='tiled', tile_size=TILE_SIZE,
+                            n_jobs=1, gene_set=None, on_progress=None, on_pruning=None):
+    """
+    iter_pruned_pair_search: Generator searching reversed gene pairs while skipping the pairs that cannot reach the threshold
+    
+    Input Parameters:
+    values: Expression values (genes x samples, negative samples first), an array
+    pruning: 'exact' or 'approximate'
+        - exact: Genes are grouped into row blocks of close expression levels, and every row block is only compared with the column genes whose
+                 cutpoint bound (see pruning_summary) may reach the threshold, so the results are unchanged; if the bounds do not save any
+                 comparison, the row blocks of iter_pair_search are kept
+        - approximate: Pairs are also screened on PRUNING_SUBSAMPLE samples per class and only compared on all samples if their estimated
+                       ratio is within PRUNING_MARGIN_SE standard errors of the threshold; pairs above the threshold may be missed
+    on_pruning: If provided, called at the end with a report: the mode, whether the bounds were used, the pairs of the search space, the pairs
+                compared on all samples and their fraction, and the recall estimated from the randomly checked pairs (1 in the exact mode)
+    (other parameters: see iter_pair_search)
+    
+    Output:
+    Yields (row_genes, col_genes, neg_counts, pos_counts) blocks, see search_pair_block, in no particular order
+    """
+    values = np.ascontiguousarray(values)
+    all_genes = np.arange(values.shape[0])
+    summary = pruning_summary(values, negative_samples_num, positive_samples_num, pruning)
+    
+    # 1. Row blocks of close expression levels with their candidate columns, unless they compare as many pairs as the plain row blocks
+    blocks = []
+    for row_genes, col_genes in gene_set_searches(all_genes, gene_set):
+        blocks.extend(pair_search_blocks(summary, row_genes, col_genes, reversal_ratio_threshold, tile_size))
+    plain_blocks = []
+    for row_genes, col_genes in gene_set_searches(all_genes, gene_set):
+        for block_start in range(0, len(row_genes), tile_size):
+            block_genes = row_genes[block_start:block_start + tile_size]
+            block_col_genes = col_genes[np.searchsorted(col_genes, block_genes[0], side='right'):]
+            plain_blocks.append((block_genes, block_col_genes, int(row_pairs_num(block_genes, col_genes).sum())))
+    bounded = sum(len(block[0]) * len(block[1]) for block in blocks) < sum(len(block[0]) * len(block[1]) for block in plain_blocks)
+    if not bounded:
+        blocks = plain_blocks
+    
+    # 2. Search the blocks, in a process pool sharing the expression matrix if n_jobs > 1
+    pairs_total = sum(block[2] for block in blocks)
+    pairs_done = 0
+    stats = np.zeros(4, dtype=np.int64)
+    def report(results, shard):
+        nonlocal pairs_done, stats
+        pairs_done += sum(block[2] for block in shard)
+        for _, block_stats in results:
+            stats += block_stats
+        if on_progress is not None:
+            on_progress(pairs_done, pairs_total)
+    
+    search_args = (negative_samples_num, positive_samples_num, reversal_ratio_threshold, summary['subsample'], backend, tile_size)
+    if n_jobs <= 1:
+        for block in blocks:
+            results = search_pruned_blocks(values, [block], *search_args)
+            report(results, [block])
+            yield results[0][0]
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        try:
+            np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+            # One task per block, with only a window of blocks in flight as in iter_pair_search
+            shards = [[block] for block in blocks]
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=attach_shared_values, initargs=(shm.name, values.shape, values.dtype)) as executor:
+                for shard, results in ordered_pool_results(executor, search_pruned_shard, shards, n_jobs * PAIR_SEARCH_WINDOW, *search_args):
+                    report(results, shard)
+                    yield results[0][0]
+        finally:
+            shm.close()
+            shm.unlink()
+    
+    # 3. Report the pairs compared and the estimated recall (pairs missed by the screening are extrapolated from the checked pairs)
+    if on_pruning is not None:
+        pairs_compared, pairs_found, _, pairs_missed = (int(value) for value in stats)
+        missed_estimate = pairs_missed / PRUNING_RECALL_FRACTION
+        on_pruning({
+            'mode': pruning,
+            'bounded': bool(bounded),
+            'pairs_total': pairs_total,
+            'pairs_compared': pairs_compared,
+            'compared_fraction': pairs_compared / pairs_total if pairs_total else 0.0,
+            'recall_estimate': pairs_found / (pairs_found + missed_estimate) if pairs_found + missed_estimate > 0 else 1.0
+        })
+
+def tiled_pair_search(values, negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend='tiled', tile_size=TILE_SIZE, n_jobs=1, gene_set=None, max_pairs=None, on_block=None, on_progress=None,
+                      pruning=None, on_pruning=None):
+    """
+    tiled_pair_search: Function to search reversed gene pairs with gene x gene tiles
+    
+    Input Parameters:
+    (see iter_pair_search)
+    max_pairs: If provided, only the max_pairs pairs with the highest reversal ratio are kept while streaming over the tiles
+    on_block: If provided, called with every (row_genes, col_genes, neg_counts, pos_counts) block as soon as its tiles complete
+    pruning: If 'exact' or 'approximate', skip the pairs that cannot (or are unlikely to) reach the threshold, see iter_pruned_pair_search;
+             ignored for sparse matrices
+    on_pruning: See iter_pruned_pair_search
+    
+    Output:
+    row_genes, col_genes, neg_counts, pos_counts: See search_pair_block, concatenated in row-major order
+    pairs_num: Number of pairs above the threshold (including those dropped by max_pairs)
+    """
+    if pruning is not None and not is_sparse_matrix(values):
+        blocks = iter_pruned_pair_search(values, negative_samples_num, positive_samples_num, reversal_ratio_threshold, pruning, backend, tile_size, n_jobs, gene_set,
+                                         on_progress, on_pruning)
+    else:
+        blocks = iter_pair_search(values, negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend, tile_size, n_jobs, gene_set, on_progress)
+    if on_block is not None:
+        blocks = observe_blocks(blocks, on_block)
+    if max_pairs is None:
+        pairs = concatenate_pair_blocks(list(blocks))
+        pairs_num = len(pairs[0])
+    else:
+        pairs, pairs_num = select_top_pairs(blocks, max_pairs, negative_samples_num, positive_samples_num)
+    
+    # Gene set and pruned searches and top pair selection do not preserve row-major order
+    if gene_set is not None or max_pairs is not None or pruning is not None:
+        pairs = row_major_order(*pairs)
+    
+    return pairs + (pairs_num,)
+
+def gene_pairs_frame(symbols, row_genes, col_genes, ratios):
+    """
+    gene_pairs_frame: Function to build the reversed gene pairs dataframe from gene indices
+    
+    Input Parameters:
+    symbols: Gene symbols indexed by gene index
+    row_genes, col_genes: Gene indices of the pairs
+    ratios: Signed reversal ratios of the pairs
+    
+    Output:
+    gene_pairs: Includes the columns: 'Gene1', 'Gene2', and 'ReversalRatio', with the smaller gene listed first
+    """
+    # Swap genes in rows with negative values to ensure the smaller gene is listed first
+    swap = ratios < 0
+    gene1 = np.where(swap, col_genes, row_genes)
+    gene2 = np.where(swap, row_genes, col_genes)
+    
+    return pd.DataFrame({
+        'Gene1': symbols[gene1],
+        'Gene2': symbols[gene2],
+        'ReversalRatio': np.abs(ratios)
+    })
+
+def reference_pair_search(expr_df, negative_samples_num, positive_samples_num, reversal_ratio_threshold):
+    """
+    reference_pair_search: Reference implementation of the reversed gene pairs search, one gene at a time
+    
+    Input Parameters:
+    expr_df: An expression matrix indexed by Symbol, with negative samples followed by positive samples
     negative_samples_num: Number of negative samples
     positive_samples_num: Number of positive samples
     reversal_ratio_threshold: Reversal proportion threshold
-    remove_duplicate_gene_pairs: Remove duplicates or not
-    gene_set_input: Path to gene set data
     
     Output:
-    reverse_gene_pairs_reslut: Includes the columns: 'Gene1', 'Gene2', and 'ReversalRatio' (reversal ratio)
+    gene_pairs: Includes the columns: 'Gene1', 'Gene2', and 'ReversalRatio', unsorted
     """
-    expr_df = expr_df.set_index(expr_df.columns[0])  # Set the first column as the index
-    
     def get_reverse_gene_pairs(row):
         # Get the index of the current row
         current_index = row.name
@@ -73,93 +1382,719 @@ def Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, reve
 
     result_list = expr_df.apply(get_reverse_gene_pairs, axis=1)
     
-    # Merge the list into the final result dataframe
-    reverse_gene_pairs_reslut = pd.concat(result_list.tolist(), ignore_index=True)
-    reverse_gene_pairs_reslut = reverse_gene_pairs_reslut.sort_values(by='ReversalRatio', ascending=False)
+    # Merge the list into the final result dataframe
+    return pd.concat(result_list.tolist(), ignore_index=True)
+
+def ratio_histogram(ratios):
+    """
+    ratio_histogram: Function to build the histogram (distinct values and counts) of absolute reversal ratios
+    """
+    return np.unique(np.abs(ratios), return_counts=True)
+
+def merge_ratio_histograms(histogram1, histogram2):
+    """
+    merge_ratio_histograms: Function to merge two reversal ratio histograms
+    """
+    values, inverse = np.unique(np.concatenate([histogram1[0], histogram2[0]]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([histogram1[1], histogram2[1]]), minlength=len(values)).astype(np.int64)
+    return values, counts
+
+def count_pairs_above(histogram, reversal_ratio_threshold):
+    """
+    count_pairs_above: Function to count the pairs whose reversal ratio is above the threshold from a reversal ratio histogram
+    """
+    return int(histogram[1][histogram[0] > reversal_ratio_threshold].sum())
+
+# Number of samples that can be added to the cohort of an incremental state before the pair search is run again on all samples
+INCREMENTAL_SAMPLES = 10
+
+# Version of the incremental state files, states of other versions are rebuilt
+INCREMENTAL_STATE_VERSION = 1
+
+# Tolerance on reversal ratios when checking that an incremental state still holds every pair above the threshold
+INCREMENTAL_TOLERANCE = 1e-9
+
+def ratio_drift(negative_base_num, positive_base_num, negative_added_num, positive_added_num):
+    """
+    ratio_drift: Function to bound the change of the reversal ratio of any gene pair when samples are added to both classes
+    
+    Whatever the comparisons in the added samples, the fraction of a class moves by at most added / (base + added)
+    """
+    return negative_added_num / (negative_base_num + negative_added_num) + positive_added_num / (positive_base_num + positive_added_num)
+
+def sample_columns(values, columns):
+    """
+    sample_columns: Function to get the dense columns of the given samples from an array or a sparse matrix
+    """
+    if is_sparse_matrix(values):
+        return values[:, columns].toarray()
+    return values[:, columns]
+
+def sample_digests(values, samples, chunk_samples=RANK_CHUNK_SAMPLES):
+    """
+    sample_digests: Function to hash the values of every sample, so that an incremental state can check that its samples are unchanged
+    
+    Output:
+    digests: Dictionary of sample name: hex digest (float64 values, so that it does not depend on the dtype of the ranks)
+    """
+    digests = {}
+    for start in range(0, len(samples), chunk_samples):
+        block = sample_columns(values, np.arange(start, min(start + chunk_samples, len(samples))))
+        for sample, column in zip(samples[start:start + chunk_samples], block.T):
+            digests[str(sample)] = hashlib.blake2b(np.ascontiguousarray(column, dtype=np.float64).tobytes(), digest_size=16).hexdigest()
+    return digests
+
+def load_incremental_state(incremental_dir):
+    """
+    load_incremental_state: Function to read the incremental state of a contrast
+    
+    Output:
+    state: (index, pairs) or None if there is no readable state of the current version; index is the JSON description of the state
+           (see incremental_pair_search), pairs the (row_genes, col_genes, neg_counts, pos_counts) of its candidate pairs
+    """
+    try:
+        with open(os.path.join(incremental_dir, 'index.json')) as f:
+            index = json.load(f)
+        with np.load(os.path.join(incremental_dir, 'pairs.npz')) as pairs_file:
+            pairs = tuple(pairs_file[name].astype(np.int64) for name in ('row_genes', 'col_genes', 'neg_counts', 'pos_counts'))
+    except (OSError, ValueError, KeyError):
+        return None
+    if index.get('version') != INCREMENTAL_STATE_VERSION:
+        return None
+    return index, pairs
+
+def save_incremental_state(incremental_dir, index, pairs):
+    """
+    save_incremental_state: Function to write the incremental state of a contrast, replacing the previous one
+    
+    Gene indices are stored as uint32 and counts as uint16 when every class has fewer than 65536 samples
+    """
+    count_dtype = np.uint16 if max(len(index['negative_samples']), len(index['positive_samples'])) < 2 ** 16 else np.uint32
+    
+    # Write the state into a temporary directory first so that a partially written state is never used
+    parent_dir = os.path.dirname(os.path.abspath(incremental_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=parent_dir)
+    np.savez(os.path.join(tmp_dir, 'pairs.npz'), row_genes=pairs[0].astype(np.uint32), col_genes=pairs[1].astype(np.uint32),
+             neg_counts=pairs[2].astype(count_dtype), pos_counts=pairs[3].astype(count_dtype))
+    with open(os.path.join(tmp_dir, 'index.json'), 'w') as f:
+        json.dump(dict(index, version=INCREMENTAL_STATE_VERSION), f)
+    
+    old_dir = None
+    if os.path.exists(incremental_dir):
+        old_dir = tempfile.mkdtemp(prefix='.old-', dir=parent_dir)
+        os.rename(incremental_dir, os.path.join(old_dir, 'state'))
+    os.rename(tmp_dir, incremental_dir)
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+def incremental_state_mismatch(index, symbols, negative_samples, positive_samples, digests, reversal_ratio_threshold, gene_set, pruning):
+    """
+    incremental_state_mismatch: Function to check whether an incremental state can be updated with the samples of the current run
+    
+    Output:
+    reason: None if the state can be updated, otherwise the reason why the pair search has to be run on all samples
+    """
+    if index['symbols'] != [str(symbol) for symbol in symbols]:
+        return 'gene symbols changed'
+    if index['gene_set'] != (None if gene_set is None else np.asarray(gene_set).tolist()):
+        return 'gene set changed'
+    if index['pruning'] == 'approximate' and pruning != 'approximate':
+        return 'state built with approximate pruning'
+    if not set(index['negative_samples']) <= set(negative_samples) or not set(index['positive_samples']) <= set(positive_samples):
+        return 'samples removed or moved to the other class'
+    if any(index['sample_digests'][sample] != digests[sample] for sample in index['negative_samples'] + index['positive_samples']):
+        return 'sample values changed'
+    
+    # Pairs left out of the state had a ratio of at most candidate_threshold on the base samples
+    drift = ratio_drift(index['negative_base_num'], index['positive_base_num'],
+                        len(negative_samples) - index['negative_base_num'], len(positive_samples) - index['positive_base_num'])
+    if index['candidate_threshold'] + drift > reversal_ratio_threshold - INCREMENTAL_TOLERANCE:
+        return 'too many samples added since the last full search'
+    return None
+
+def incremental_pair_search(values, symbols, samples, negative_samples_num, positive_samples_num, reversal_ratio_threshold, incremental_dir,
+                            incremental_samples=INCREMENTAL_SAMPLES, backend='tiled', n_jobs=1, gene_set=None, max_pairs=None, on_block=None,
+                            on_progress=None, pruning=None, on_pruning=None, on_incremental=None):
+    """
+    incremental_pair_search: Function to search reversed gene pairs by updating the per-pair counts persisted by an earlier run with the added samples
+    
+    The state of a contrast holds the negative and positive counts of every candidate pair: the pairs whose reversal ratio could still exceed
+    the threshold after incremental_samples samples are added. Pairs outside the candidates had a ratio too low on the base samples to get
+    above the threshold, so a run updating the candidate counts with the added samples gives the same pairs as a search on all samples.
+    The search is run on all samples again (and the state rebuilt) when there is no state, when samples were removed, changed or moved
+    to the other class, when the genes or the gene set changed, or when too many samples were added for the threshold.
+    
+    Input Parameters:
+    values: Expression values (genes x samples, negative samples first), an array or a CSR matrix
+    symbols, samples: Gene symbols and sample names of values
+    incremental_dir: Directory of the incremental state of the contrast, created by the first run
+    incremental_samples: Number of samples that can be added before the pair search is run on all samples again
+    on_incremental: If provided, called with a report: mode ('update' or 'full'), reason of a full search, added samples and candidate pairs
+    (other parameters: see tiled_pair_search)
+    
+    Output:
+    row_genes, col_genes, neg_counts, pos_counts, pairs_num: See tiled_pair_search
+    """
+    negative_samples = [str(sample) for sample in samples[:negative_samples_num]]
+    positive_samples = [str(sample) for sample in samples[negative_samples_num:]]
+    digests = sample_digests(values, samples)
+    
+    state = load_incremental_state(incremental_dir)
+    reason = 'no incremental state' if state is None else incremental_state_mismatch(
+        state[0], symbols, negative_samples, positive_samples, digests, reversal_ratio_threshold, gene_set, pruning)
+    
+    if reason is None:
+        # ------------------------------
+        # 1. Update the candidate counts with the added samples only
+        # ------------------------------
+        index, (row_genes, col_genes, neg_counts, pos_counts) = state
+        known_samples = set(index['sample_digests'])
+        added_negative = [column for column, sample in enumerate(negative_samples) if sample not in known_samples]
+        added_positive = [negative_samples_num + column for column, sample in enumerate(positive_samples) if sample not in known_samples]
+        if added_negative or added_positive:
+            added_values = np.ascontiguousarray(sample_columns(values, added_negative + added_positive))
+            added_neg_counts, added_pos_counts = count_pair_samples(added_values, row_genes, col_genes, len(added_negative))
+            neg_counts = neg_counts + added_neg_counts
+            pos_counts = pos_counts + added_pos_counts
+        if on_progress is not None:
+            on_progress(len(row_genes), len(row_genes))
+        report = {'mode': 'update', 'reason': None, 'samples_added': len(added_negative) + len(added_positive)}
+    else:
+        # ------------------------------
+        # 1. Search all samples for the candidate pairs, at a threshold lowered by the largest ratio drift of incremental_samples added samples
+        # ------------------------------
+        drift = max(ratio_drift(negative_samples_num, positive_samples_num, negative_added_num, incremental_samples - negative_added_num)
+                    for negative_added_num in range(incremental_samples + 1))
+        candidate_threshold = reversal_ratio_threshold - drift - 2 * INCREMENTAL_TOLERANCE
+        row_genes, col_genes, neg_counts, pos_counts, _ = tiled_pair_search(
+            values, negative_samples_num, positive_samples_num, candidate_threshold, backend, n_jobs=n_jobs, gene_set=gene_set,
+            on_progress=on_progress, pruning=pruning, on_pruning=on_pruning)
+        index = {'symbols': [str(symbol) for symbol in symbols], 'gene_set': None if gene_set is None else np.asarray(gene_set).tolist(),
+                 'pruning': pruning, 'candidate_threshold': candidate_threshold,
+                 'negative_base_num': negative_samples_num, 'positive_base_num': positive_samples_num}
+        report = {'mode': 'full', 'reason': reason, 'samples_added': 0}
+    
+    # ------------------------------
+    # 2. Persist the updated state
+    # ------------------------------
+    index.update(negative_samples=negative_samples, positive_samples=positive_samples, sample_digests=digests)
+    save_incremental_state(incremental_dir, index, (row_genes, col_genes, neg_counts, pos_counts))
+    report['candidate_pairs'] = len(row_genes)
+    if on_incremental is not None:
+        on_incremental(report)
+    
+    # ------------------------------
+    # 3. Select the pairs above the threshold, in the row-major order of a search on all samples
+    # ------------------------------
+    ratios = reversal_ratios(neg_counts, pos_counts, negative_samples_num, positive_samples_num)
+    keep = np.abs(ratios) > reversal_ratio_threshold
+    pairs = (row_genes[keep], col_genes[keep], neg_counts[keep], pos_counts[keep])
+    if on_block is not None:
+        on_block(pairs)
+    pairs_num = len(pairs[0])
+    if max_pairs is not None:
+        pairs = row_major_order(*top_pairs(pairs, max_pairs, negative_samples_num, positive_samples_num))
+    
+    return pairs + (pairs_num,)
+
+def search_reversed_gene_pairs(expr_df, negative_samples_num, positive_samples_num, reversal_ratio_threshold, gene_set=None, backend='tiled', n_jobs=1, max_pairs=None, pairs_writer=None, on_progress=None,
+                               pruning=None, on_pruning=None, incremental_dir=None, incremental_samples=INCREMENTAL_SAMPLES, on_incremental=None):
+    """
+    search_reversed_gene_pairs: Function to run the pair search of the selected backend
+    
+    Input Parameters:
+    expr_df: An expression matrix indexed by Symbol, with negative samples followed by positive samples
+    gene_set: Sorted gene indices of the gene set (tiled and bitpacked backends), or None
+    on_progress: See iter_pair_search (tiled and bitpacked backends)
+    on_pruning: See iter_pruned_pair_search (tiled and bitpacked backends)
+    on_incremental: See incremental_pair_search (tiled and bitpacked backends)
+    (other parameters: see Reverse_gene_pairs)
+    
+    Output:
+    reverse_gene_pairs_reslut: Includes the columns: 'Gene1', 'Gene2', and 'ReversalRatio', unsorted (row-major order)
+    histogram: Histogram of the reversal ratios of all pairs above the threshold, including pairs dropped by max_pairs
+    """
+    if backend == 'reference':
+        if incremental_dir is not None:
+            raise ValueError("The incremental mode requires the tiled or bitpacked backend!")
+        if is_sparse_frame(expr_df):
+            expr_df = expr_df.sparse.to_dense()
+        # The reference subtracts the values of two genes, which would wrap around with unsigned ranks
+        if any(dtype.kind == 'u' for dtype in expr_df.dtypes):
+            expr_df = expr_df.astype(np.float64)
+        reverse_gene_pairs_reslut = reference_pair_search(expr_df, negative_samples_num, positive_samples_num, reversal_ratio_threshold)
+        return reverse_gene_pairs_reslut, ratio_histogram(reverse_gene_pairs_reslut['ReversalRatio'].to_numpy())
+    if backend not in PAIR_COUNT_KERNELS:
+        raise ValueError("Invalid pair search backend, please enter one of: " + ", ".join(PAIR_SEARCH_BACKENDS) + "!")
+    
+    symbols = expr_df.index.to_numpy()
+    histogram = ratio_histogram(np.empty(0))
+    
+    # Update the histogram and stream the pairs of each block to disk as soon as its tiles complete
+    def observe_block(block):
+        nonlocal histogram
+        ratios = reversal_ratios(block[2], block[3], negative_samples_num, positive_samples_num)
+        histogram = merge_ratio_histograms(histogram, ratio_histogram(ratios))
+        if pairs_writer is not None:
+            pairs_writer.write(gene_pairs_frame(symbols, block[0], block[1], ratios))
+    
+    if incremental_dir is None:
+        row_genes, col_genes, neg_counts, pos_counts, pairs_num = tiled_pair_search(
+            expression_values(expr_df), negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend,
+            n_jobs=n_jobs, gene_set=gene_set, max_pairs=max_pairs, on_block=observe_block, on_progress=on_progress, pruning=pruning, on_pruning=on_pruning)
+    else:
+        row_genes, col_genes, neg_counts, pos_counts, pairs_num = incremental_pair_search(
+            expression_values(expr_df), symbols, expr_df.columns, negative_samples_num, positive_samples_num, reversal_ratio_threshold, incremental_dir,
+            incremental_samples, backend, n_jobs, gene_set, max_pairs, observe_block, on_progress, pruning, on_pruning, on_incremental)
+    ratios = reversal_ratios(neg_counts, pos_counts, negative_samples_num, positive_samples_num)
+    
+    return gene_pairs_frame(symbols, row_genes, col_genes, ratios), histogram
+
+# Minimum number of reversed gene pairs in the whole matrix
+MIN_GENE_PAIRS = 100
+
+def whole_matrix_pairs_num(expr_df, negative_samples_num, positive_samples_num, reversal_ratio_threshold, pairs_num, gene_set=None, backend='tiled'):
+    """
+    whole_matrix_pairs_num: Function to get the number of reversed gene pairs of the whole matrix checked by finalize_gene_pairs
+    
+    Input Parameters:
+    pairs_num: Number of pairs above the threshold found by search_reversed_gene_pairs (only gene set pairs with the tiled and bitpacked backends)
+    (other parameters: see search_reversed_gene_pairs)
+    
+    Output:
+    pairs_num: Number of pairs above the threshold in the whole matrix, or MIN_GENE_PAIRS if there are at least as many
+    
+    The tiled and bitpacked backends only enumerate gene set pairs; when there are fewer than MIN_GENE_PAIRS of them, the whole matrix
+    is searched until MIN_GENE_PAIRS pairs are found, so that every backend checks the same number as the reference backend.
+    """
+    if gene_set is None or backend == 'reference' or pairs_num >= MIN_GENE_PAIRS:
+        return pairs_num
+    
+    pairs_num = 0
+    for block in iter_pair_search(expression_values(expr_df), negative_samples_num, positive_samples_num, reversal_ratio_threshold, backend):
+        pairs_num += len(block[0])
+        if pairs_num >= MIN_GENE_PAIRS:
+            return MIN_GENE_PAIRS
+    return pairs_num
+
+# Number of gene pairs screened at once against the used genes when removing duplicate gene pairs
+DEDUP_BLOCK_PAIRS = 65536
+
+def select_disjoint_pairs(gene1, gene2, genes_num, block_pairs=DEDUP_BLOCK_PAIRS):
+    """
+    select_disjoint_pairs: Function to select gene pairs greedily in the given order, keeping a pair only if neither gene is used by a kept pair
+    
+    Input Parameters:
+    gene1, gene2: Integer gene codes of the pairs (0 .. genes_num - 1)
+    genes_num: Number of distinct genes
+    block_pairs: Number of pairs screened at once
+    
+    Output:
+    selected: Positions of the kept pairs
+    """
+    used = np.zeros(genes_num, dtype=bool)
+    used_num = 0
+    selected = []
+    for start in range(0, gene1.shape[0], block_pairs):
+        # Pairs touching a gene used before this block can never be kept
+        block_gene1 = gene1[start:start + block_pairs]
+        block_gene2 = gene2[start:start + block_pairs]
+        candidates = np.flatnonzero(~used[block_gene1] & ~used[block_gene2])
+        
+        for position, code1, code2 in zip(candidates.tolist(), block_gene1[candidates].tolist(), block_gene2[candidates].tolist()):
+            if not used[code1] and not used[code2]:
+                used[code1] = used[code2] = True
+                used_num += 2
+                selected.append(start + position)
+                # Every gene is used once at most, so no pair can be kept once fewer than two genes are left
+                if used_num >= genes_num - 1:
+                    break
+        
+        if used_num >= genes_num - 1:
+            break
+    
+    return np.array(selected, dtype=np.int64)
+
+def finalize_gene_pairs(reverse_gene_pairs_reslut, pairs_num, gene_list, remove_duplicate_gene_pairs, backend='tiled', recorder=None):
+    """
+    finalize_gene_pairs: Function to sort, check, filter and deduplicate the searched reversed gene pairs
+    
+    Input Parameters:
+    reverse_gene_pairs_reslut: Unsorted reversed gene pairs, see search_reversed_gene_pairs
+    pairs_num: Number of pairs above the threshold in the whole matrix, see whole_matrix_pairs_num
+    gene_list: Gene symbols of the gene set, or None
+    remove_duplicate_gene_pairs: Remove duplicates or not
+    backend: Pair search backend (only the reference backend searches pairs outside the gene set)
+    recorder: StageRecorder timing the duplicate removal (optional)
+    
+    Output:
+    reverse_gene_pairs_reslut: Includes the columns: 'Gene1', 'Gene2', and 'ReversalRatio' (reversal ratio)
+    """
+    # Every backend returns its pairs in row-major order, the order in which the original search concatenated them, so the same sort
+    # orders tied pairs as before (a gene set search only sorts its own pairs, so ties between them can come out in another order)
+    reverse_gene_pairs_reslut = reverse_gene_pairs_reslut.sort_values(by='ReversalRatio', ascending=False)
+
+    # Check the number of gene pairs of the whole matrix, see whole_matrix_pairs_num
+    if pairs_num < MIN_GENE_PAIRS:
+        raise ValueError("The reversal ratio threshold is too high or there is no difference between the two sample groups. Please adjust the threshold accordingly!")
+
+    if gene_list is not None:
+        # Select reversed gene pairs where at least one gene is present in the provided gene set
+        if backend == 'reference':
+            reverse_gene_pairs_reslut = reverse_gene_pairs_reslut[
+                reverse_gene_pairs_reslut['Gene1'].isin(gene_list) | reverse_gene_pairs_reslut['Gene2'].isin(gene_list)
+            ]
+
+        # Check if there are any gene pairs after filtering
+        if reverse_gene_pairs_reslut.shape[0] < 1:
+            raise ValueError("No reversed gene pairs were obtained, indicating that this gene set shows no difference between the two sample groups!")
+       
+    # Define function for removing duplicate gene pairs
+    def duplicate_removal(matrix):
+        pairs_num = matrix.shape[0]
+        gene_codes, genes = pd.factorize(pd.concat([matrix['Gene1'], matrix['Gene2']], ignore_index=True))
+        selected = select_disjoint_pairs(gene_codes[:pairs_num], gene_codes[pairs_num:], len(genes))
+        return matrix.iloc[selected]
+
+    # Remove duplicate gene pairs
+    if remove_duplicate_gene_pairs:
+        with (recorder or StageRecorder()).stage('dedup') as stage:
+            reverse_gene_pairs_reslut = duplicate_removal(reverse_gene_pairs_reslut)
+            stage['items'] = reverse_gene_pairs_reslut.shape[0]
+        
+    # Return the result
+    return reverse_gene_pairs_reslut
+
+def read_gene_set(gene_set_input, gene_index):
+    """
+    read_gene_set: Function to read a gene set and locate its genes in the expression matrix
+    
+    Input Parameters:
+    gene_set_input: Path to gene set data, or gene symbols (list-like)
+    gene_index: Gene symbols of the expression matrix (pandas Index)
+    
+    Output:
+    gene_list: Gene symbols of the gene set
+    gene_set: Sorted indices of the gene set genes in the expression matrix
+    """
+    if isinstance(gene_set_input, (str, os.PathLike)):
+        gene_set_df = pd.read_csv(gene_set_input, sep=',')
+        
+        # Check whether the gene set contains only one column
+        if gene_set_df.shape[1] != 1:
+            raise ValueError("Incorrect gene set data format!")
+        gene_symbols = gene_set_df.iloc[:, 0]
+    else:
+        gene_symbols = pd.Series(list(gene_set_input), dtype=object)
+    
+    # Check whether all gene symbols are present in the 'Symbol' column of the expression dataframe (hashed index lookup)
+    gene_list = gene_symbols.dropna().astype(str).tolist()
+    gene_positions = gene_index.get_indexer_for(gene_list)
+    if (gene_positions < 0).any():
+        raise ValueError("Some genes in the gene set do not exist in the expression dataframe!")
+    
+    return gene_list, np.unique(gene_positions)
+
+# ==============================
+#       Reverse_gene_pairs
+# ==============================
+def Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, reversal_ratio_threshold, remove_duplicate_gene_pairs, gene_set_input, backend='tiled', n_jobs=1, max_pairs=None, pairs_writer=None, recorder=None,
+                       pruning=None, incremental_dir=None, incremental_samples=INCREMENTAL_SAMPLES):
+    """
+    Reverse_gene_pairs: Function to extract reversed gene pairs
+    
+    Input Parameters:
+    expr_df: An expression matrix sorted by Symbol, negative samples, and positive samples
+    negative_samples_num: Number of negative samples
+    positive_samples_num: Number of positive samples
+    reversal_ratio_threshold: Reversal proportion threshold
+    remove_duplicate_gene_pairs: Remove duplicates or not
+    gene_set_input: Path to gene set data, or gene symbols (the tiled and bitpacked backends only enumerate pairs with at least one gene in the set)
+    backend: Pair search backend, 'tiled' (NumPy gene x gene tiles), 'bitpacked' (tiles counted from packed uint64 bitsets) or 'reference' (one gene at a time)
+    n_jobs: Number of worker processes for the tiled and bitpacked backends
+    max_pairs: If provided, only the max_pairs pairs with the highest reversal ratio are kept (tiled and bitpacked backends), before duplicate removal
+    pairs_writer: If provided, a GenePairsWriter receiving all pairs above the threshold (unsorted) as the tiles complete (tiled and bitpacked backends)
+    recorder: StageRecorder timing the pair search and the duplicate removal, and tracking the fraction of pairs compared (optional)
+    pruning: None, 'exact' or 'approximate' (tiled and bitpacked backends), see iter_pruned_pair_search; its report is added to the pair_search stage record
+    incremental_dir, incremental_samples: If incremental_dir is provided, the pair counts are persisted there and later runs only compare the added
+                                          samples (tiled and bitpacked backends), see incremental_pair_search; its report is added to the pair_search stage record
+    
+    Output:
+    reverse_gene_pairs_reslut: Includes the columns: 'Gene1', 'Gene2', and 'ReversalRatio' (reversal ratio)
+    """
+    expr_df = expr_df.set_index(expr_df.columns[0])  # Set the first column as the index
+    
+    # Gene set processing
+    gene_list, gene_set = None, None
+    if gene_set_input is not None:
+        gene_list, gene_set = read_gene_set(gene_set_input, expr_df.index)
+    
+    # Search reversed gene pairs with the selected backend
+    recorder = recorder or StageRecorder()
+    with recorder.stage('pair_search') as stage:
+        reverse_gene_pairs_reslut, histogram = search_reversed_gene_pairs(expr_df, negative_samples_num, positive_samples_num, reversal_ratio_threshold,
+                                                                         gene_set, backend, n_jobs, max_pairs, pairs_writer,
+                                                                         lambda pairs_done, pairs_total: recorder.progress(stage, pairs_done, pairs_total),
+                                                                         pruning, lambda report: stage.update(pruning=report),
+                                                                         incremental_dir, incremental_samples, lambda report: stage.update(incremental=report))
+        stage['items'] = reverse_gene_pairs_reslut.shape[0]
+        pairs_num = whole_matrix_pairs_num(expr_df, negative_samples_num, positive_samples_num, reversal_ratio_threshold,
+                                           count_pairs_above(histogram, reversal_ratio_threshold), gene_set, backend)
+    
+    return finalize_gene_pairs(reverse_gene_pairs_reslut, pairs_num, gene_list, remove_duplicate_gene_pairs, backend, recorder)
+
+def Reverse_gene_pairs_sweep(expr_df, negative_samples_num, positive_samples_num, reversal_ratio_thresholds, remove_duplicate_gene_pairs, gene_set_input, backend='tiled', n_jobs=1, max_pairs=None, pairs_writer=None, recorder=None,
+                             pruning=None, incremental_dir=None, incremental_samples=INCREMENTAL_SAMPLES):
+    """
+    Reverse_gene_pairs_sweep: Function to extract reversed gene pairs for several thresholds with a single pair search
+    
+    Input Parameters:
+    reversal_ratio_thresholds: List of reversal proportion thresholds
+    (other parameters: see Reverse_gene_pairs)
+    
+    Output:
+    sweep_results: List of (threshold, reverse_gene_pairs_reslut or the ValueError raised for this threshold, number of pairs above the threshold,
+                   only counting the pairs of the gene set with a gene set)
+    """
+    expr_df = expr_df.set_index(expr_df.columns[0])  # Set the first column as the index
+    
+    # Gene set processing
+    gene_list, gene_set = None, None
+    if gene_set_input is not None:
+        gene_list, gene_set = read_gene_set(gene_set_input, expr_df.index)
+    
+    # Search once at the lowest threshold; every higher threshold selects a subset of these pairs, in the same order
+    recorder = recorder or StageRecorder()
+    with recorder.stage('pair_search') as stage:
+        all_gene_pairs, histogram = search_reversed_gene_pairs(expr_df, negative_samples_num, positive_samples_num, min(reversal_ratio_thresholds),
+                                                               gene_set, backend, n_jobs, max_pairs, pairs_writer,
+                                                               lambda pairs_done, pairs_total: recorder.progress(stage, pairs_done, pairs_total),
+                                                               pruning, lambda report: stage.update(pruning=report),
+                                                               incremental_dir, incremental_samples, lambda report: stage.update(incremental=report))
+        stage['items'] = all_gene_pairs.shape[0]
+    
+    # The reference backend searches the whole matrix, the other backends only the pairs of the gene set
+    gene_set_ratios = None
+    if gene_list is not None and backend == 'reference':
+        gene_set_ratios = all_gene_pairs.loc[all_gene_pairs['Gene1'].isin(gene_list) | all_gene_pairs['Gene2'].isin(gene_list), 'ReversalRatio'].to_numpy()
+    
+    sweep_results = []
+    for reversal_ratio_threshold in reversal_ratio_thresholds:
+        reverse_gene_pairs_reslut = all_gene_pairs[all_gene_pairs['ReversalRatio'] > reversal_ratio_threshold].reset_index(drop=True)
+        pairs_num = count_pairs_above(histogram, reversal_ratio_threshold)
+        try:
+            reverse_gene_pairs_reslut = finalize_gene_pairs(reverse_gene_pairs_reslut,
+                                                            whole_matrix_pairs_num(expr_df, negative_samples_num, positive_samples_num, reversal_ratio_threshold,
+                                                                                   pairs_num, gene_set, backend),
+                                                            gene_list, remove_duplicate_gene_pairs, backend, recorder)
+        except ValueError as e:
+            reverse_gene_pairs_reslut = e
+        if gene_set_ratios is not None:
+            pairs_num = int((gene_set_ratios > reversal_ratio_threshold).sum())
+        sweep_results.append((reversal_ratio_threshold, reverse_gene_pairs_reslut, pairs_num))
+    
+    return sweep_results
 
-    # Check the number of gene pairs
-    if reverse_gene_pairs_reslut.shape[0] < 100:
-        raise ValueError("The reversal ratio threshold is too high or there is no difference between the two sample groups. Please adjust the threshold accordingly!")
+# Output formats of the gene pairs tables
+PAIRS_TABLE_FORMATS = ['csv', 'csv.gz', 'csv.zst', 'parquet', 'arrow']
 
-    # Gene set processing
-    if gene_set_input is not None:
-        gene_set_df = pd.read_csv(gene_set_input, sep=',')
-        
-        # Check whether the gene set contains only one column
-        if gene_set_df.shape[1] != 1:
-            raise ValueError("Incorrect gene set data format!")
+# Number of rows written at once to the gene pairs tables
+PAIRS_TABLE_CHUNK_ROWS = 100000
+
+# ==============================
+#     Gene pairs table output
+# ==============================
+def open_zstd_text(file_path):
+    """
+    open_zstd_text: Function to open a zstd-compressed text file for writing (compression.zstd on Python 3.14+, otherwise the zstandard package)
+    """
+    try:
+        from compression import zstd
+        return zstd.open(file_path, 'wt', encoding='utf-8', newline='')
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("Writing csv.zst output requires the zstandard package!")
+    return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(file_path, 'wb')), encoding='utf-8', newline='')
+
+class GenePairsWriter:
+    """
+    GenePairsWriter: Writer streaming a gene pairs table to disk chunk by chunk
+    
+    Input Parameters:
+    folder_path: Output path
+    table_name: File name without extension (e.g. "Gene_pairs_table")
+    pairs_format: One of PAIRS_TABLE_FORMATS, also used as the file extension
+    symbols: Gene symbols of the expression matrix, used as the fixed dictionary of Gene1/Gene2 in parquet and arrow output
+    index: Write the dataframe index as the first column of csv output
+    """
+    def __init__(self, folder_path, table_name, pairs_format='csv', symbols=None, index=True):
+        if pairs_format not in PAIRS_TABLE_FORMATS:
+            raise ValueError("Invalid gene pairs table format, please enter one of: " + ", ".join(PAIRS_TABLE_FORMATS) + "!")
+        self.file_path = os.path.join(folder_path, table_name + "." + pairs_format)
+        self.pairs_format = pairs_format
+        self.index = index
+        self.header = True
+        self.handle = None
+        self.arrow_writer = None
         
-        # Check whether all gene symbols are present in the 'Symbol' column of the expression dataframe
-        gene_list = gene_set_df.iloc[:, 0].dropna().astype(str).tolist()
-        missing_genes = [g for g in gene_list if g not in expr_df.index.tolist()]
-        if missing_genes:
-            raise ValueError("Some genes in the gene set do not exist in the expression dataframe!")
+        if pairs_format == 'csv':
+            self.handle = open(self.file_path, 'w', encoding='utf-8', newline='')
+        elif pairs_format == 'csv.gz':
+            self.handle = gzip.open(self.file_path, 'wt', encoding='utf-8', newline='')
+        elif pairs_format == 'csv.zst':
+            self.handle = open_zstd_text(self.file_path)
+        else:
+            try:
+                import pyarrow
+            except ImportError:
+                raise ValueError("Writing parquet or arrow output requires the pyarrow package!")
+            # A fixed dictionary keeps Gene1/Gene2 dictionary-encoded with the same dictionary in every chunk
+            self.gene_dtype = pd.CategoricalDtype(pd.Index(symbols).unique()) if symbols is not None else 'category'
+    
+    def write(self, chunk):
+        """
+        write: Function to append a chunk of gene pairs (dataframe) to the table
+        """
+        if self.handle is not None:
+            chunk.to_csv(self.handle, header=self.header, index=self.index)
+            self.header = False
+            return
         
-        # Select reversed gene pairs where at least one gene is present in the provided gene set
-        reverse_gene_pairs_reslut = reverse_gene_pairs_reslut[
-            reverse_gene_pairs_reslut['Gene1'].isin(gene_list) | reverse_gene_pairs_reslut['Gene2'].isin(gene_list)
-        ]
-
-        # Check if there are any gene pairs after filtering
-        if reverse_gene_pairs_reslut.shape[0] < 1:
-            raise ValueError("No reversed gene pairs were obtained, indicating that this gene set shows no difference between the two sample groups!")
-       
-    # Define function for removing duplicate gene pairs
-    def duplicate_removal(matrix):
-        seen_genes = set()
-        result_matrix = []
+        import pyarrow as pa
+        chunk = chunk.astype({'Gene1': self.gene_dtype, 'Gene2': self.gene_dtype})
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self.arrow_writer is None:
+            if self.pairs_format == 'parquet':
+                import pyarrow.parquet as pq
+                self.arrow_writer = pq.ParquetWriter(self.file_path, table.schema)
+            else:
+                self.arrow_writer = pa.ipc.new_file(self.file_path, table.schema)
+        self.arrow_writer.write_table(table)
     
-        for idx, row in matrix.iterrows():
-            gene1, gene2 = row.iloc[:2]
+    def write_frame(self, frame, chunk_rows=PAIRS_TABLE_CHUNK_ROWS):
+        """
+        write_frame: Function to write a whole dataframe in chunks of chunk_rows rows
+        """
+        for chunk_start in range(0, max(len(frame), 1), chunk_rows):
+            self.write(frame.iloc[chunk_start:chunk_start + chunk_rows])
     
-            if gene1 not in seen_genes and gene2 not in seen_genes:
-                result_matrix.append(row)
-                seen_genes.update([gene1, gene2])
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+        elif self.arrow_writer is not None:
+            self.arrow_writer.close()
     
-        return pd.DataFrame(result_matrix, columns=matrix.columns)
-
-    # Remove duplicate gene pairs
-    if remove_duplicate_gene_pairs:
-        reverse_gene_pairs_reslut = duplicate_removal(reverse_gene_pairs_reslut)
-        
-    # Return the result
-    return reverse_gene_pairs_reslut
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 # ==============================
 #            DP_Score
 # ==============================
+# Number of gene pairs compared at once when scoring samples
+SCORE_CHUNK_PAIRS = 65536
+
 def DP_Score(reversal_gene_pairs, expression_matrix, sample_info_matrix):
     """
     DP_Score: Function to calculate disease perturbation score
     
     Input Parameters:
     reversal_gene_pairs: Data of reversed gene pairs
-    expression_matrix: Gene expression matrix (including the first column as symbol, others as sample expression levels)
+    expression_matrix: Gene expression matrix indexed by symbol, or its per-sample gene ranks (see rank_expression_matrix), which give the same results
     sample_info_matrix: Sample information matrix
     
     Output: 
     Disease_perturbation_scoring: A data frame that adds two columns [DP_Score, Outlier] based on the sample information matrix
-    diff_matrix: Used for calculating the importance of gene pairs
+    importance_score: ImportanceScore of each gene pair, the fraction of samples where the pair agrees with the sample rank
+                      (Gene1 < Gene2 in Rank 0 samples, Gene1 >= Gene2 in the other samples)
     """
     
-    # 1. Extract corresponding data from the expression matrix based on Gene1 and Gene2
+    # 1. Get the row positions of Gene1 and Gene2 in the expression matrix
     # Gene1 is usually lowly expressed in negative samples, Gene2 is usually highly expressed in negative samples
-    small_gene_matrix = expression_matrix.loc[reversal_gene_pairs['Gene1']].reset_index(drop=True)
-    big_gene_matrix = expression_matrix.loc[reversal_gene_pairs['Gene2']].reset_index(drop=True)
-
-    # 2. Calculate the difference matrix
-    diff_matrix = small_gene_matrix - big_gene_matrix
- 
-    # 3. For each column (sample), count how many values are greater than or equal to 0, then divide by the logarithm of the number of gene pairs as the score for each sample
-    scores = (diff_matrix >= 0).sum(axis=0)
+    gene1 = gene_positions(expression_matrix.index, reversal_gene_pairs['Gene1'])
+    gene2 = gene_positions(expression_matrix.index, reversal_gene_pairs['Gene2'])
+    
+    # 2. Rank 0 samples of the expression matrix
+    rank_0_samples = sample_info_matrix.loc[sample_info_matrix['Rank'] == 0, 'Sample']
+    rank_0_mask = expression_matrix.columns.isin(rank_0_samples)
+    
+    # 3. Compare Gene1 and Gene2 chunk by chunk of gene pairs: count for each sample how many pairs have Gene1 >= Gene2,
+    # then divide by the number of gene pairs as the score for each sample
+    scores, pair_counts = count_pair_comparisons(expression_values(expression_matrix) if is_sparse_frame(expression_matrix) else expression_matrix.to_numpy(),
+                                                 gene1, gene2, rank_0_mask)
     gene_pairs_num = reversal_gene_pairs.shape[0]
     normalized_scores = scores / gene_pairs_num
+    importance_score = pair_counts / expression_matrix.shape[1]
     
     # 4. Create the result data frame
+    Disease_perturbation_scoring = scoring_table(expression_matrix.columns, normalized_scores, sample_info_matrix)
+
+    return Disease_perturbation_scoring, importance_score
+
+def gene_positions(gene_index, genes):
+    """
+    gene_positions: Function to get the row positions of genes in an expression matrix (first row of a duplicated symbol)
+    """
+    positions = pd.Series(np.arange(len(gene_index)), index=gene_index)
+    positions = positions[~positions.index.duplicated()]
+    return positions.loc[genes].to_numpy()
+
+def count_pair_comparisons(values, gene1, gene2, rank_0_mask=None, chunk_pairs=SCORE_CHUNK_PAIRS):
+    """
+    count_pair_comparisons: Function to compare Gene1 and Gene2 of every gene pair in every sample, chunk by chunk of gene pairs
+    
+    Input Parameters:
+    values: Expression values (genes x samples), an array or a CSR matrix (only the rows of a chunk are densified)
+    gene1, gene2: Row positions of Gene1 and Gene2 of every gene pair
+    rank_0_mask: Boolean mask of the Rank 0 samples (optional)
+    chunk_pairs: Number of gene pairs compared at once, which bounds the temporary memory
+    
+    Output:
+    sample_counts: For every sample, number of gene pairs where Gene1 >= Gene2
+    pair_counts: For every gene pair, number of Rank 0 samples where Gene1 < Gene2 plus number of other samples where Gene1 >= Gene2
+                 (None without rank_0_mask)
+    """
+    sample_counts = np.zeros(values.shape[1], dtype=np.int64)
+    pair_counts = None if rank_0_mask is None else np.zeros(gene1.shape[0], dtype=np.int64)
+    for start in range(0, gene1.shape[0], chunk_pairs):
+        stop = start + chunk_pairs
+        small_gene_values = dense_rows(values, gene1[start:stop])
+        big_gene_values = dense_rows(values, gene2[start:stop])
+        
+        # Missing values count neither as >= nor as <
+        greater_equal = small_gene_values >= big_gene_values
+        sample_counts += greater_equal.sum(axis=0)
+        if rank_0_mask is not None:
+            less = small_gene_values[:, rank_0_mask] < big_gene_values[:, rank_0_mask]
+            pair_counts[start:stop] = less.sum(axis=1) + greater_equal[:, ~rank_0_mask].sum(axis=1)
+    
+    return sample_counts, pair_counts
+
+def scoring_table(samples, normalized_scores, sample_info_matrix=None):
+    """
+    scoring_table: Function to build the disease perturbation score table
+    
+    Input Parameters:
+    samples: Sample names
+    normalized_scores: DP_Score of each sample
+    sample_info_matrix: Sample information matrix (optional)
+    
+    Output: 
+    Disease_perturbation_scoring: Sample information matrix with the additional columns [DP_Score, Outlier], sorted by DP_Score;
+                                  without sample information only the columns [Sample, DP_Score]
+    """
     scores_result = pd.DataFrame({
-        'Sample': normalized_scores.index,
-        'DP_Score': normalized_scores.values
+        'Sample': samples,
+        'DP_Score': normalized_scores
     })
+    if sample_info_matrix is None:
+        return scores_result.sort_values(by='DP_Score').reset_index(drop=True)
     result_matrix = pd.merge(sample_info_matrix, scores_result, on='Sample', how='inner')
 
     # 5. Retrieve the 'Outlier' column
@@ -191,12 +2126,252 @@ def DP_Score(reversal_gene_pairs, expression_matrix, sample_info_matrix):
     # Mark outliers
     Disease_perturbation_scoring = mark_outliers(result_matrix_sorted)
 
-    return Disease_perturbation_scoring, diff_matrix
+    return Disease_perturbation_scoring
+    
+# ==============================
+#       Permutation test
+# ==============================
+# Number of label permutations applied at once to a chunk of gene pairs, as one matrix product
+PERMUTATION_BATCH = 100
+
+def permutation_seeds(seed, permutations_num):
+    """
+    permutation_seeds: Function to split the permutations into batches of PERMUTATION_BATCH, each with its own random seed
+    
+    Output:
+    batches: List of (seed sequence, number of permutations); the permutations only depend on seed, not on the number of workers
+    """
+    batches_num = -(-permutations_num // PERMUTATION_BATCH)
+    sizes = [min(PERMUTATION_BATCH, permutations_num - batch * PERMUTATION_BATCH) for batch in range(batches_num)]
+    return list(zip(np.random.SeedSequence(seed).spawn(batches_num), sizes))
+
+def permutation_masks(seed_sequence, negative_samples_num, positive_samples_num, permutations_num):
+    """
+    permutation_masks: Function to draw label permutations
+    
+    Output:
+    masks: float32 matrix (samples x permutations), 1 where the sample is labelled negative in the permutation
+    """
+    labels = np.arange(negative_samples_num + positive_samples_num) < negative_samples_num
+    rng = np.random.default_rng(seed_sequence)
+    return rng.permuted(np.tile(labels, (permutations_num, 1)), axis=1).T.astype(np.float32)
+
+def iter_pair_chunks(row_genes, col_genes, chunk_pairs=SCORE_CHUNK_PAIRS):
+    """
+    iter_pair_chunks: Generator listing the pairs of a search, every row gene with the column genes below it, in chunks of whole rows
+    
+    Output:
+    Yields (row genes, column genes) of about chunk_pairs pairs (at least one row), in row-major order
+    """
+    pairs_num = row_pairs_num(row_genes, col_genes)
+    chunk_start = 0
+    while chunk_start < len(row_genes):
+        chunk_stop = chunk_start + max(1, int(np.searchsorted(np.cumsum(pairs_num[chunk_start:]), chunk_pairs, side='right')))
+        rows = row_genes[chunk_start:chunk_stop]
+        col_starts = np.searchsorted(col_genes, rows, side='right')
+        yield np.repeat(rows, len(col_genes) - col_starts), np.concatenate([col_genes[col_start:] for col_start in col_starts])
+        chunk_start = chunk_stop
+
+def permutation_max_ratios(values, row_genes, col_genes, negative_samples_num, positive_samples_num, batches, chunk_pairs=SCORE_CHUNK_PAIRS):
+    """
+    permutation_max_ratios: Function to repeat a pair search with shuffled labels, keeping the largest reversal ratio of every permutation
+    
+    Input Parameters:
+    values: Expression values (genes x samples, negative samples first)
+    row_genes, col_genes: Sorted indices of the row and column genes of the search, see gene_set_searches
+    negative_samples_num: Number of negative samples
+    positive_samples_num: Number of positive samples
+    batches: Permutation batches, see permutation_seeds
+    chunk_pairs: Number of gene pairs compared at once
+    
+    Output:
+    null_max: Largest |neg_count * P - pos_count * N| over the pairs of the search, for every permutation in batch order
+    
+    The samples of a chunk of pairs are compared once; each batch of permutations then counts the negative samples where the
+    row gene is lower with one matrix product. Ratios are compared as integers (the reversal ratio times N * P), so ties are exact.
+    """
+    masks = [permutation_masks(seed_sequence, negative_samples_num, positive_samples_num, permutations_num) for seed_sequence, permutations_num in batches]
+    null_max = np.zeros(sum(batch_masks.shape[1] for batch_masks in masks), dtype=np.int64)
+    for pair_rows, pair_cols in iter_pair_chunks(row_genes, col_genes, chunk_pairs):
+        # Missing values are never lower, as in the pair search
+        lower = (values[pair_rows] < values[pair_cols]).astype(np.float32)
+        lower_num = lower.sum(axis=1).astype(np.int64)
+        
+        batch_start = 0
+        for batch_masks in masks:
+            # Counts of 0/1 values stay exact in float32 below 2 ** 24 samples
+            null_negative_lower_num = np.rint(lower @ batch_masks).astype(np.int64)
+            null = np.abs(null_negative_lower_num * positive_samples_num - (lower_num[:, None] - null_negative_lower_num) * negative_samples_num)
+            batch_stop = batch_start + batch_masks.shape[1]
+            null_max[batch_start:batch_stop] = np.maximum(null_max[batch_start:batch_stop], null.max(axis=0))
+            batch_start = batch_stop
+    
+    return null_max
+
+def permutation_shard(shard, negative_samples_num, positive_samples_num, batches):
+    """
+    permutation_shard: Worker function repeating the (row genes, column genes) search of a shard on the shared expression matrix
+    """
+    return permutation_max_ratios(WORKER_STATE['values'], shard[0], shard[1], negative_samples_num, positive_samples_num, batches)
+
+def permutation_test(reversal_gene_pairs, expression_matrix, negative_samples, positive_samples, permutations_num, seed=0, n_jobs=1, gene_set_input=None):
+    """
+    permutation_test: Function to test the reversed gene pairs against the pair search repeated with shuffled negative/positive labels
+    
+    Input Parameters:
+    reversal_gene_pairs: Reversed gene pairs, including the column 'ReversalRatio'
+    expression_matrix: Expression matrix indexed by Symbol
+    negative_samples, positive_samples: Samples of the contrast
+    permutations_num: Number of label permutations
+    seed: Random seed of the permutations
+    n_jobs: Number of worker processes
+    gene_set_input: Gene set of the pair search, or None if all pairs were searched (see Reverse_gene_pairs)
+    
+    Output:
+    p_values: Adjusted empirical p-value of every gene pair, (1 + permutations whose largest ratio >= its ratio) / (1 + permutations_num)
+    
+    Every permutation repeats the whole pair search (all the pairs of the matrix, or of the gene set, whatever their ratio) and keeps
+    its largest reversal ratio. Comparing every pair with these maxima (single-step max-T) accounts for the selection of the pairs and
+    for the number of pairs searched: the p-values control the family-wise error rate whichever threshold, duplicate removal or
+    max_pairs selected the pairs. Each permutation costs a pair search, done as matrix products over batches of label masks.
+    """
+    negative_samples_num = len(negative_samples)
+    positive_samples_num = len(positive_samples)
+    batches = permutation_seeds(seed, permutations_num)
+    
+    # 1. Observed reversal ratios as integers, |ratio| * N * P
+    observed = np.rint(np.abs(reversal_gene_pairs['ReversalRatio'].to_numpy(dtype=float)) * negative_samples_num * positive_samples_num).astype(np.int64)
+    
+    # 2. Contrast values of all genes and the searches covering the pairs of the whole matrix or of the gene set
+    contrast_matrix = expression_matrix[list(negative_samples) + list(positive_samples)]
+    if is_sparse_frame(contrast_matrix):
+        contrast_matrix = contrast_matrix.sparse.to_dense()
+    values = np.ascontiguousarray(contrast_matrix.to_numpy())
+    gene_set = None
+    if gene_set_input is not None:
+        _, gene_set = read_gene_set(gene_set_input, expression_matrix.index)
+    searches = gene_set_searches(np.arange(values.shape[0]), gene_set)
+    
+    # 3. Largest null ratio of every permutation, in row blocks across a process pool if n_jobs > 1
+    null_max = np.zeros(permutations_num, dtype=np.int64)
+    if n_jobs <= 1:
+        for row_genes, col_genes in searches:
+            null_max = np.maximum(null_max, permutation_max_ratios(values, row_genes, col_genes, negative_samples_num, positive_samples_num, batches))
+    else:
+        shards = [(row_genes[block_start:block_start + TILE_SIZE], col_genes) for row_genes, col_genes in searches
+                  for block_start in range(0, len(row_genes), TILE_SIZE)]
+        shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        try:
+            np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=attach_shared_values,
+                                     initargs=(shm.name, values.shape, values.dtype)) as executor:
+                for _, shard_max in ordered_pool_results(executor, permutation_shard, shards, n_jobs * PAIR_SEARCH_WINDOW,
+                                                         negative_samples_num, positive_samples_num, batches):
+                    null_max = np.maximum(null_max, shard_max)
+        finally:
+            shm.close()
+            shm.unlink()
+    
+    # 4. Count the permutations whose largest ratio reaches the ratio of every pair
+    exceedances = permutations_num - np.searchsorted(np.sort(null_max), observed, side='left')
+    return (1 + exceedances) / (1 + permutations_num)
+
+# ==============================
+#       Signature scoring
+# ==============================
+# Number of expression matrix rows parsed at once when reading only the signature genes
+EXPRESSION_CHUNK_ROWS = 10000
+
+def save_signature(reversal_gene_pairs, file_path):
+    """
+    save_signature: Function to save the reversed gene pairs as a signature that can score new samples (see DPS_Score)
+    
+    Input Parameters:
+    reversal_gene_pairs: Reversed gene pairs, including the columns 'Gene1', 'Gene2', 'ReversalRatio' and 'ImportanceScore'
+    file_path: Path of the .npz signature file
+    
+    Output:
+    The file holds the gene symbols used by the signature and, for every pair, the integer positions of Gene1 and Gene2 in these symbols
+    """
+    codes, symbols = pd.factorize(pd.concat([reversal_gene_pairs['Gene1'], reversal_gene_pairs['Gene2']], ignore_index=True))
+    pairs_num = reversal_gene_pairs.shape[0]
+    
+    np.savez(file_path,
+             symbols=np.asarray(symbols, dtype=str),
+             gene1=codes[:pairs_num].astype(np.int32),
+             gene2=codes[pairs_num:].astype(np.int32),
+             reversal_ratio=reversal_gene_pairs['ReversalRatio'].to_numpy(dtype=np.float64),
+             importance_score=reversal_gene_pairs['ImportanceScore'].to_numpy(dtype=np.float64))
+
+def load_signature(file_path):
+    """
+    load_signature: Function to load a signature saved by save_signature
+    
+    Output:
+    signature: Dictionary with the arrays 'symbols', 'gene1', 'gene2', 'reversal_ratio' and 'importance_score'
+    """
+    with np.load(file_path, allow_pickle=False) as signature_file:
+        signature = {key: signature_file[key] for key in signature_file.files}
+    if signature['gene1'].shape[0] < 1:
+        raise ValueError("The signature does not contain any gene pairs!")
+    return signature
+
+def load_signature_genes(expression_matrix_input, symbols, cache_dir=None, cache_size_limit=CACHE_SIZE_LIMIT):
+    """
+    load_signature_genes: Function to load only the rows of the signature genes from an expression matrix
+    
+    Input Parameters:
+    expression_matrix_input: Path to the expression matrix CSV file
+    symbols: Gene symbols of the signature
+    cache_dir: Expression matrix cache directory (optional, see load_expression_matrix)
+    
+    Output:
+    values: Expression values, one row per signature gene (in the order of symbols), one column per sample (a CSR matrix for a sparse cached matrix)
+    samples: Sample names
+    """
+    if cache_dir is not None:
+        # The cached matrix is memory-mapped: only the rows of the signature genes are read below
+        expr_df = load_expression_matrix(expression_matrix_input, cache_dir, cache_size_limit)
+    else:
+        # Parse the file in chunks and keep only the signature genes
+        gene_chunks = []
+        for chunk in pd.read_csv(expression_matrix_input, sep=',', chunksize=EXPRESSION_CHUNK_ROWS):
+            gene_chunks.append(chunk[chunk.iloc[:, 0].isin(symbols)])
+        expr_df = pd.concat(gene_chunks)
+    
+    # The first row of a duplicated symbol is used
+    gene_rows = pd.Series(np.arange(expr_df.shape[0]), index=expr_df.iloc[:, 0].to_numpy())
+    gene_rows = gene_rows[~gene_rows.index.duplicated()].reindex(symbols)
+    missing_genes = symbols[gene_rows.isna().to_numpy()]
+    if missing_genes.shape[0] > 0:
+        raise ValueError(f"{missing_genes.shape[0]} genes of the signature are missing from the expression matrix, e.g. {', '.join(missing_genes[:5])}!")
+    
+    # Select the signature rows before converting them to an array
+    signature_df = expr_df.iloc[gene_rows.to_numpy(dtype=np.int64), 1:]
+    values = expression_values(signature_df)
+    return values, signature_df.columns
+
+def signature_scores(values, gene1, gene2, chunk_pairs=SCORE_CHUNK_PAIRS):
+    """
+    signature_scores: Function to calculate the DP_Score of every sample with a signature
+    
+    Input Parameters:
+    values: Expression values (genes x samples)
+    gene1, gene2: Row positions of Gene1 and Gene2 of every gene pair
+    chunk_pairs: Number of gene pairs compared at once
     
+    Output:
+    normalized_scores: Fraction of gene pairs where Gene1 is expressed at least as high as Gene2, for every sample
+    """
+    counts, _ = count_pair_comparisons(values, gene1, gene2, chunk_pairs=chunk_pairs)
+    return counts / gene1.shape[0]
+
 # ==============================
 # plot_TOP10_gene_pairs_bar_chart 
 # ==============================
-def plot_TOP10_gene_pairs_bar_chart(reversal_gene_pairs, folder_path):
+def plot_TOP10_gene_pairs_bar_chart(reversal_gene_pairs, folder_path, figure_formats=FIGURE_FORMATS, dpi=None):
+    plt = import_pyplot()
+
     # Calculate the number of rows
     num_rows = len(reversal_gene_pairs)
     
@@ -253,16 +2428,14 @@ def plot_TOP10_gene_pairs_bar_chart(reversal_gene_pairs, folder_path):
     plt.tight_layout()
     
     # Save the figure
-    file_path = os.path.join(folder_path, "TOP10_gene_pairs_bar_chart.pdf")
-    plt.savefig(file_path, format='pdf', dpi=600, bbox_inches='tight')   
-
-    png_path = os.path.join(folder_path, "TOP10_gene_pairs_bar_chart.png")
-    plt.savefig(png_path, format='png', dpi=300, bbox_inches='tight')
+    save_figure(plt, folder_path, "TOP10_gene_pairs_bar_chart", figure_formats, dpi)
         
 # ==============================
 #    plot_DP_score_bar_chart 
 # ==============================
-def plot_DP_score_bar_chart(Disease_perturbation_scoring, colors, folder_path):
+def plot_DP_score_bar_chart(Disease_perturbation_scoring, colors, folder_path, figure_formats=FIGURE_FORMATS, dpi=None):
+    plt = import_pyplot()
+
     # Group the data and extract, then sort in ascending order
     group_scores = Disease_perturbation_scoring.groupby('Rank').apply(lambda group: sorted(group['DP_Score'])).to_dict()
     class_mapping = Disease_perturbation_scoring.drop_duplicates(subset=['Rank'])[['Rank', 'Class']].set_index('Rank')['Class'].to_dict()
@@ -271,34 +2444,52 @@ def plot_DP_score_bar_chart(Disease_perturbation_scoring, colors, folder_path):
     # Calculate the total number of samples
     total_samples = len(Disease_perturbation_scoring)
 
-    # Dynamically adjust the figure width based on the total number of samples
-    fig_width = 8 + total_samples * 0.025 
+    if total_samples > BAR_CHART_MAX_SAMPLES:
+        # Too many samples for one bar each: plot a histogram of DP_Score for each class
+        plt.figure(figsize=(8, 4))
+        plt.xlim(-0.05, 1.05)
+        plt.xticks(fontsize=10)
+        plt.yticks(fontsize=10)
+        
+        bins = np.linspace(0, 1, 51)
+        for i, (classname, scores) in enumerate(class_group_scores.items()):
+            plt.hist(scores, bins=bins, color=colors[i], edgecolor='black', linewidth=0.1, alpha=0.7, label=classname)
+        
+        # Add denser grid lines
+        plt.grid(True, linestyle='--', alpha=0.7)
 
-    # Create a bar chart
-    plt.figure(figsize=(fig_width, 4))
-    plt.ylim(-0.1, 1.1)
-    plt.yticks(fontsize=10)
+        # Add axis labels
+        plt.xlabel('DP_Score', fontsize=12)
+        plt.ylabel('Number of samples', fontsize=12)
+    else:
+        # Dynamically adjust the figure width based on the total number of samples
+        fig_width = 8 + total_samples * 0.025 
 
-    # Set the width of the bars
-    bar_width = 1
+        # Create a bar chart
+        plt.figure(figsize=(fig_width, 4))
+        plt.ylim(-0.1, 1.1)
+        plt.yticks(fontsize=10)
 
-    # Loop through each group of data
-    x = 0
-    for i, (classname, scores) in enumerate(class_group_scores.items()):
-        group_length = len(scores)
-        x_pos = np.arange(x, x + group_length)
-        scores = [x + 0.1 for x in scores]
-        plt.bar(x_pos, scores, width=bar_width, color=colors[i], edgecolor='black', linewidth=bar_width * 0.1, label=classname, bottom=-0.1)
-        x += group_length
+        # Set the width of the bars
+        bar_width = 1
 
-    # Hide X-axis tick labels
-    plt.xticks([])
+        # Loop through each group of data
+        x = 0
+        for i, (classname, scores) in enumerate(class_group_scores.items()):
+            group_length = len(scores)
+            x_pos = np.arange(x, x + group_length)
+            scores = [x + 0.1 for x in scores]
+            plt.bar(x_pos, scores, width=bar_width, color=colors[i], edgecolor='black', linewidth=bar_width * 0.1, label=classname, bottom=-0.1)
+            x += group_length
 
-    # Add denser grid lines
-    plt.grid(True, linestyle='--', alpha=0.7)
+        # Hide X-axis tick labels
+        plt.xticks([])
 
-    # Add axis labels
-    plt.ylabel('DP_Score', fontsize=12)
+        # Add denser grid lines
+        plt.grid(True, linestyle='--', alpha=0.7)
+
+        # Add axis labels
+        plt.ylabel('DP_Score', fontsize=12)
 
     # Add legend
     plt.legend(title='Class', fontsize=10, loc='upper left')
@@ -317,16 +2508,14 @@ def plot_DP_score_bar_chart(Disease_perturbation_scoring, colors, folder_path):
     ax.spines['right'].set_color('black')
 
     # Save the figure
-    file_path = os.path.join(folder_path, "DP_score_bar_chart.pdf")
-    plt.savefig(file_path, format='pdf', dpi=600, bbox_inches='tight') 
-
-    png_path = os.path.join(folder_path, "DP_score_bar_chart.png")
-    plt.savefig(png_path, format='png', dpi=300, bbox_inches='tight')
+    save_figure(plt, folder_path, "DP_score_bar_chart", figure_formats, dpi)
 
 # ==============================
 #     plot_DP_score_boxplot
 # ==============================
-def plot_DP_score_boxplot(Disease_perturbation_scoring, colors, folder_path):
+def plot_DP_score_boxplot(Disease_perturbation_scoring, colors, folder_path, figure_formats=FIGURE_FORMATS, dpi=None):
+    plt = import_pyplot()
+
     # Sort by values in the 'Rank' column
     Disease_perturbation_scoring_sorted = Disease_perturbation_scoring.sort_values(by='Rank')
 
@@ -402,16 +2591,12 @@ def plot_DP_score_boxplot(Disease_perturbation_scoring, colors, folder_path):
     plt.grid(True, linestyle='--', alpha=0.7)
 
     # Save the chart
-    file_path = os.path.join(folder_path, "DP_score_boxplot.pdf")
-    plt.savefig(file_path, format='pdf', dpi=600, bbox_inches='tight') 
-
-    png_path = os.path.join(folder_path, "DP_score_boxplot.png")
-    plt.savefig(png_path, format='png', dpi=300, bbox_inches='tight')
+    save_figure(plt, folder_path, "DP_score_boxplot", figure_formats, dpi)
 
 # ==============================
 # plot_DP_score_with_sample_information 
 # ==============================
-def plot_DP_score_with_sample_information(Disease_perturbation_scoring, colors, folder_path, sample_info_category=None, sample_category=None, data_type=None):
+def plot_DP_score_with_sample_information(Disease_perturbation_scoring, colors, folder_path, sample_info_category=None, sample_category=None, data_type=None, figure_formats=FIGURE_FORMATS, dpi=None):
     # 1. If none of the three parameters are provided, do not process
     if sample_info_category is None and sample_category is None and data_type is None:
         return
@@ -428,6 +2613,8 @@ def plot_DP_score_with_sample_information(Disease_perturbation_scoring, colors,
     if sample_category not in Disease_perturbation_scoring['Class'].unique():
         raise ValueError("Invalid sample category input!")
 
+    plt = import_pyplot()
+
     # 5. Retrieve scores and corresponding sample information data for the specified sample category
     selected_scores_info = Disease_perturbation_scoring[Disease_perturbation_scoring['Class'] == sample_category][['DP_Score', sample_info_category]]
     
@@ -506,11 +2693,7 @@ def plot_DP_score_with_sample_information(Disease_perturbation_scoring, colors,
         plt.grid(True, linestyle='--', alpha=0.7)
     
         # Save the figure
-        file_path = os.path.join(folder_path, "DP_score_with_sample_information.pdf")
-        plt.savefig(file_path, format='pdf', dpi=600, bbox_inches='tight') 
-
-        png_path = os.path.join(folder_path, "DP_score_with_sample_information.png")
-        plt.savefig(png_path, format='png', dpi=300, bbox_inches='tight')
+        save_figure(plt, folder_path, "DP_score_with_sample_information", figure_formats, dpi)
 
     elif data_type.lower() == "continuous":
         fig, ax = plt.subplots(figsize=(4.9, 4))
@@ -526,37 +2709,443 @@ def plot_DP_score_with_sample_information(Disease_perturbation_scoring, colors,
         cbar.ax.tick_params(labelsize=10)
         cbar.set_label('DP_Score', fontsize=12)
 
+        from scipy.stats import spearmanr
         rho, p_value = spearmanr(selected_scores, selected_info)
 
         # Set chart title including Spearman correlation coefficient and p-value
         ax.set_title(f'{sample_category}: DP_Score vs {sample_info_category}\nSpearman ρ = {rho:.2f}, p = {p_value:.3f}', fontsize=12, fontweight='bold')
 
-        # Add grid lines with specific line style and transparency
-        ax.grid(True, linestyle='--', alpha=0.7)
+        # Add grid lines with specific line style and transparency
+        ax.grid(True, linestyle='--', alpha=0.7)
+
+        # Set axis labels
+        ax.set_xlabel('DP_Score', fontsize=12)
+        ax.set_ylabel(sample_info_category, fontsize=12)
+
+        # Adjust axis tick label font size
+        ax.tick_params(axis='both', which='major', labelsize=10)
+
+        # Save the figure
+        save_figure(plt, folder_path, "DP_score_with_sample_information", figure_formats, dpi)
+
+    else:
+        raise ValueError("Error in data_type parameter, please enter 'Discrete' or 'Continuous'!")
+        
+# ==============================
+#        export_results
+# ==============================
+def plot_results(reverse_gene_pairs_reslut, Disease_perturbation_scoring, folder_path, sample_info_category=None, sample_category=None, data_type=None,
+                 figure_formats=FIGURE_FORMATS, dpi=None, n_jobs=1, recorder=None):
+    """
+    plot_results: Function to plot the TOP 10 gene pairs, the score bar chart, the score boxplot and the scores in relation to sample information
+    
+    Input Parameters:
+    reverse_gene_pairs_reslut: Reversed gene pairs sorted by ImportanceScore
+    Disease_perturbation_scoring: Disease perturbation score table
+    (other parameters: see DPS_Tool and render_figures)
+    """
+    # Define color list
+    colors = [
+        '#AEC7E8', '#FFBB78', '#98DF8A', '#FF9896', 
+        '#C5B0D5', '#C49C94', '#F7B6D2', '#C7C7C7', 
+        '#DBDB8D', '#9EDAE5'
+    ]
+    
+    figures = [
+        (plot_TOP10_gene_pairs_bar_chart, (reverse_gene_pairs_reslut.head(10).copy(), folder_path)),
+        (plot_DP_score_bar_chart, (Disease_perturbation_scoring, colors, folder_path)),
+        (plot_DP_score_boxplot, (Disease_perturbation_scoring, colors, folder_path)),
+        (plot_DP_score_with_sample_information, (Disease_perturbation_scoring, colors, folder_path, sample_info_category, sample_category, data_type))
+    ]
+    render_figures(figures, figure_formats, dpi, n_jobs, recorder)
+
+def score_separation(Disease_perturbation_scoring, negative_category, positive_category):
+    """
+    score_separation: Function to measure how well DP_Score separates the negative and positive samples
+    
+    Output:
+    separation: Mean DP_Score of both classes, their difference (ScoreSeparation) and the AUC of DP_Score for positive vs negative samples
+    """
+    negative_scores = Disease_perturbation_scoring.loc[Disease_perturbation_scoring['Class'] == negative_category, 'DP_Score']
+    positive_scores = Disease_perturbation_scoring.loc[Disease_perturbation_scoring['Class'] == positive_category, 'DP_Score']
+    
+    # AUC from the Mann-Whitney U statistic (average ranks for ties)
+    ranks = pd.concat([negative_scores, positive_scores], ignore_index=True).rank()
+    positive_rank_sum = ranks.iloc[len(negative_scores):].sum()
+    auc = (positive_rank_sum - len(positive_scores) * (len(positive_scores) + 1) / 2) / (len(negative_scores) * len(positive_scores))
+    
+    return {
+        'NegativeMeanDPScore': negative_scores.mean(),
+        'PositiveMeanDPScore': positive_scores.mean(),
+        'ScoreSeparation': positive_scores.mean() - negative_scores.mean(),
+        'AUC': auc
+    }
+
+def score_gene_pairs(reverse_gene_pairs_reslut, expr_df, sample_df, folder_path=None, pairs_format='csv', n_jobs=1, recorder=None, negative_samples=None,
+                     positive_samples=None, permutations_num=0, permutation_seed=0, gene_set_input=None, signature=False):
+    """
+    score_gene_pairs: Function to score the samples with the reversed gene pairs and the gene pairs with the samples, then export the tables
+    
+    Input Parameters:
+    reverse_gene_pairs_reslut: Reversed gene pairs, see Reverse_gene_pairs
+    expr_df: Expression matrix indexed by Symbol
+    sample_df: Sample information matrix
+    folder_path: Output path, or None to export nothing
+    negative_samples, positive_samples: Samples of the contrast, required by the permutation test
+    permutations_num: If > 0, every gene pair is tested with permutations_num label permutations (see permutation_test)
+    gene_set_input: Gene set of the pair search, which the permutation test searches again
+    signature: Also save the gene pairs as DPS_signature.npz in folder_path (see save_signature)
+    (other parameters: see DPS_Tool)
+    
+    Output:
+    Reverse_gene_pairs_result: Includes the columns: 'Gene1', 'Gene2', 'ReversalRatio' and 'ImportanceScore' (then 'AdjustedPValue' with the permutation test)
+    Disease_perturbation_scoring: Sample information matrix with the additional columns [DP_Score, Outlier]
+    """
+    recorder = recorder or StageRecorder()
+    
+    # ------------------------------
+    # 5. Calculate disease perturbation scores and export the score table
+    # ------------------------------
+    with recorder.stage('dp_score') as stage:
+        # Calculate disease perturbation scores and the ImportanceScore of gene pairs
+        Disease_perturbation_scoring, importance_score = DP_Score(reverse_gene_pairs_reslut, expr_df, sample_df)
+
+        # Export disease perturbation score table
+        if folder_path is not None:
+            file_path = os.path.join(folder_path, "DP_score_table.csv")
+            Disease_perturbation_scoring.to_csv(file_path)
+        stage['items'] = Disease_perturbation_scoring.shape[0]
+
+    # ------------------------------
+    # 6. Test the gene pairs against shuffled labels
+    # ------------------------------
+    if permutations_num > 0:
+        with recorder.stage('permutation') as stage:
+            p_values = permutation_test(reverse_gene_pairs_reslut, expr_df, negative_samples, positive_samples, permutations_num, permutation_seed, n_jobs,
+                                        gene_set_input)
+            stage['items'] = permutations_num
+
+    # ------------------------------
+    # 7. Export reversed gene pairs table with the ImportanceScore of gene pairs
+    # ------------------------------
+    with recorder.stage('importance') as stage:
+        # 1. Add ImportanceScore (and the permutation p-values) to reverse_gene_pairs_result
+        reverse_gene_pairs_reslut = reverse_gene_pairs_reslut.reset_index(drop=True)
+        reverse_gene_pairs_reslut['ImportanceScore'] = importance_score
+        if permutations_num > 0:
+            reverse_gene_pairs_reslut['AdjustedPValue'] = p_values
+    
+        # 2. Sort by ImportanceScore in descending order
+        reverse_gene_pairs_reslut = reverse_gene_pairs_reslut.sort_values(by='ImportanceScore', ascending=False).reset_index(drop=True)
+    
+        # 3. Export reversed gene pairs table, and the signature used to score new samples if requested
+        if folder_path is not None:
+            with GenePairsWriter(folder_path, "Gene_pairs_table", pairs_format, expr_df.index) as pairs_writer:
+                pairs_writer.write_frame(reverse_gene_pairs_reslut)
+            if signature:
+                save_signature(reverse_gene_pairs_reslut, os.path.join(folder_path, "DPS_signature.npz"))
+        stage['items'] = reverse_gene_pairs_reslut.shape[0]
+    
+    return reverse_gene_pairs_reslut, Disease_perturbation_scoring
+
+def export_results(reverse_gene_pairs_reslut, expr_df, sample_df, folder_path, sample_info_category=None, sample_category=None, data_type=None, pairs_format='csv', plots=True,
+                   figure_formats=FIGURE_FORMATS, dpi=None, n_jobs=1, recorder=None, negative_samples=None, positive_samples=None, permutations_num=0, permutation_seed=0,
+                   gene_set_input=None, signature=False):
+    """
+    export_results: Function to score the samples with the reversed gene pairs, then export the tables and figures
+    
+    Input Parameters:
+    (see score_gene_pairs and DPS_Tool)
+    
+    Output:
+    Reverse_gene_pairs_result, Disease_perturbation_scoring: See score_gene_pairs
+    Figures are plotted only if plots is True, in n_jobs processes; the stages are timed by recorder (optional)
+    """
+    recorder = recorder or StageRecorder()
+    reverse_gene_pairs_reslut, Disease_perturbation_scoring = score_gene_pairs(reverse_gene_pairs_reslut, expr_df, sample_df, folder_path, pairs_format, n_jobs, recorder,
+                                                                              negative_samples, positive_samples, permutations_num, permutation_seed, gene_set_input,
+                                                                              signature)
+
+    # ------------------------------
+    # 8. Plot figures
+    # ------------------------------
+    if plots:
+        plot_results(reverse_gene_pairs_reslut, Disease_perturbation_scoring, folder_path, sample_info_category, sample_category, data_type,
+                     figure_formats, dpi, n_jobs, recorder)
+
+    # ------------------------------
+    # 9. Output results
+    # ------------------------------
+    return reverse_gene_pairs_reslut, Disease_perturbation_scoring
+
+# ==============================
+#         Result cache
+# ==============================
+# Default size limit of the result cache (bytes)
+RESULT_CACHE_SIZE_LIMIT = 10 * 1024 ** 3
+
+# Version of the result cache layout and of the outputs, part of every key
+RESULT_CACHE_VERSION = 4
+
+# Returned results stored in each cache entry next to the output tables (JSON, never unpickled, since the cache may be writable by others)
+RESULT_CACHE_RESULTS_FILE = '.results.json'
+
+def frame_record(frame):
+    """
+    frame_record: Function to convert a dataframe into a JSON-serializable record (index, column names, dtypes and values)
+    
+    Python floats are written with their shortest exact representation, so the values are restored exactly
+    """
+    return {
+        'index': frame.index.tolist(),
+        'columns': [str(column) for column in frame.columns],
+        'dtypes': [str(dtype) for dtype in frame.dtypes],
+        'values': [frame[column].tolist() for column in frame.columns]
+    }
+
+def record_frame(record):
+    """
+    record_frame: Function to rebuild a dataframe from a record, see frame_record
+    """
+    return pd.DataFrame({column: pd.Series(values, dtype=dtype) for column, dtype, values in zip(record['columns'], record['dtypes'], record['values'])},
+                        columns=record['columns']).set_axis(pd.Index(record['index']), axis=0)
+
+def read_cached_results(tables_dir):
+    """
+    read_cached_results: Function to read the results stored with the cached tables
+    
+    Output:
+    found: Whether the results could be read (a missing or corrupt file is a cache miss)
+    results: (Reverse_gene_pairs_result, Disease_perturbation_scoring), or None for a threshold sweep
+    """
+    try:
+        with open(os.path.join(tables_dir, RESULT_CACHE_RESULTS_FILE)) as f:
+            records = json.load(f)['results']
+        return True, None if records is None else tuple(record_frame(record) for record in records)
+    except (OSError, ValueError, KeyError, TypeError):
+        return False, None
+
+def input_hashes(input_files):
+    """
+    input_hashes: Function to hash the content of the input files of a run (None for a missing optional input), see result_cache_keys
+    """
+    return [None if file_path is None else file_hash(file_path) for file_path in input_files]
+
+def result_cache_keys(inputs, table_params, figure_params):
+    """
+    result_cache_keys: Function to compute the result cache keys of a run
+    
+    Input Parameters:
+    inputs: Content hashes of the input files, see input_hashes
+    table_params: Parameters that affect the output tables
+    figure_params: Parameters that only affect the figures, or None if no figures are plotted
+    
+    Output:
+    table_key: Key of the output tables
+    figure_key: Key of the figures, within the entry of the tables (None without figures)
+    """
+    table_key = hashlib.sha256(json.dumps({'version': RESULT_CACHE_VERSION, 'inputs': inputs, 'params': table_params}, sort_keys=True).encode()).hexdigest()
+    figure_key = None if figure_params is None else hashlib.sha256(json.dumps(figure_params, sort_keys=True).encode()).hexdigest()[:16]
+    return table_key, figure_key
 
-        # Set axis labels
-        ax.set_xlabel('DP_Score', fontsize=12)
-        ax.set_ylabel(sample_info_category, fontsize=12)
+def contrast_cache_keys(inputs, negative_category, positive_category, thresholds, remove_duplicate_gene_pairs, backend, max_pairs, pairs_format, stream_pairs,
+                        permutations_num, permutation_seed, pruning, signature, plots, sample_info_category, sample_category, data_type, figure_formats, dpi):
+    """
+    contrast_cache_keys: Function to compute the result cache keys of one contrast, the same for DPS_Tool and DPS_Tool_batch
+    
+    Input Parameters:
+    inputs: Content hashes of the input files, see input_hashes
+    (other parameters: see DPS_Tool)
+    
+    Output:
+    table_key, figure_key: See result_cache_keys
+    """
+    # The exact pruning does not change the results
+    table_params = [negative_category, positive_category, thresholds, remove_duplicate_gene_pairs, backend, max_pairs, pairs_format, stream_pairs,
+                    permutations_num, permutation_seed, pruning if pruning == 'approximate' else None, signature]
+    figure_params = [sample_info_category, sample_category, data_type, list(figure_formats), dpi] if plots else None
+    return result_cache_keys(inputs, table_params, figure_params)
 
-        # Adjust axis tick label font size
-        ax.tick_params(axis='both', which='major', labelsize=10)
+def is_figure_file(file_path):
+    """
+    is_figure_file: Function to tell figure files (see FIGURE_DPI) from tables
+    """
+    return file_path.rsplit('.', 1)[-1] in FIGURE_DPI
 
-        # Save the figure
-        file_path = os.path.join(folder_path, "DP_score_with_sample_information.pdf")
-        plt.savefig(file_path, format='pdf', dpi=600, bbox_inches='tight') 
+def link_or_copy_tree(source_dir, target_dir, select, link=True):
+    """
+    link_or_copy_tree: Function to hardlink (or copy across file systems) the selected files of a directory tree into another directory
+    (always copy if link is False)
+    
+    Output:
+    files_num: Number of files linked or copied
+    """
+    files_num = 0
+    for root, _, file_names in os.walk(source_dir):
+        relative_root = os.path.relpath(root, source_dir)
+        for file_name in file_names:
+            relative_path = os.path.normpath(os.path.join(relative_root, file_name))
+            if file_name == RESULT_CACHE_RESULTS_FILE or not select(relative_path):
+                continue
+            target_path = os.path.join(target_dir, relative_path)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            if os.path.exists(target_path):
+                os.remove(target_path)
+            try:
+                if not link:
+                    raise OSError
+                os.link(os.path.join(root, file_name), target_path)
+            except OSError:
+                shutil.copy2(os.path.join(root, file_name), target_path)
+            files_num += 1
+    return files_num
 
-        png_path = os.path.join(folder_path, "DP_score_with_sample_information.png")
-        plt.savefig(png_path, format='png', dpi=300, bbox_inches='tight')
+def restore_cached_results(result_cache_dir, table_key, figure_key, folder_path):
+    """
+    restore_cached_results: Function to materialize cached outputs into the output folder
+    
+    Output:
+    tables_hit: Whether the output tables were found and restored
+    figures_hit: Whether the figures were found and restored (True if figure_key is None)
+    results: Results returned by DPS_Tool for the cached tables (None for a threshold sweep or a miss)
+    """
+    entry_dir = os.path.join(result_cache_dir, table_key)
+    tables_dir = os.path.join(entry_dir, 'tables')
+    if not os.path.isdir(tables_dir):
+        return False, False, None
+    found, results = read_cached_results(tables_dir)
+    if not found:
+        # Drop the unreadable tables so that this run stores them again
+        shutil.rmtree(tables_dir, ignore_errors=True)
+        return False, False, None
+    
+    figures_dir = None if figure_key is None else os.path.join(entry_dir, 'figures-' + figure_key)
+    figures_hit = figures_dir is None or os.path.isdir(figures_dir)
+    if not figures_hit and results is None:
+        # The figures of a threshold sweep cannot be plotted from the cached results, the sweep is run again
+        return False, False, None
+    
+    # Mark the entry as recently used
+    os.utime(entry_dir)
+    link_or_copy_tree(tables_dir, folder_path, lambda file_path: True)
+    if figures_dir is not None and figures_hit:
+        link_or_copy_tree(figures_dir, folder_path, lambda file_path: True)
+    return True, figures_hit, results
 
-    else:
-        raise ValueError("Error in data_type parameter, please enter 'Discrete' or 'Continuous'!")
+def store_cached_results(result_cache_dir, table_key, figure_key, folder_path, results, result_cache_size_limit=RESULT_CACHE_SIZE_LIMIT):
+    """
+    store_cached_results: Function to store the outputs of a run in the result cache, the tables and the figures separately,
+    so that a run differing only in plotting options reuses the tables
+    """
+    entry_dir = os.path.join(result_cache_dir, table_key)
+    os.makedirs(entry_dir, exist_ok=True)
+    
+    parts = [('tables', lambda file_path: not is_figure_file(file_path))]
+    if figure_key is not None:
+        parts.append(('figures-' + figure_key, is_figure_file))
+    for part_name, select in parts:
+        part_dir = os.path.join(entry_dir, part_name)
+        if os.path.isdir(part_dir):
+            continue
         
+        # Write the part into a temporary directory first so that a partially written part is never used;
+        # outputs are copied, not linked, so that rewriting the output folder later leaves the cache intact
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=entry_dir)
+        link_or_copy_tree(folder_path, tmp_dir, select, link=False)
+        if part_name == 'tables':
+            with open(os.path.join(tmp_dir, RESULT_CACHE_RESULTS_FILE), 'w') as f:
+                json.dump({'results': None if results is None else [frame_record(frame) for frame in results]}, f)
+        try:
+            os.rename(tmp_dir, part_dir)
+        except OSError:
+            # Another run stored the same outputs in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    
+    os.utime(entry_dir)
+    evict_cache_entries(result_cache_dir, result_cache_size_limit)
+
 # ==============================
 #           DPS_Tool
 # ==============================
+def run_contrast(expr_df, sample_df, negative_category, positive_category, folder_path, thresholds, remove_duplicate_gene_pairs=False, gene_set_input=None,
+                 sample_info_category=None, sample_category=None, data_type=None, backend='tiled', n_jobs=1, max_pairs=None, pairs_format='csv',
+                 stream_pairs=False, plots=True, figure_formats=FIGURE_FORMATS, dpi=None, permutations_num=0, permutation_seed=0, pruning=None, recorder=None,
+                 incremental_dir=None, incremental_samples=INCREMENTAL_SAMPLES, signature=False):
+    """
+    run_contrast: Function to search the reversed gene pairs of one negative/positive contrast and export its results
+    
+    Input Parameters:
+    expr_df: Rank matrix of all samples (Symbol, then one column per sample), see rank_expression_matrix
+    sample_df: Sample information matrix
+    thresholds: List of reversal ratio thresholds; more than one runs a threshold sweep
+    (other parameters: see DPS_Tool)
+    
+    Output:
+    results: (Reverse_gene_pairs_result, Disease_perturbation_scoring), see export_results, or None for a threshold sweep
+    """
+    recorder = recorder or StageRecorder()
+    
+    # ------------------------------
+    # 1. Adjust matrix order and obtain negative and positive sample counts
+    # ------------------------------
+    negative_samples = sample_df[sample_df['Class'] == negative_category]['Sample'].tolist()
+    positive_samples = sample_df[sample_df['Class'] == positive_category]['Sample'].tolist()
+    
+    # Extract the ranks of the negative and positive samples
+    expr_df1 = expr_df[['Symbol'] + negative_samples + positive_samples]
+    negative_samples_num = len(negative_samples)
+    positive_samples_num = len(positive_samples)
+
+    # ------------------------------
+    # 2. Extract reversed gene pairs
+    # ------------------------------
+    with GenePairsWriter(folder_path, "All_gene_pairs_table", pairs_format, expr_df['Symbol'], index=False) if stream_pairs else contextlib.nullcontext() as pairs_writer:
+        if len(thresholds) > 1:
+            sweep_results = Reverse_gene_pairs_sweep(expr_df1, negative_samples_num, positive_samples_num, thresholds, remove_duplicate_gene_pairs, gene_set_input, backend, n_jobs, max_pairs, pairs_writer, recorder, pruning,
+                                                     incremental_dir, incremental_samples)
+        else:
+            reverse_gene_pairs_reslut = Reverse_gene_pairs(expr_df1, negative_samples_num, positive_samples_num, thresholds[0], remove_duplicate_gene_pairs, gene_set_input, backend, n_jobs, max_pairs, pairs_writer, recorder, pruning,
+                                                           incremental_dir, incremental_samples)
+    
+    expr_df = expr_df.set_index(expr_df.columns[0]) 
+    
+    # ------------------------------
+    # 3. Threshold sweep: export the results of every threshold into its own folder and summarize them
+    # ------------------------------
+    if len(thresholds) > 1:
+        summary = []
+        for threshold, reverse_gene_pairs_reslut, pairs_num in sweep_results:
+            summary_row = {'Threshold': threshold, 'PairsAboveThreshold': pairs_num, 'GenePairsNum': 0}
+            if isinstance(reverse_gene_pairs_reslut, ValueError):
+                summary_row['Status'] = f"failed: {reverse_gene_pairs_reslut}"
+            else:
+                threshold_folder_path = os.path.join(folder_path, f"threshold_{threshold:g}")
+                os.makedirs(threshold_folder_path, exist_ok=True)
+                Reverse_gene_pairs_result, Disease_perturbation_scoring = export_results(
+                    reverse_gene_pairs_reslut, expr_df, sample_df, threshold_folder_path, sample_info_category, sample_category, data_type, pairs_format, plots,
+                    figure_formats, dpi, n_jobs, recorder, negative_samples, positive_samples, permutations_num, permutation_seed, gene_set_input, signature)
+                summary_row['GenePairsNum'] = Reverse_gene_pairs_result.shape[0]
+                summary_row.update(score_separation(Disease_perturbation_scoring, negative_category, positive_category))
+                summary_row['Status'] = "completed"
+            summary.append(summary_row)
+        
+        file_path = os.path.join(folder_path, "Threshold_sweep_summary.csv")
+        pd.DataFrame(summary).to_csv(file_path, index=False)
+        results = None
+    else:
+        results = export_results(reverse_gene_pairs_reslut, expr_df, sample_df, folder_path, sample_info_category, sample_category, data_type, pairs_format, plots,
+                                 figure_formats, dpi, n_jobs, recorder, negative_samples, positive_samples, permutations_num, permutation_seed, gene_set_input,
+                                 signature)
+    
+    return results
+
 def DPS_Tool(expression_matrix_input, sample_info_input, negative_category, positive_category, folder_path,
              reversal_ratio_threshold=0.5, remove_duplicate_gene_pairs=False, gene_set_input=None,
-             sample_info_category=None, sample_category=None, data_type=None):
+             sample_info_category=None, sample_category=None, data_type=None, backend='tiled', n_jobs=1, max_pairs=None,
+             pairs_format='csv', stream_pairs=False, cache_dir=None, cache_size_limit=CACHE_SIZE_LIMIT, plots=True,
+             figure_formats=FIGURE_FORMATS, dpi=None, progress_file=None, result_cache_dir=None, result_cache_size_limit=RESULT_CACHE_SIZE_LIMIT,
+             permutations_num=0, permutation_seed=0, symbols_input=None, samples_input=None, pruning=None, incremental_dir=None,
+             incremental_samples=INCREMENTAL_SAMPLES, signature=False):
     """
     DPS_Tool(Disease Perturbation Scoring Tool):A Function for Disease Perturbation Scoring
 
@@ -567,8 +3156,11 @@ def DPS_Tool(expression_matrix_input, sample_info_input, negative_category, posi
        - The first column must be Gene symbol (column name: "Symbol"), and the remaining columns are expression levels for each sample (column names: sample names)
        - The number of sample classes should be between 2 and 10, and both the negative and positive classes must each have ≥10 samples
        - The number of genes must be greater than 100
-       - Expression values can be normalized or raw (e.g., Count, TPM, FPKM, etc.)
-       - Each gene must have non-zero expression in at least 80% of the samples
+       - Expression values can be normalized or raw (e.g., Count, TPM, FPKM, etc.); only the order of the genes within each sample is used,
+         so the pair search runs on the per-sample ranks of the negative and positive samples (see RankMatrix)
+       - Each gene must have non-zero expression in at least 80% of the samples (dense CSV input)
+       - Mostly-zero data (e.g. single-cell pseudo-bulk) can instead be a sparse matrix: MatrixMarket (.mtx, .mtx.gz) or scipy.sparse.save_npz (.npz),
+         genes x samples, with the gene symbols and sample names in symbols_input and samples_input; it stays sparse through the pair search
     2. sample_info_input (Sample Information Matrix):
        - CSV file
        - First column: sample name (column name: "Sample"),
@@ -585,6 +3177,8 @@ def DPS_Tool(expression_matrix_input, sample_info_input, negative_category, posi
     6. reversal_ratio_threshold (Reversal Ratio Threshold):
        - Threshold used to extract reversed gene pairs
        - Value must be ≥ 0.3 and ≤ 1, default is 0.5
+       - A list of thresholds runs a threshold sweep: pair ratios are computed once, the results of each threshold are written to
+         "threshold_<value>" subfolders and summarized in Threshold_sweep_summary.csv (pair counts and score separation per threshold)
     7. remove_duplicate_gene_pairs (Remove Duplicate Gene Pairs):
        - By default, duplicates are not removed
        - If enabled, for gene pairs with the same gene(s), only the one with the highest reversal ratio will be retained
@@ -592,6 +3186,8 @@ def DPS_Tool(expression_matrix_input, sample_info_input, negative_category, posi
        - CSV file
        - A single-column file where the column name is the gene set name
        - Gene symbols in the column must exist in the "Symbol" column of the expression matrix
+       - The tiled and bitpacked backends only search the pairs of the gene set, so pairs with equal reversal ratios can be ordered
+         differently than by the reference backend, which sorts all pairs before selecting those of the gene set
     9. sample_info_category (Sample Information Category) (Optional):
        - Column name in the sample info matrix to be used for correlation analysis
        - Must be provided together with sample_category and data_type
@@ -603,10 +3199,78 @@ def DPS_Tool(expression_matrix_input, sample_info_input, negative_category, posi
        - Type of the sample information for correlation analysi
        - Must be either "Discrete" or "Continuous"
        - Must be provided together with sample_info_category and sample_category
+    12. backend (Pair Search Backend) (Optional):
+       - "tiled" (default): NumPy engine comparing gene x gene tiles
+       - "bitpacked": Tiles stored as packed uint64 bitsets per sample class and counted with popcounts
+       - "reference": Original implementation processing one gene at a time
+    13. n_jobs (Number of Worker Processes) (Optional):
+       - The gene pair search is split into balanced shards across a process pool, default is 1 (single core)
+    14. max_pairs (Maximum Number of Gene Pairs) (Optional):
+       - If provided, only the gene pairs with the highest reversal ratios are kept while searching, so memory does not grow with the number of pairs above the threshold
+       - Applied before removing duplicate gene pairs
+    15. pairs_format (Gene Pairs Table Format) (Optional):
+       - "csv" (default), "csv.gz", "csv.zst", "parquet" or "arrow"
+       - Parquet and Arrow output store Gene1/Gene2 as dictionary-encoded categoricals and have no index column
+    16. stream_pairs (Stream All Gene Pairs) (Optional):
+       - If enabled, all gene pairs above the threshold are streamed to All_gene_pairs_table (unsorted, without ImportanceScore) as the search proceeds
+    17. cache_dir (Expression Matrix Cache Directory) (Optional):
+       - If provided, the expression matrix is parsed once into a memory-mapped binary keyed on the file content hash
+       - Later runs on the same file only read the sample columns they use
+    18. cache_size_limit (Expression Matrix Cache Size Limit) (Optional):
+       - Maximum size of the cache directory in bytes, default is 10 GB; least recently used matrices are evicted
+    19. plots (Plot Figures) (Optional):
+       - If False, only the tables are written and matplotlib is never imported, default is True
+    20. figure_formats (Figure Formats) (Optional):
+       - File formats of the figures, among 'pdf', 'png' and 'svg', default is ('pdf', 'png')
+       - With n_jobs > 1 the figures are rendered concurrently
+    21. dpi (Figure Resolution) (Optional):
+       - Resolution of all figure formats, default is 600 dpi for PDF and 300 dpi for PNG and SVG
+    22. progress_file (Progress File) (Optional):
+       - Path of a JSON file updated with the current stage, the fraction of gene pairs compared, and the wall time,
+         peak RSS and number of items of each stage (load, ranks, pair_search, dedup, dp_score, permutation, importance and each plot)
+    23. result_cache_dir (Result Cache Directory) (Optional):
+       - If provided, the outputs are stored there, keyed on the content of the input files and the parameters; a repeated run
+         hardlinks (or copies) them into folder_path instead of recomputing them
+       - A run differing only in the plotting options (sample_info_category, sample_category, data_type, plots, figure_formats, dpi)
+         reuses the tables and only plots the figures
+    24. result_cache_size_limit (Result Cache Size Limit) (Optional):
+       - Maximum size of the result cache in bytes, default is 10 GB; least recently used results are evicted
+    25. permutations_num (Number of Permutations) (Optional):
+       - If > 0, the negative/positive labels are shuffled permutations_num times and the pair search is repeated for each permutation,
+         giving an empirical p-value (AdjustedPValue) for the reversal ratio of every gene pair; default is 0 (no permutation test)
+       - Every pair is compared with the largest reversal ratio of each permutation (max-T), so the p-values are adjusted for the
+         selection and the number of gene pairs searched (family-wise error rate); each permutation costs one pair search
+    26. permutation_seed (Permutation Seed) (Optional):
+       - Random seed of the permutations, default is 0; results do not depend on n_jobs
+    27. symbols_input (Gene Symbols File) (Optional):
+       - Gene symbols of a sparse expression matrix, one per line (only the first tab-separated field is used, as in features.tsv)
+    28. samples_input (Sample Names File) (Optional):
+       - Sample names of a sparse expression matrix, one per line
+    29. pruning (Pair Search Pruning) (Optional):
+       - None (default): every gene pair is compared
+       - "exact": genes are summarized by the number of samples of each class below or above per-sample expression quantiles, which bounds the
+         reversal ratio of their pairs; row blocks of genes with close expression levels skip the genes that cannot reach the threshold with them,
+         so the results are unchanged (the saving depends on how well separated the expression levels are)
+       - "approximate": pairs are also screened on 32 samples per class and only compared on all samples if they may reach the threshold;
+         a random 1% of the pairs is compared on all samples to estimate the recall
+       - The pair_search record of the progress file reports the fraction of gene pairs compared and the estimated recall
+       - Tiled and bitpacked backends with a dense expression matrix
+    30. incremental_dir (Incremental State Directory) (Optional):
+       - If provided, the negative and positive counts of the gene pairs that could still pass the threshold are stored there, and a later run
+         on the same cohort with added samples only compares the added samples to update them; the results are the same as those of a full run
+       - The pair search is run on all samples again (and the state rebuilt) when samples were removed, changed or moved to another class,
+         when the genes or the gene set changed, or when too many samples were added for the threshold (see incremental_samples)
+       - Use one directory per contrast; the pair_search record of the progress file reports whether the state was updated or rebuilt
+       - Tiled and bitpacked backends
+    31. incremental_samples (Incremental Sample Margin) (Optional):
+       - Number of samples that can be added before the pair search is run on all samples again, default is 10
+       - A larger margin stores more gene pairs, since a pair's reversal ratio can move further with more added samples
+    32. signature (Save Signature) (Optional):
+       - If True, the gene pairs are also saved as DPS_signature.npz, which scores new samples without a pair search (see DPS_Score), default is False
 
     Output:
     1. Gene Pairs Table:
-    - Columns: [Gene1, Gene2, ReversalRatio, ImportanceScore]
+    - Columns: [Gene1, Gene2, ReversalRatio, ImportanceScore], then [AdjustedPValue] with the permutation test
     - Sorted in descending order by ImportanceScore
     2. DP_score Table:
     - Based on the sample information matrix, with two additional columns: [DP_Score, Outlier]
@@ -614,6 +3278,7 @@ def DPS_Tool(expression_matrix_input, sample_info_input, negative_category, posi
     4. Bar Plot of Disease Perturbation Scores
     5. Boxplot of Disease Perturbation Scores Grouped by Sample Class
     6. If sample_info_category, sample_category, and data_type are provided: Additional boxplot or correlation plot will be generated
+    7. If signature is True: DPS_signature.npz
 
     Example Dataset:
     Transcriptome data from 58 pancreatic islet samples from patients undergoing pancreatectomy:
@@ -622,10 +3287,38 @@ def DPS_Tool(expression_matrix_input, sample_info_input, negative_category, posi
     - Includes fasting glucose levels and gene sets related to β-cell identity and maturity
     """
 
+    recorder = StageRecorder(progress_file)
+    thresholds = np.atleast_1d(reversal_ratio_threshold).astype(float).tolist()
+    
+    # ------------------------------
+    # 0. Restore the outputs of an identical earlier run from the result cache
+    # ------------------------------
+    if result_cache_dir is not None:
+        with recorder.stage('result_cache') as stage:
+            inputs = input_hashes([expression_matrix_input, sample_info_input, gene_set_input, symbols_input, samples_input])
+            table_key, figure_key = contrast_cache_keys(inputs, negative_category, positive_category, thresholds, remove_duplicate_gene_pairs, backend, max_pairs,
+                                                        pairs_format, stream_pairs, permutations_num, permutation_seed, pruning, signature, plots,
+                                                        sample_info_category, sample_category, data_type, figure_formats, dpi)
+            tables_hit, figures_hit, results = restore_cached_results(result_cache_dir, table_key, figure_key, folder_path)
+            stage['items'] = int(tables_hit) + int(figures_hit)
+        
+        if tables_hit and figures_hit:
+            return results
+        if tables_hit and results is not None:
+            # Only the plotting options differ: plot the figures from the cached results
+            plot_results(results[0], results[1], folder_path, sample_info_category, sample_category, data_type, figure_formats, dpi, n_jobs, recorder)
+            store_cached_results(result_cache_dir, table_key, figure_key, folder_path, results, result_cache_size_limit)
+            return results
+    
     # ------------------------------
     # 1. Import expression matrix
     # ------------------------------
-    expr_df = pd.read_csv(expression_matrix_input, sep=',')
+    with recorder.stage('load') as stage:
+        expr_df = load_expression_matrix(expression_matrix_input, cache_dir, cache_size_limit, symbols_input, samples_input)
+        stage['items'] = expr_df.shape[0]
+    
+    # Rank the genes within every sample once, dropping the expression values before the pair search
+    expr_df = rank_expression_matrix(expr_df, recorder)
     
     # ------------------------------
     # 2. Import sample information matrix
@@ -633,139 +3326,894 @@ def DPS_Tool(expression_matrix_input, sample_info_input, negative_category, posi
     sample_df = pd.read_csv(sample_info_input, sep=',')
         
     # ------------------------------
-    # 3. Adjust matrix order and obtain negative and positive sample counts
+    # 3. Search reversed gene pairs and export the results of the contrast
+    # ------------------------------
+    results = run_contrast(expr_df, sample_df, negative_category, positive_category, folder_path, thresholds, remove_duplicate_gene_pairs, gene_set_input,
+                           sample_info_category, sample_category, data_type, backend, n_jobs, max_pairs, pairs_format, stream_pairs,
+                           plots, figure_formats, dpi, permutations_num, permutation_seed, pruning, recorder, incremental_dir, incremental_samples, signature)
+    
+    # ------------------------------
+    # 4. Store the outputs in the result cache
+    # ------------------------------
+    if result_cache_dir is not None:
+        store_cached_results(result_cache_dir, table_key, figure_key, folder_path, results, result_cache_size_limit)
+    
+    return results
+
+# ==============================
+#          DPS_Analysis
+# ==============================
+class DPSResult:
+    """
+    DPSResult: Results of an in-memory analysis, see DPS_Analysis
+    
+    Attributes:
+    gene_pairs: Gene pairs table, columns [Gene1, Gene2, ReversalRatio, ImportanceScore] (then [AdjustedPValue] with the permutation test),
+                sorted in descending order by ImportanceScore
+    scores: DP_score table, the sample information matrix with the additional columns [DP_Score, Outlier]
+    importance: ImportanceScore of the gene pairs (NumPy array, in the order of gene_pairs)
+    timings: Stage records of the run: wall time, peak RSS and number of items of each stage (see StageRecorder)
+    """
+    __slots__ = ('gene_pairs', 'scores', 'importance', 'timings')
+
+    def __init__(self, gene_pairs, scores, timings):
+        self.gene_pairs = gene_pairs
+        self.scores = scores
+        self.importance = gene_pairs['ImportanceScore'].to_numpy()
+        self.timings = timings
+
+def DPS_Analysis(expression, sample_info, negative_category, positive_category, symbols=None, samples=None, folder_path=None,
+                 reversal_ratio_threshold=0.5, remove_duplicate_gene_pairs=False, gene_set=None, backend='tiled', n_jobs=1, max_pairs=None,
+                 pruning=None, permutations_num=0, permutation_seed=0, pairs_format='csv', plots=False, sample_info_category=None,
+                 sample_category=None, data_type=None, figure_formats=FIGURE_FORMATS, dpi=None, progress_file=None, signature=False):
+    """
+    DPS_Analysis: Function to run DPS-Tool on an expression matrix held in memory and return its results as a DPSResult
+    
+    Input Parameters:
+    expression: Expression matrix (genes x samples), see expression_frame: a dataframe starting with a Symbol column (as the expression matrix file),
+                a dataframe of values indexed by gene symbol, or a NumPy array or scipy sparse matrix with symbols and samples;
+                its values are never copied, the genes are ranked within every sample a few samples at a time (see rank_expression_matrix)
+                and sparse matrices stay sparse
+    sample_info: Sample information dataframe (Sample, Class, Rank, then optional columns), see DPS_Tool
+    symbols, samples: Gene symbols and sample names, if expression does not hold them
+    folder_path: If provided, the tables (and the figures if plots is True) are also written there, as by DPS_Tool; nothing is written otherwise
+    reversal_ratio_threshold: Reversal ratio threshold (a single value)
+    gene_set: Gene symbols of a gene set (list-like) or path to a gene set file (optional)
+    plots: Plot the figures into folder_path, default is False
+    signature: Save the gene pairs as DPS_signature.npz into folder_path, default is False
+    (other parameters: see DPS_Tool)
+    
+    Output:
+    result: DPSResult
+    """
+    if plots and folder_path is None:
+        raise ValueError("Plotting the figures requires an output path!")
+    if signature and folder_path is None:
+        raise ValueError("Saving the signature requires an output path!")
+    recorder = StageRecorder(progress_file)
+    sample_df = sample_info
+    for category in (negative_category, positive_category):
+        if not (sample_df['Class'] == category).any():
+            raise ValueError(f"Class {category} does not exist in the sample information matrix!")
+    
+    # ------------------------------
+    # 1. Wrap the expression matrix without copying it and rank the genes within every sample
     # ------------------------------
+    expr_df = rank_expression_matrix(expression_frame(expression, symbols, samples), recorder)
     negative_samples = sample_df[sample_df['Class'] == negative_category]['Sample'].tolist()
     positive_samples = sample_df[sample_df['Class'] == positive_category]['Sample'].tolist()
+    contrast_df = expr_df[['Symbol'] + negative_samples + positive_samples]
     
-    # Extract expression matrix for negative and positive samples
-    expr_df1 = expr_df[['Symbol'] + negative_samples + positive_samples]
-    negative_samples_num = len(negative_samples)
-    positive_samples_num = len(positive_samples)
-
     # ------------------------------
-    # 4. Extract reversed gene pairs
+    # 2. Search reversed gene pairs, negative samples first
     # ------------------------------
-    reverse_gene_pairs_reslut = Reverse_gene_pairs(expr_df1, negative_samples_num, positive_samples_num, reversal_ratio_threshold, remove_duplicate_gene_pairs, gene_set_input)
-
+    reverse_gene_pairs_reslut = Reverse_gene_pairs(contrast_df, len(negative_samples), len(positive_samples),
+                                                   reversal_ratio_threshold, remove_duplicate_gene_pairs, gene_set, backend, n_jobs, max_pairs,
+                                                   recorder=recorder, pruning=pruning)
+    
     # ------------------------------
-    # 5. Calculate disease perturbation scores and export the score table
+    # 3. Score the samples and the gene pairs, and export the tables and figures if requested
     # ------------------------------
-    # Calculate disease perturbation scores
-    expr_df = expr_df.set_index(expr_df.columns[0]) 
-    Disease_perturbation_scoring, diff_matrix = DP_Score(reverse_gene_pairs_reslut, expr_df, sample_df)
+    if folder_path is not None:
+        os.makedirs(folder_path, exist_ok=True)
+    expr_df = expr_df.set_index(expr_df.columns[0])
+    gene_pairs, scores = score_gene_pairs(reverse_gene_pairs_reslut, expr_df, sample_df, folder_path, pairs_format, n_jobs, recorder,
+                                          negative_samples, positive_samples, permutations_num, permutation_seed, gene_set, signature)
+    if plots:
+        plot_results(gene_pairs, scores, folder_path, sample_info_category, sample_category, data_type, figure_formats, dpi, n_jobs, recorder)
+    
+    return DPSResult(gene_pairs, scores, recorder.stages)
 
-    # Export disease perturbation score table
-    file_path = os.path.join(folder_path, "DP_score_table.csv")
-    Disease_perturbation_scoring.to_csv(file_path)
+# ==============================
+#        DPS_Tool_batch
+# ==============================
+def contrast_folder_name(negative_category, positive_category):
+    """
+    contrast_folder_name: Function to get the output subfolder name of a contrast, "<negative>_vs_<positive>"
+    """
+    return re.sub(r'[^0-9A-Za-z._-]+', '_', f"{negative_category}_vs_{positive_category}")
+
+def parse_contrasts(text):
+    """
+    parse_contrasts: Function to parse comma-separated contrasts, e.g. "ND:T2D,ND:Pre" ("negative:positive")
+    """
+    contrasts = []
+    for contrast in text.split(','):
+        classes = contrast.split(':')
+        if len(classes) != 2 or not all(class_name.strip() for class_name in classes):
+            raise argparse.ArgumentTypeError(f"invalid contrast: {contrast}")
+        contrasts.append((classes[0].strip(), classes[1].strip()))
+    return contrasts
+
+def contrast_summary(rank_df, sample_df, negative_category, positive_category, folder_path, options, recorder=None, result_cache=None):
+    """
+    contrast_summary: Function to run one contrast of a batch and summarize it
+    
+    Input Parameters:
+    rank_df: Shared rank matrix (see RankMatrix), or the sparse expression matrix
+    options: Keyword arguments of run_contrast
+    result_cache: (result_cache_dir, table_key, figure_key, result_cache_size_limit) to store the outputs of the contrast in the result cache (optional)
+    
+    Output:
+    summary_row: See summarize_contrast
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    try:
+        results = run_contrast(rank_df, sample_df, negative_category, positive_category, folder_path, recorder=recorder, **options)
+    except ValueError as e:
+        # A contrast without enough reversed gene pairs does not stop the other contrasts
+        return summarize_contrast(sample_df, negative_category, positive_category, folder_path, None, e)
+    
+    if result_cache is not None:
+        result_cache_dir, table_key, figure_key, result_cache_size_limit = result_cache
+        store_cached_results(result_cache_dir, table_key, figure_key, folder_path, results, result_cache_size_limit)
+    return summarize_contrast(sample_df, negative_category, positive_category, folder_path, results)
+
+def summarize_contrast(sample_df, negative_category, positive_category, folder_path, results, error=None):
+    """
+    summarize_contrast: Function to summarize the results of one contrast of a batch
+    
+    Input Parameters:
+    results: Results of run_contrast (None for a threshold sweep)
+    error: ValueError that stopped the contrast (optional)
+    
+    Output:
+    summary_row: Sample counts, number of gene pairs, score separation (see score_separation) and status of the contrast
+    """
+    summary_row = {
+        'NegativeClass': negative_category,
+        'PositiveClass': positive_category,
+        'Folder': os.path.basename(folder_path),
+        'NegativeSamplesNum': int((sample_df['Class'] == negative_category).sum()),
+        'PositiveSamplesNum': int((sample_df['Class'] == positive_category).sum()),
+        'GenePairsNum': None
+    }
+    if error is not None:
+        summary_row['Status'] = f"failed: {error}"
+        return summary_row
+    
+    if results is not None:
+        summary_row['GenePairsNum'] = results[0].shape[0]
+        summary_row.update(score_separation(results[1], negative_category, positive_category))
+    summary_row['Status'] = "completed"
+    return summary_row
+
+def contrast_task(symbols, samples, sample_df, negative_category, positive_category, folder_path, options, result_cache=None):
+    """
+    contrast_task: Worker function running one contrast on the rank matrix attached from shared memory
+    
+    Output:
+    summary_row: See contrast_summary
+    wall_time, peak_rss: Run time (seconds) and peak memory (MB) of the worker process
+    """
+    start = time.perf_counter()
+    rank_df = RankMatrix(WORKER_STATE['values'], symbols, samples).frame()
+    summary_row = contrast_summary(rank_df, sample_df, negative_category, positive_category, folder_path, options, result_cache=result_cache)
+    return summary_row, time.perf_counter() - start, peak_rss_mb()
 
+def DPS_Tool_batch(expression_matrix_input, sample_info_input, contrasts, folder_path,
+                   reversal_ratio_threshold=0.5, remove_duplicate_gene_pairs=False, gene_set_input=None,
+                   sample_info_category=None, sample_category=None, data_type=None, backend='tiled', n_jobs=1, max_pairs=None,
+                   pairs_format='csv', stream_pairs=False, cache_dir=None, cache_size_limit=CACHE_SIZE_LIMIT, plots=True,
+                   figure_formats=FIGURE_FORMATS, dpi=None, progress_file=None, permutations_num=0, permutation_seed=0, symbols_input=None, samples_input=None,
+                   pruning=None, signature=False, result_cache_dir=None, result_cache_size_limit=RESULT_CACHE_SIZE_LIMIT, incremental_dir=None,
+                   incremental_samples=INCREMENTAL_SAMPLES):
+    """
+    DPS_Tool_batch: Function to run DPS_Tool on several negative/positive contrasts of the same cohort
+    
+    Input Parameters:
+    1. expression_matrix_input, sample_info_input: See DPS_Tool
+    2. contrasts (Contrasts):
+       - List of (negative_category, positive_category); both classes must exist in the "Class" column of the sample information matrix
+    3. folder_path (Output Path):
+       - The outputs of each contrast are written to a "<negative>_vs_<positive>" subfolder, as by DPS_Tool
+    4. n_jobs (Number of Worker Processes) (Optional):
+       - Contrasts run concurrently in up to n_jobs processes sharing the rank matrix; with a single contrast or a sparse expression matrix,
+         the contrasts run one after the other, each as DPS_Tool with n_jobs
+    5. progress_file (Progress File) (Optional):
+       - See DPS_Tool; with concurrent contrasts, one stage is recorded per contrast
+    6. result_cache_dir, result_cache_size_limit (Result Cache) (Optional):
+       - See DPS_Tool; every contrast is cached under the same key as by DPS_Tool, the expression matrix is only loaded if a contrast is missing
+    7. incremental_dir (Incremental State Directory) (Optional):
+       - See DPS_Tool; the state of every contrast is stored in its own "<negative>_vs_<positive>" subfolder
+    (other parameters: see DPS_Tool, applied to every contrast)
+    
+    Output:
+    batch_summary: One row per contrast (classes, subfolder, sample counts, GenePairsNum, score separation and status), also written to Batch_summary.csv
+    
+    The expression matrix is loaded once and replaced by per-sample gene ranks (see RankMatrix), which all contrasts share;
+    a sparse matrix stays sparse, as in DPS_Tool.
+    """
+    recorder = StageRecorder(progress_file)
+    thresholds = np.atleast_1d(reversal_ratio_threshold).astype(float).tolist()
+    
+    # ------------------------------
+    # 1. Import sample information matrix and check the contrasts
+    # ------------------------------
+    sample_df = pd.read_csv(sample_info_input, sep=',')
+    contrasts = [tuple(contrast) for contrast in contrasts]
+    if len(contrasts) == 0:
+        raise ValueError("No contrast provided!")
+    classes = set(sample_df['Class'])
+    for negative_category, positive_category in contrasts:
+        for category in (negative_category, positive_category):
+            if category not in classes:
+                raise ValueError(f"Class {category} does not exist in the sample information matrix!")
+    contrast_folders = [os.path.join(folder_path, contrast_folder_name(*contrast)) for contrast in contrasts]
+    if len(set(contrast_folders)) < len(contrast_folders):
+        raise ValueError("Duplicate contrasts!")
+    
+    # ------------------------------
+    # 2. Restore the contrasts of identical earlier runs from the result cache
+    # ------------------------------
+    summary = {}
+    result_caches = {}
+    if result_cache_dir is not None:
+        with recorder.stage('result_cache') as stage:
+            inputs = input_hashes([expression_matrix_input, sample_info_input, gene_set_input, symbols_input, samples_input])
+            for (negative_category, positive_category), contrast_folder_path in zip(contrasts, contrast_folders):
+                table_key, figure_key = contrast_cache_keys(inputs, negative_category, positive_category, thresholds, remove_duplicate_gene_pairs, backend,
+                                                            max_pairs, pairs_format, stream_pairs, permutations_num, permutation_seed, pruning, signature, plots,
+                                                            sample_info_category, sample_category, data_type, figure_formats, dpi)
+                os.makedirs(contrast_folder_path, exist_ok=True)
+                tables_hit, figures_hit, results = restore_cached_results(result_cache_dir, table_key, figure_key, contrast_folder_path)
+                if tables_hit and not figures_hit:
+                    # Only the plotting options differ: plot the figures from the cached results
+                    plot_results(results[0], results[1], contrast_folder_path, sample_info_category, sample_category, data_type, figure_formats, dpi,
+                                 n_jobs, recorder)
+                    store_cached_results(result_cache_dir, table_key, figure_key, contrast_folder_path, results, result_cache_size_limit)
+                if tables_hit:
+                    summary[negative_category, positive_category] = summarize_contrast(sample_df, negative_category, positive_category, contrast_folder_path,
+                                                                                       results)
+                else:
+                    result_caches[negative_category, positive_category] = (result_cache_dir, table_key, figure_key, result_cache_size_limit)
+            stage['items'] = len(summary)
+    pending = [(contrast, contrast_folder_path) for contrast, contrast_folder_path in zip(contrasts, contrast_folders) if contrast not in summary]
+    
+    # ------------------------------
+    # 3. Import expression matrix once and rank the genes within every sample (a sparse matrix stays sparse)
+    # ------------------------------
+    if pending:
+        with recorder.stage('load') as stage:
+            expr_df = load_expression_matrix(expression_matrix_input, cache_dir, cache_size_limit, symbols_input, samples_input)
+            stage['items'] = expr_df.shape[0]
+        if is_sparse_frame(expr_df.iloc[:, 1:]):
+            rank_matrix, rank_df = None, expr_df
+        else:
+            with recorder.stage('ranks') as stage:
+                rank_matrix = RankMatrix.from_frame(expr_df)
+                stage['items'] = len(rank_matrix.samples)
+            rank_df = rank_matrix.frame()
+        del expr_df
+    
     # ------------------------------
-    # 6. Calculate ImportanceScore of gene pairs and export reversed gene pairs table
+    # 4. Run the contrasts, concurrently if n_jobs > 1
     # ------------------------------
-    # 1. Get sample names where Rank == 0
-    rank_0_samples = Disease_perturbation_scoring.loc[Disease_perturbation_scoring['Rank'] == 0, 'Sample']
+    options = {
+        'thresholds': thresholds,
+        'remove_duplicate_gene_pairs': remove_duplicate_gene_pairs,
+        'gene_set_input': gene_set_input,
+        'sample_info_category': sample_info_category,
+        'sample_category': sample_category,
+        'data_type': data_type,
+        'backend': backend,
+        'n_jobs': n_jobs,
+        'max_pairs': max_pairs,
+        'pairs_format': pairs_format,
+        'stream_pairs': stream_pairs,
+        'plots': plots,
+        'figure_formats': figure_formats,
+        'dpi': dpi,
+        'permutations_num': permutations_num,
+        'permutation_seed': permutation_seed,
+        'pruning': pruning,
+        'signature': signature,
+        'incremental_samples': incremental_samples
+    }
+    contrast_options = {}
+    for (negative_category, positive_category), contrast_folder_path in pending:
+        # Every contrast has its own incremental state
+        contrast_options[negative_category, positive_category] = dict(options, incremental_dir=None if incremental_dir is None else
+                                                                      os.path.join(incremental_dir, os.path.basename(contrast_folder_path)))
+    # The pool shares the dense rank matrix; the contrasts of a sparse matrix run one after the other
+    contrast_jobs = min(n_jobs, len(pending)) if pending and rank_matrix is not None else 1
+    if contrast_jobs <= 1:
+        for (negative_category, positive_category), contrast_folder_path in pending:
+            with recorder.stage(f"contrast {negative_category} vs {positive_category}"):
+                summary[negative_category, positive_category] = contrast_summary(rank_df, sample_df, negative_category, positive_category, contrast_folder_path,
+                                                                                 contrast_options[negative_category, positive_category], recorder,
+                                                                                 result_caches.get((negative_category, positive_category)))
+    else:
+        # Each contrast runs in a single process; the rank matrix is placed in shared memory once so that workers never copy it
+        for contrast in contrast_options:
+            contrast_options[contrast]['n_jobs'] = 1
+        values = rank_matrix.ranks
+        shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        try:
+            np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+            with ProcessPoolExecutor(max_workers=contrast_jobs, initializer=attach_shared_values,
+                                     initargs=(shm.name, values.shape, values.dtype)) as executor:
+                futures = [executor.submit(contrast_task, rank_df['Symbol'].to_numpy(), rank_df.columns[1:].tolist(), sample_df,
+                                           negative_category, positive_category, contrast_folder_path, contrast_options[negative_category, positive_category],
+                                           result_caches.get((negative_category, positive_category)))
+                           for (negative_category, positive_category), contrast_folder_path in pending]
+                for ((negative_category, positive_category), _), future in zip(pending, futures):
+                    summary_row, wall_time, peak_rss = future.result()
+                    recorder.add_stage(f"contrast {negative_category} vs {positive_category}", wall_time, peak_rss, summary_row['GenePairsNum'])
+                    summary[negative_category, positive_category] = summary_row
+        finally:
+            shm.close()
+            shm.unlink()
+    
+    # ------------------------------
+    # 5. Export the batch summary
+    # ------------------------------
+    batch_summary = pd.DataFrame([summary[contrast] for contrast in contrasts])
+    batch_summary.insert(0, 'Contrast', [f"{negative_category} vs {positive_category}" for negative_category, positive_category in contrasts])
+    batch_summary.to_csv(os.path.join(folder_path, "Batch_summary.csv"), index=False)
+    return batch_summary
+
+# ==============================
+#      Bootstrap stability
+# ==============================
+def bootstrap_signature(values, symbols, resample, other_columns, negative_columns, positive_columns, rank_0_mask, options):
+    """
+    bootstrap_signature: Function to search the reversed gene pairs of one resample and score the pairs and the original samples
     
-    # 2. Subset expression matrix
-    matrix_A = diff_matrix[rank_0_samples] 
-    matrix_B = diff_matrix.drop(columns=rank_0_samples)  
+    Input Parameters:
+    values: Per-sample gene ranks (genes x samples of the sample information matrix, then the other samples of the expression matrix), see RankMatrix
+    symbols: Gene symbols
+    resample: Columns of the resampled samples (all classes)
+    other_columns: Columns of the expression matrix samples missing from the sample information matrix, counted in every ImportanceScore as in DPS_Tool
+    negative_columns, positive_columns: Columns of the resampled negative and positive samples
+    rank_0_mask: Boolean mask of the Rank 0 samples (columns of values)
+    options: Keyword arguments of the pair search (reversal_ratio_threshold, remove_duplicate_gene_pairs, gene_set_input, backend, max_pairs, pruning)
     
-    # 3. Compute ImportanceScore
-    count_A = (matrix_A < 0).sum(axis=1)  
-    count_B = (matrix_B >= 0).sum(axis=1)  
-    total_samples = expr_df.shape[1]  
-    importance_score = (count_A + count_B) / total_samples  
+    Output:
+    gene1, gene2: Row positions of the genes of the reversed gene pairs
+    importance_score: ImportanceScore of every pair in the resample and the other samples, over as many samples as the expression matrix has
+    dp_scores: DP_Score of the original samples of the sample information matrix with the gene pairs of the resample
+    """
+    contrast_df = pd.DataFrame(values[:, np.concatenate([negative_columns, positive_columns])], copy=False)
+    contrast_df.columns = contrast_df.columns.astype(str)
+    contrast_df.insert(0, 'Symbol', symbols)
+    reverse_gene_pairs_reslut = Reverse_gene_pairs(contrast_df, len(negative_columns), len(positive_columns), options['reversal_ratio_threshold'],
+                                                   options['remove_duplicate_gene_pairs'], options['gene_set_input'], options['backend'], 1, options['max_pairs'],
+                                                   pruning=options['pruning'])
+    gene1 = gene_positions(pd.Index(symbols), reverse_gene_pairs_reslut['Gene1'])
+    gene2 = gene_positions(pd.Index(symbols), reverse_gene_pairs_reslut['Gene2'])
     
-    # 4. Add ImportanceScore to reverse_gene_pairs_result
-    reverse_gene_pairs_reslut = reverse_gene_pairs_reslut.reset_index(drop=True)
-    reverse_gene_pairs_reslut['ImportanceScore'] = importance_score
+    # Only the genes of the pairs are compared
+    genes = np.unique(np.concatenate([gene1, gene2]))
+    gene_values = values[genes]
+    signature_gene1, signature_gene2 = np.searchsorted(genes, gene1), np.searchsorted(genes, gene2)
+    scored = np.concatenate([resample, other_columns])
+    _, pair_counts = count_pair_comparisons(gene_values[:, scored], signature_gene1, signature_gene2, rank_0_mask[scored])
+    sample_counts, _ = count_pair_comparisons(gene_values[:, :values.shape[1] - len(other_columns)], signature_gene1, signature_gene2)
+    return gene1, gene2, pair_counts / len(scored), sample_counts / len(gene1)
+
+def bootstrap_resample(values, symbols, other_columns, class_columns, negative_category, positive_category, rank_0_mask, options, seed_sequence):
+    """
+    bootstrap_resample: Function to draw one resample, with replacement within every sample class, and run bootstrap_signature on it
     
-    # 5. Sort by ImportanceScore in descending order
-    reverse_gene_pairs_reslut = reverse_gene_pairs_reslut.sort_values(by='ImportanceScore', ascending=False).reset_index(drop=True)
+    Input Parameters:
+    class_columns: Dictionary of the columns of every sample class
+    seed_sequence: Random seed sequence of the resample
+    (other parameters: see bootstrap_signature)
     
-    # 6. Export reversed gene pairs table
-    file_path = os.path.join(folder_path, "Gene_pairs_table.csv")
-    reverse_gene_pairs_reslut.to_csv(file_path)
+    Output:
+    signature: See bootstrap_signature, or the ValueError raised when the resample has too few reversed gene pairs
+    """
+    rng = np.random.default_rng(seed_sequence)
+    resampled_columns = {category: columns[rng.integers(0, len(columns), len(columns))] for category, columns in class_columns.items()}
+    resample = np.concatenate(list(resampled_columns.values()))
+    try:
+        return bootstrap_signature(values, symbols, resample, other_columns, resampled_columns[negative_category], resampled_columns[positive_category],
+                                   rank_0_mask, options)
+    except ValueError as e:
+        return e
+
+def bootstrap_task(symbols, other_columns, class_columns, negative_category, positive_category, rank_0_mask, options, seed_sequence):
+    """
+    bootstrap_task: Worker function running bootstrap_resample on the rank matrix attached from shared memory
+    """
+    return bootstrap_resample(WORKER_STATE['values'], symbols, other_columns, class_columns, negative_category, positive_category, rank_0_mask, options,
+                              seed_sequence)
 
+def DPS_Bootstrap(expression_matrix_input, sample_info_input, negative_category, positive_category, folder_path, resamples_num=100,
+                  reversal_ratio_threshold=0.5, remove_duplicate_gene_pairs=False, gene_set_input=None, backend='tiled', n_jobs=1, max_pairs=None,
+                  seed=0, confidence=0.95, cache_dir=None, cache_size_limit=CACHE_SIZE_LIMIT, progress_file=None, symbols_input=None, samples_input=None,
+                  pruning=None):
+    """
+    DPS_Bootstrap: Function to measure the stability of the reversed gene pairs and of the scores by resampling the samples
+    
+    Input Parameters:
+    1. expression_matrix_input, sample_info_input, negative_category, positive_category, folder_path: See DPS_Tool
+    2. resamples_num (Number of Resamples):
+       - Every resample draws the samples of each class with replacement, then searches the reversed gene pairs and scores them, default is 100
+    3. reversal_ratio_threshold, remove_duplicate_gene_pairs, gene_set_input, backend, max_pairs, pruning (Optional):
+       - Pair search settings, see DPS_Tool (a single threshold)
+    4. n_jobs (Number of Worker Processes) (Optional):
+       - Resamples run in a process pool sharing the ranked expression matrix, default is 1
+    5. seed (Random Seed) (Optional):
+       - Every resample has its own seed spawned from it, so results do not depend on n_jobs, default is 0
+    6. confidence (Confidence Level) (Optional):
+       - Level of the percentile intervals, default is 0.95
+    7. cache_dir, cache_size_limit, progress_file, symbols_input, samples_input (Optional):
+       - See DPS_Tool; the ranks of a sparse matrix are dense
+    
+    Output:
+    1. Bootstrap_pairs_table.csv:
+    - One row per gene pair selected in the full data or in any resample
+    - Columns: [Gene1, Gene2, Selected (in the full data), ImportanceScore (full data), SelectionFrequency (fraction of resamples selecting the pair),
+      ImportanceScoreMean, ImportanceScoreLower, ImportanceScoreUpper (over the resamples selecting the pair)]
+    - Sorted in descending order by SelectionFrequency, then ImportanceScore
+    2. Bootstrap_DP_score_table.csv:
+    - DP_Score of every sample with the gene pairs of the full data, and the mean and interval of its DP_Score with the gene pairs of the resamples
+    3. Bootstrap_summary.csv:
+    - Number of gene pairs of every resample, fraction of the gene pairs of the full data it selects, and status
+    """
+    recorder = StageRecorder(progress_file)
+    options = {
+        'reversal_ratio_threshold': reversal_ratio_threshold,
+        'remove_duplicate_gene_pairs': remove_duplicate_gene_pairs,
+        'gene_set_input': gene_set_input,
+        'backend': backend,
+        'max_pairs': max_pairs,
+        'pruning': pruning
+    }
+    
     # ------------------------------
-    # 7. Plot bar chart of TOP 10 gene pairs
+    # 1. Import the expression matrix once and rank the genes within every sample, the samples of the sample information matrix first;
+    # the other samples are never resampled, but count in every ImportanceScore as in DPS_Tool
     # ------------------------------
-    TOP10_gene_pairs_bar_chart = plot_TOP10_gene_pairs_bar_chart(reverse_gene_pairs_reslut, folder_path)
-    plt.close() 
+    sample_df = pd.read_csv(sample_info_input, sep=',')
+    for category in (negative_category, positive_category):
+        if not (sample_df['Class'] == category).any():
+            raise ValueError(f"Class {category} does not exist in the sample information matrix!")
+    with recorder.stage('load') as stage:
+        expr_df = load_expression_matrix(expression_matrix_input, cache_dir, cache_size_limit, symbols_input, samples_input)
+        stage['items'] = expr_df.shape[0]
+    with recorder.stage('ranks') as stage:
+        other_samples = expr_df.columns[1:].difference(sample_df['Sample'], sort=False)
+        rank_matrix = RankMatrix.from_frame(expr_df, sample_df['Sample'].tolist() + other_samples.tolist())
+        stage['items'] = len(rank_matrix.samples)
+    del expr_df
+    symbols = rank_matrix.symbols.to_numpy()
+    values = rank_matrix.ranks
+    del rank_matrix
+    
+    class_columns = {category: np.flatnonzero((sample_df['Class'] == category).to_numpy()) for category in sample_df['Class'].unique()}
+    other_columns = np.arange(len(sample_df), values.shape[1])
+    rank_0_mask = np.concatenate([(sample_df['Rank'] == 0).to_numpy(), np.zeros(len(other_columns), dtype=bool)])
     
     # ------------------------------
-    # 10. Plot score bar chart
+    # 2. Reversed gene pairs of the full data
     # ------------------------------
-    # Define color list
-    colors = [
-        '#AEC7E8', '#FFBB78', '#98DF8A', '#FF9896', 
-        '#C5B0D5', '#C49C94', '#F7B6D2', '#C7C7C7', 
-        '#DBDB8D', '#9EDAE5'
-    ]
+    with recorder.stage('pair_search') as stage:
+        gene1, gene2, importance_score, dp_scores = bootstrap_signature(values, symbols, np.arange(len(sample_df)), other_columns,
+                                                                        class_columns[negative_category], class_columns[positive_category], rank_0_mask,
+                                                                        options)
+        stage['items'] = len(gene1)
     
-    DP_score_bar_chart = plot_DP_score_bar_chart(Disease_perturbation_scoring, colors, folder_path)
-    plt.close() 
-
     # ------------------------------
-    # 11. Plot score boxplot
+    # 3. Resamples, in a process pool sharing the ranked expression matrix if n_jobs > 1
     # ------------------------------
-    DP_score_boxplot = plot_DP_score_boxplot(Disease_perturbation_scoring, colors, folder_path)
-    plt.close() 
+    seed_sequences = np.random.SeedSequence(seed).spawn(resamples_num)
+    with recorder.stage('bootstrap') as stage:
+        if n_jobs <= 1:
+            resample_results = []
+            for seed_sequence in seed_sequences:
+                resample_results.append(bootstrap_resample(values, symbols, other_columns, class_columns, negative_category, positive_category, rank_0_mask,
+                                                           options, seed_sequence))
+                recorder.progress(stage, len(resample_results), resamples_num)
+        else:
+            shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            try:
+                np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+                with ProcessPoolExecutor(max_workers=n_jobs, initializer=attach_shared_values,
+                                         initargs=(shm.name, values.shape, values.dtype)) as executor:
+                    futures = [executor.submit(bootstrap_task, symbols, other_columns, class_columns, negative_category, positive_category, rank_0_mask, options,
+                                               seed_sequence)
+                               for seed_sequence in seed_sequences]
+                    resample_results = []
+                    for future in futures:
+                        resample_results.append(future.result())
+                        recorder.progress(stage, len(resample_results), resamples_num)
+            finally:
+                shm.close()
+                shm.unlink()
+        stage['items'] = resamples_num
     
     # ------------------------------
-    # 12. Analyze scores in relation to sample information
+    # 4. Selection frequency and ImportanceScore interval of every gene pair
     # ------------------------------
-    DP_score_with_sample_information = plot_DP_score_with_sample_information(Disease_perturbation_scoring, colors, folder_path, sample_info_category=sample_info_category, sample_category=sample_category, data_type=data_type)
-    plt.close() 
+    lower_quantile, upper_quantile = (1 - confidence) / 2, (1 + confidence) / 2
+    genes_num = len(symbols)
+    original_keys = gene1.astype(np.int64) * genes_num + gene2
+    summary = []
+    resample_pairs = []
+    resample_dp_scores = []
+    for resample_index, resample_result in enumerate(resample_results):
+        if isinstance(resample_result, ValueError):
+            summary.append({'Resample': resample_index, 'GenePairsNum': 0, 'OriginalPairsSelected': 0.0, 'Status': f"failed: {resample_result}"})
+            continue
+        resample_gene1, resample_gene2, resample_importance_score, resample_dp_score = resample_result
+        keys = resample_gene1.astype(np.int64) * genes_num + resample_gene2
+        summary.append({'Resample': resample_index, 'GenePairsNum': len(keys), 'OriginalPairsSelected': np.isin(original_keys, keys).mean(), 'Status': "completed"})
+        resample_pairs.append(pd.DataFrame({'Key': keys, 'ImportanceScore': resample_importance_score}))
+        resample_dp_scores.append(resample_dp_score)
+    
+    resample_pairs = pd.concat(resample_pairs, ignore_index=True) if resample_pairs else pd.DataFrame({'Key': np.empty(0, dtype=np.int64), 'ImportanceScore': np.empty(0)})
+    grouped = resample_pairs.groupby('Key')['ImportanceScore']
+    pair_stability = pd.DataFrame({
+        'SelectionFrequency': grouped.size() / resamples_num,
+        'ImportanceScoreMean': grouped.mean(),
+        'ImportanceScoreLower': grouped.quantile(lower_quantile),
+        'ImportanceScoreUpper': grouped.quantile(upper_quantile)
+    })
+    original_pairs = pd.DataFrame({'Selected': True, 'ImportanceScore': importance_score}, index=pd.Index(original_keys, name='Key'))
+    pair_stability = original_pairs.join(pair_stability, how='outer')
+    pair_stability['Selected'] = pair_stability['Selected'].fillna(False).astype(bool)
+    pair_stability['SelectionFrequency'] = pair_stability['SelectionFrequency'].fillna(0.0)
+    keys = pair_stability.index.to_numpy()
+    pair_stability.insert(0, 'Gene1', symbols[keys // genes_num])
+    pair_stability.insert(1, 'Gene2', symbols[keys % genes_num])
+    pair_stability = pair_stability.sort_values(by=['SelectionFrequency', 'ImportanceScore'], ascending=False).reset_index(drop=True)
+    pair_stability.to_csv(os.path.join(folder_path, "Bootstrap_pairs_table.csv"), index=False)
     
     # ------------------------------
-    # 13. Output results
+    # 5. DP_Score interval of every sample and resample summary
     # ------------------------------
-    Reverse_gene_pairs_result = reverse_gene_pairs_reslut.iloc[:, :-1]
+    score_stability = sample_df[['Sample', 'Class']].copy()
+    score_stability['DP_Score'] = dp_scores
+    resample_dp_scores = np.array(resample_dp_scores).reshape(-1, len(score_stability))
+    score_stability['DP_ScoreMean'] = resample_dp_scores.mean(axis=0) if len(resample_dp_scores) else np.nan
+    score_stability['DP_ScoreLower'] = np.quantile(resample_dp_scores, lower_quantile, axis=0) if len(resample_dp_scores) else np.nan
+    score_stability['DP_ScoreUpper'] = np.quantile(resample_dp_scores, upper_quantile, axis=0) if len(resample_dp_scores) else np.nan
+    score_stability.to_csv(os.path.join(folder_path, "Bootstrap_DP_score_table.csv"), index=False)
+    pd.DataFrame(summary).to_csv(os.path.join(folder_path, "Bootstrap_summary.csv"), index=False)
+    
+    return pair_stability, score_stability
+
+# ==============================
+#           DPS_Score
+# ==============================
+def DPS_Score(signature_input, expression_matrix_input, folder_path, sample_info_input=None, cache_dir=None, cache_size_limit=CACHE_SIZE_LIMIT):
+    """
+    DPS_Score: Score new samples with a signature saved by DPS_Tool, without searching reversed gene pairs again
+    
+    Input Parameters:
+    1. signature_input (Signature File):
+       - DPS_signature.npz written by DPS_Tool with signature=True (--save_signature)
+    2. expression_matrix_input (Gene Expression Matrix):
+       - Same format as for DPS_Tool; only the genes of the signature are loaded
+    3. folder_path (Output Path):
+       - Path to save DP_score_table.csv
+    4. sample_info_input (Sample Information Matrix, optional):
+       - Same format as for DPS_Tool; if provided, the score table includes the sample information and the 'Outlier' column
+    5. cache_dir, cache_size_limit (optional):
+       - Expression matrix cache, see DPS_Tool
+    
+    Output:
+    Disease_perturbation_scoring: Disease perturbation score table
+    """
+    signature = load_signature(signature_input)
+    values, samples = load_signature_genes(expression_matrix_input, signature['symbols'], cache_dir, cache_size_limit)
+    normalized_scores = signature_scores(values, signature['gene1'], signature['gene2'])
+    
+    sample_df = None
+    if sample_info_input is not None:
+        sample_df = pd.read_csv(sample_info_input, sep=',')
+    Disease_perturbation_scoring = scoring_table(samples, normalized_scores, sample_df)
+    
+    file_path = os.path.join(folder_path, "DP_score_table.csv")
+    Disease_perturbation_scoring.to_csv(file_path)
+    return Disease_perturbation_scoring
+
+def parse_thresholds(text):
+    """
+    parse_thresholds: Function to parse a reversal ratio threshold, a list "0.3,0.4,0.5" or a range "start:stop:step" (stop included)
+    """
+    if ':' in text:
+        start, stop, step = (float(value) for value in text.split(':'))
+        return [round(float(value), 10) for value in np.arange(start, stop + step / 2, step)]
+    return [float(value) for value in text.split(',')]
+
+def parse_figure_formats(text):
+    """
+    parse_figure_formats: Function to parse comma-separated figure formats, e.g. "png,pdf,svg"
+    """
+    figure_formats = tuple(figure_format.strip().lower() for figure_format in text.split(','))
+    for figure_format in figure_formats:
+        if figure_format not in FIGURE_DPI:
+            raise argparse.ArgumentTypeError(f"invalid figure format: {figure_format}")
+    return figure_formats
+
+def build_score_parser():
+    """
+    build_score_parser: Function to build the command line parser of "DPS-Tool.py score"
+    """
+    parser = argparse.ArgumentParser(prog='DPS-Tool.py score', description='Score new samples with a saved DPS signature')
+    parser.add_argument('--signature', required=True, help='Path to DPS_signature.npz')
+    parser.add_argument('--expression_matrix', required=True, help='Path to expression matrix file')
+    parser.add_argument('--output_dir', required=True, help='Output directory')
+    parser.add_argument('--sample_info', default=None, help='Path to sample information file (optional)')
+    parser.add_argument('--cache_dir', default=None, help='Directory of the binary expression matrix cache (optional)')
+    parser.add_argument('--cache_size_mb', type=float, default=CACHE_SIZE_LIMIT / 1024 ** 2, help='Size limit of the expression matrix cache in MB (optional)')
+    return parser
+
+def add_analysis_arguments(parser):
+    """
+    add_analysis_arguments: Function to add the command line arguments shared by DPS-Tool.py and "DPS-Tool.py batch"
+    """
+    parser.add_argument('--expression_matrix', required=True, help='Path to expression matrix file (CSV, or sparse .mtx, .mtx.gz or .npz)')
+    parser.add_argument('--symbols_file', default=None, help='Gene symbols of a sparse expression matrix, one per line (optional)')
+    parser.add_argument('--samples_file', default=None, help='Sample names of a sparse expression matrix, one per line (optional)')
+    parser.add_argument('--sample_info', required=True, help='Path to sample information file')
+    parser.add_argument('--output_dir', required=True, help='Output directory')
+    parser.add_argument('--reversion_threshold', type=parse_thresholds, required=True, help='Reversal ratio threshold, or a sweep as "0.3,0.4,0.5" or "start:stop:step"')
+    parser.add_argument('--deduplicate', choices=['True', 'False'], required=True, help='Whether to deduplicate gene pairs')
+    parser.add_argument('--gene_set_file', default=None, help='Path to gene set file (optional)')
+    parser.add_argument('--sample_info_category', default=None, help='Sample information category (optional)')
+    parser.add_argument('--sample_category', default=None, help='Sample category (optional)')
+    parser.add_argument('--data_type', default=None, help='Data type (optional)')
+    parser.add_argument('--backend', choices=PAIR_SEARCH_BACKENDS, default='tiled', help='Pair search backend (optional)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for the gene pair search (optional)')
+    parser.add_argument('--max_pairs', '--max-pairs', type=int, default=None, help='Keep only the top K gene pairs by reversal ratio (optional)')
+    parser.add_argument('--pairs_format', choices=PAIRS_TABLE_FORMATS, default='csv', help='Format of the gene pairs table (optional)')
+    parser.add_argument('--stream_pairs', action='store_true', help='Stream all gene pairs above the threshold to All_gene_pairs_table (optional)')
+    parser.add_argument('--cache_dir', default=None, help='Directory of the binary expression matrix cache (optional)')
+    parser.add_argument('--cache_size_mb', type=float, default=CACHE_SIZE_LIMIT / 1024 ** 2, help='Size limit of the expression matrix cache in MB (optional)')
+    parser.add_argument('--outputs', choices=['all', 'tables'], default='all', help='Write tables and figures, or only the tables (optional)')
+    parser.add_argument('--no_plots', '--no-plots', dest='plots', action='store_false', help='Same as --outputs tables (optional)')
+    parser.add_argument('--figure_formats', '--figure-formats', type=parse_figure_formats, default=FIGURE_FORMATS, help='Comma-separated figure formats among pdf, png and svg (optional)')
+    parser.add_argument('--dpi', type=int, default=None, help='Resolution of the figures (optional)')
+    parser.add_argument('--permutations', type=int, default=0, help='Number of label permutations for the adjusted gene pair p-values (optional)')
+    parser.add_argument('--permutation_seed', type=int, default=0, help='Random seed of the label permutations (optional)')
+    parser.add_argument('--pruning', choices=PRUNING_MODES, default=None, help='Skip the gene pairs that cannot (exact) or are unlikely to (approximate) reach the threshold (optional)')
+    parser.add_argument('--save_signature', dest='signature', action='store_true', help='Save the gene pairs as DPS_signature.npz for "DPS-Tool.py score" (optional)')
+    parser.add_argument('--result_cache_dir', default=None, help='Directory of the result cache reused by identical runs (optional)')
+    parser.add_argument('--result_cache_size_mb', type=float, default=RESULT_CACHE_SIZE_LIMIT / 1024 ** 2, help='Size limit of the result cache in MB (optional)')
+    parser.add_argument('--incremental_dir', default=None, help='Directory of the persisted pair counts updated by later runs with added samples, one subfolder per contrast in a batch (optional)')
+    parser.add_argument('--incremental_samples', type=int, default=INCREMENTAL_SAMPLES, help='Number of samples that can be added before a full pair search (optional)')
+
+def build_parser():
+    """
+    build_parser: Function to build the command line parser of DPS-Tool.py
+    """
+    parser = argparse.ArgumentParser(description='DPS-Tool Analysis Script')
+    parser.add_argument('--negative_class', required=True, help='Negative sample class')
+    parser.add_argument('--positive_class', required=True, help='Positive sample class')
+    add_analysis_arguments(parser)
+    return parser
+
+def build_batch_parser():
+    """
+    build_batch_parser: Function to build the command line parser of "DPS-Tool.py batch"
+    """
+    parser = argparse.ArgumentParser(prog='DPS-Tool.py batch', description='Run DPS-Tool on several contrasts of the same cohort')
+    parser.add_argument('--contrasts', type=parse_contrasts, required=True, help='Comma-separated "negative:positive" sample classes, e.g. "ND:T2D,ND:Pre"')
+    add_analysis_arguments(parser)
+    return parser
+
+def run_task(args):
+    """
+    run_task: Function to run DPS_Tool with the parsed command line arguments
+    """
+    # Convert string to boolean
+    deduplicate = args.deduplicate == 'True'
+
+    DPS_Tool(
+        args.expression_matrix,
+        args.sample_info, 
+        args.negative_class,
+        args.positive_class,
+        args.output_dir,
+        args.reversion_threshold[0] if len(args.reversion_threshold) == 1 else args.reversion_threshold,
+        deduplicate,     
+        args.gene_set_file, 
+        args.sample_info_category, 
+        args.sample_category, 
+        args.data_type,
+        backend=args.backend,
+        n_jobs=args.workers,
+        max_pairs=args.max_pairs,
+        pairs_format=args.pairs_format,
+        stream_pairs=args.stream_pairs,
+        cache_dir=args.cache_dir,
+        cache_size_limit=int(args.cache_size_mb * 1024 ** 2),
+        plots=args.plots and args.outputs == 'all',
+        figure_formats=args.figure_formats,
+        dpi=args.dpi,
+        progress_file=task_progress_file(args.output_dir),
+        result_cache_dir=args.result_cache_dir,
+        result_cache_size_limit=int(args.result_cache_size_mb * 1024 ** 2),
+        permutations_num=args.permutations,
+        permutation_seed=args.permutation_seed,
+        symbols_input=args.symbols_file,
+        samples_input=args.samples_file,
+        pruning=args.pruning,
+        incremental_dir=args.incremental_dir,
+        incremental_samples=args.incremental_samples,
+        signature=args.signature
+        )
+
+def build_bootstrap_parser():
+    """
+    build_bootstrap_parser: Function to build the command line parser of "DPS-Tool.py bootstrap"
+    """
+    parser = argparse.ArgumentParser(prog='DPS-Tool.py bootstrap', description='Measure the stability of the reversed gene pairs and scores by resampling the samples')
+    parser.add_argument('--expression_matrix', required=True, help='Path to expression matrix file (CSV, or sparse .mtx, .mtx.gz or .npz)')
+    parser.add_argument('--symbols_file', default=None, help='Gene symbols of a sparse expression matrix, one per line (optional)')
+    parser.add_argument('--samples_file', default=None, help='Sample names of a sparse expression matrix, one per line (optional)')
+    parser.add_argument('--sample_info', required=True, help='Path to sample information file')
+    parser.add_argument('--negative_class', required=True, help='Negative sample class')
+    parser.add_argument('--positive_class', required=True, help='Positive sample class')
+    parser.add_argument('--output_dir', required=True, help='Output directory')
+    parser.add_argument('--reversion_threshold', type=float, required=True, help='Reversal ratio threshold')
+    parser.add_argument('--deduplicate', choices=['True', 'False'], required=True, help='Whether to deduplicate gene pairs')
+    parser.add_argument('--gene_set_file', default=None, help='Path to gene set file (optional)')
+    parser.add_argument('--backend', choices=PAIR_SEARCH_BACKENDS, default='tiled', help='Pair search backend (optional)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for the resamples (optional)')
+    parser.add_argument('--max_pairs', '--max-pairs', type=int, default=None, help='Keep only the top K gene pairs by reversal ratio (optional)')
+    parser.add_argument('--resamples', type=int, default=100, help='Number of resamples (optional)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the resamples (optional)')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Level of the percentile intervals (optional)')
+    parser.add_argument('--pruning', choices=PRUNING_MODES, default=None, help='Skip the gene pairs that cannot (exact) or are unlikely to (approximate) reach the threshold (optional)')
+    parser.add_argument('--cache_dir', default=None, help='Directory of the binary expression matrix cache (optional)')
+    parser.add_argument('--cache_size_mb', type=float, default=CACHE_SIZE_LIMIT / 1024 ** 2, help='Size limit of the expression matrix cache in MB (optional)')
+    return parser
+
+def run_batch_task(args):
+    """
+    run_batch_task: Function to run DPS_Tool_batch with the parsed command line arguments
+    """
+    DPS_Tool_batch(
+        args.expression_matrix,
+        args.sample_info,
+        args.contrasts,
+        args.output_dir,
+        args.reversion_threshold[0] if len(args.reversion_threshold) == 1 else args.reversion_threshold,
+        args.deduplicate == 'True',
+        args.gene_set_file,
+        args.sample_info_category,
+        args.sample_category,
+        args.data_type,
+        backend=args.backend,
+        n_jobs=args.workers,
+        max_pairs=args.max_pairs,
+        pairs_format=args.pairs_format,
+        stream_pairs=args.stream_pairs,
+        cache_dir=args.cache_dir,
+        cache_size_limit=int(args.cache_size_mb * 1024 ** 2),
+        plots=args.plots and args.outputs == 'all',
+        figure_formats=args.figure_formats,
+        dpi=args.dpi,
+        progress_file=task_progress_file(args.output_dir),
+        permutations_num=args.permutations,
+        permutation_seed=args.permutation_seed,
+        symbols_input=args.symbols_file,
+        samples_input=args.samples_file,
+        pruning=args.pruning,
+        signature=args.signature,
+        result_cache_dir=args.result_cache_dir,
+        result_cache_size_limit=int(args.result_cache_size_mb * 1024 ** 2),
+        incremental_dir=args.incremental_dir,
+        incremental_samples=args.incremental_samples
+        )
+
+def run_bootstrap_task(args):
+    """
+    run_bootstrap_task: Function to run DPS_Bootstrap with the parsed command line arguments
+    """
+    DPS_Bootstrap(
+        args.expression_matrix,
+        args.sample_info,
+        args.negative_class,
+        args.positive_class,
+        args.output_dir,
+        args.resamples,
+        args.reversion_threshold,
+        args.deduplicate == 'True',
+        args.gene_set_file,
+        backend=args.backend,
+        n_jobs=args.workers,
+        max_pairs=args.max_pairs,
+        seed=args.seed,
+        confidence=args.confidence,
+        cache_dir=args.cache_dir,
+        cache_size_limit=int(args.cache_size_mb * 1024 ** 2),
+        progress_file=task_progress_file(args.output_dir),
+        symbols_input=args.symbols_file,
+        samples_input=args.samples_file,
+        pruning=args.pruning
+        )
+
+def run_score_task(args):
+    """
+    run_score_task: Function to run DPS_Score with the parsed command line arguments
+    """
+    DPS_Score(
+        args.signature,
+        args.expression_matrix,
+        args.output_dir,
+        args.sample_info,
+        cache_dir=args.cache_dir,
+        cache_size_limit=int(args.cache_size_mb * 1024 ** 2)
+        )
+
+def task_progress_file(output_dir):
+    """
+    task_progress_file: Function to get the JSON progress file read by check_progress.php, next to the task status file
+    (None if there is no task_status directory)
+    """
+    if not os.path.isdir("task_status"):
+        return None
+    task_id = os.path.basename(output_dir)
+    return f"task_status/{task_id}.progress.json"
+
+def write_task_status(output_dir, status):
+    """
+    write_task_status: Function to write the task status read by check_status.php ("completed" or "failed: <reason>")
+    """
+    task_id = os.path.basename(output_dir)
+    with open(f"task_status/{task_id}.status", "w") as f:
+        f.write(status)
 
-def main():
+def main(argv=None):
+    """
+    main: Command line entry point; "DPS-Tool.py score ..." scores new samples with a saved signature,
+    "DPS-Tool.py batch ..." runs several contrasts and "DPS-Tool.py bootstrap ..." measures the stability of the results
+    
+    Input Parameters:
+    argv: Command line arguments (default: sys.argv[1:])
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) > 0 and argv[0] == 'score':
+        parser, task, argv = build_score_parser(), run_score_task, argv[1:]
+    elif len(argv) > 0 and argv[0] == 'batch':
+        parser, task, argv = build_batch_parser(), run_batch_task, argv[1:]
+    elif len(argv) > 0 and argv[0] == 'bootstrap':
+        parser, task, argv = build_bootstrap_parser(), run_bootstrap_task, argv[1:]
+    else:
+        parser, task = build_parser(), run_task
+
+    args = parser.parse_args(argv)
     try:
-        parser = argparse.ArgumentParser(description='DPS-Tool Analysis Script')
-        parser.add_argument('--expression_matrix', required=True, help='Path to expression matrix file')
-        parser.add_argument('--sample_info', required=True, help='Path to sample information file')
-        parser.add_argument('--negative_class', required=True, help='Negative sample class')
-        parser.add_argument('--positive_class', required=True, help='Positive sample class')
-        parser.add_argument('--output_dir', required=True, help='Output directory')
-        parser.add_argument('--reversion_threshold', type=float, required=True, help='Reversal ratio threshold')
-        parser.add_argument('--deduplicate', choices=['True', 'False'], required=True, help='Whether to deduplicate gene pairs')
-        parser.add_argument('--gene_set_file', default=None, help='Path to gene set file (optional)')
-        parser.add_argument('--sample_info_category', default=None, help='Sample information category (optional)')
-        parser.add_argument('--sample_category', default=None, help='Sample category (optional)')
-        parser.add_argument('--data_type', default=None, help='Data type (optional)')
-
-        args = parser.parse_args()
-
-        # Convert string to boolean
-        deduplicate = args.deduplicate == 'True'
-
-        DPS_Tool(
-            args.expression_matrix,
-            args.sample_info, 
-            args.negative_class,
-            args.positive_class,
-            args.output_dir,
-            args.reversion_threshold,
-            deduplicate,     
-            args.gene_set_file, 
-            args.sample_info_category, 
-            args.sample_category, 
-            args.data_type
-            )
+        task(args)
 
         # Update task status to 'completed'
-        task_id = os.path.basename(args.output_dir)
-        with open(f"task_status/{task_id}.status", "w") as f:
-            f.write("completed")
+        write_task_status(args.output_dir, "completed")
+
+    except MemoryError:
+        # A MemoryError usually has no message, and the job may be retried with a smaller matrix or a larger memory budget
+        write_task_status(args.output_dir, "failed: out of memory")
 
     except Exception as e:
         # Update task status to 'failed'
-        task_id = os.path.basename(args.output_dir)
-        with open(f"task_status/{task_id}.status", "w") as f:
-            f.write(f"failed: {str(e)}")    
+        write_task_status(args.output_dir, f"failed: {str(e)}")
                 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,273 @@
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import time
+import numpy as np
+
+# DPS-Tool.py is loaded by the dps_tool package, the parent directory of this script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dps_tool import load_dps_tool
+
+# Suffix of a job file claimed by the worker
+RUNNING_SUFFIX = '.running'
+
+# Memory reserved for every job besides its expression values: libraries allocated on first use, pair search tiles and output tables
+JOB_MEMORY_BASE = 256 * 1024 ** 2
+
+# Memory reserved per expression value (per stored entry of a sparse matrix): the parsed float64 values, the parser buffers and the ranks
+JOB_MEMORY_PER_VALUE = 32
+
+# ==============================
+#        Loading DPS-Tool
+# ==============================
+def preload_dps_tool():
+    """
+    preload_dps_tool: Function to import DPS-Tool.py as a module (see dps_tool.load_dps_tool) with the libraries it imports on first use
+
+    Output:
+    dps_tool: DPS-Tool module
+    """
+    dps_tool = load_dps_tool()
+
+    # DPS-Tool imports matplotlib and scipy on first use; import them here so that every job, forked from the worker, starts with them loaded
+    dps_tool.import_pyplot()
+    import scipy.stats
+    return dps_tool
+
+# ==============================
+#          Job queue
+# ==============================
+def queued_jobs(queue_dir):
+    """
+    queued_jobs: Function to list the queued job files, oldest first
+
+    Input Parameters:
+    queue_dir: Spool directory; upload.php writes one "<task_id>.json" file per task, containing {"task_id": ..., "argv": [...]}
+               where argv are the DPS-Tool.py command line arguments
+    """
+    jobs = []
+    for file_name in os.listdir(queue_dir):
+        if file_name.endswith('.json') and not file_name.startswith('.'):
+            file_path = os.path.join(queue_dir, file_name)
+            try:
+                jobs.append((os.path.getmtime(file_path), file_path))
+            except OSError:
+                continue
+    return [file_path for _, file_path in sorted(jobs)]
+
+def claim_job(job_path):
+    """
+    claim_job: Function to take a job file out of the queue by renaming it
+
+    Output:
+    running_path: Path of the claimed job file, or None if the job was taken by another worker
+    """
+    running_path = job_path + RUNNING_SUFFIX
+    try:
+        os.rename(job_path, running_path)
+    except OSError:
+        return None
+    return running_path
+
+def requeue_jobs(queue_dir):
+    """
+    requeue_jobs: Function to put back the jobs that were running when a previous worker stopped
+    """
+    for file_name in os.listdir(queue_dir):
+        if file_name.endswith('.json' + RUNNING_SUFFIX):
+            running_path = os.path.join(queue_dir, file_name)
+            os.rename(running_path, running_path[:-len(RUNNING_SUFFIX)])
+
+def read_status(task_id):
+    """
+    read_status: Function to read the status of a task, or None if it has no status file
+    """
+    status_file = f"task_status/{task_id}.status"
+    if not os.path.exists(status_file):
+        return None
+    with open(status_file) as f:
+        return f.read()
+
+# ==============================
+#         Memory budget
+# ==============================
+def job_expression_matrix(argv):
+    """
+    job_expression_matrix: Function to get the expression matrix path of a job from its DPS-Tool.py arguments, or None
+    """
+    for position, argument in enumerate(argv):
+        if argument == '--expression_matrix' and position + 1 < len(argv):
+            return argv[position + 1]
+        if argument.startswith('--expression_matrix='):
+            return argument.split('=', 1)[1]
+    return None
+
+def expression_values_num(file_path):
+    """
+    expression_values_num: Function to count the values of an expression matrix file without parsing it, genes x samples of a CSV file
+                           (lines x header fields) or stored entries of a sparse matrix (.mtx, .mtx.gz or .npz)
+    """
+    lower_path = file_path.lower()
+    if lower_path.endswith('.npz'):
+        with np.load(file_path) as matrix:
+            return int(matrix['data'].size)
+    if lower_path.endswith(('.mtx', '.mtx.gz')):
+        with (gzip.open(file_path, 'rt') if lower_path.endswith('.gz') else open(file_path)) as f:
+            # The size line follows the comments: rows, columns, stored entries
+            for line in f:
+                if not line.startswith('%'):
+                    return int(line.split()[2])
+        return 0
+    with open(file_path, 'rb') as f:
+        samples_num = f.readline().count(b',')
+        genes_num = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+    return genes_num * samples_num
+
+def job_memory(job, memory_budget):
+    """
+    job_memory: Function to estimate the memory of a job from the size of its expression matrix, at most the whole memory budget
+    """
+    try:
+        values_num = expression_values_num(job_expression_matrix(job['argv']))
+    except (OSError, AttributeError, TypeError, ValueError, IndexError, KeyError):
+        # A job whose input cannot be read fails when loading it
+        values_num = 0
+    return min(JOB_MEMORY_BASE + JOB_MEMORY_PER_VALUE * values_num, memory_budget)
+
+def fits_memory_budget(reserved_memory, memory, memory_budget):
+    """
+    fits_memory_budget: Function to check that a job can start, its memory added to the memory reserved by the running jobs staying
+                        within the budget; a job always starts when no other job is running
+    """
+    return reserved_memory == 0 or reserved_memory + memory <= memory_budget
+
+def address_space_size():
+    """
+    address_space_size: Function to get the address space of the current process (bytes), 0 where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except OSError:
+        return 0
+
+# ==============================
+#           Running jobs
+# ==============================
+def run_job(dps_tool, job, memory):
+    """
+    run_job: Function to run one job in a forked process
+
+    Input Parameters:
+    dps_tool: DPS-Tool module
+    job: Job description, {"task_id": ..., "argv": [...]}
+    memory: Memory reserved for the job (bytes), see job_memory, or None
+
+    The address space of the job is limited to that of the worker, which the job shares, plus its reserved memory, so that the running
+    jobs stay within the budget; a job going beyond gets a MemoryError, which DPS-Tool.py reports as "failed: out of memory".
+    """
+    if memory is not None:
+        memory_limit = address_space_size() + memory
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    dps_tool.main(job['argv'])
+
+def finish_job(task_id, running_path, exitcode):
+    """
+    finish_job: Function to remove a finished job and report jobs that died without writing their status
+    """
+    if exitcode != 0 and read_status(task_id) in (None, 'processing'):
+        reason = 'out of memory' if exitcode < 0 and -exitcode == signal.SIGKILL else f'worker process exited with code {exitcode}'
+        with open(f"task_status/{task_id}.status", "w") as f:
+            f.write(f"failed: {reason}")
+    os.remove(running_path)
+
+def serve(dps_tool, queue_dir, max_jobs=2, memory_budget=None, poll_interval=1.0):
+    """
+    serve: Function to run the queued jobs until SIGTERM or SIGINT, at most max_jobs at a time
+
+    Input Parameters:
+    dps_tool: DPS-Tool module
+    queue_dir: Spool directory (see queued_jobs)
+    max_jobs: Number of jobs run at the same time
+    memory_budget: Memory shared by the running jobs (bytes), or None; a job only starts once its estimated memory (see job_memory)
+                   fits in the budget left by the running jobs, in queue order
+    poll_interval: Seconds between two scans of the spool directory
+    """
+    context = multiprocessing.get_context('fork')
+    running = {}
+    stopping = []
+    # Memory estimates of the jobs waiting for the budget, so that their expression matrices are not read again at every scan
+    waiting_memory = {}
+
+    def stop(signum, frame):
+        stopping.append(signum)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    requeue_jobs(queue_dir)
+    while not stopping or running:
+        # 1. Collect finished jobs
+        for task_id, (process, running_path, _) in list(running.items()):
+            if not process.is_alive():
+                process.join()
+                finish_job(task_id, running_path, process.exitcode)
+                del running[task_id]
+
+        # 2. Start queued jobs while there are free slots
+        if not stopping:
+            for job_path in queued_jobs(queue_dir):
+                if len(running) >= max_jobs:
+                    break
+                running_path = claim_job(job_path)
+                if running_path is None:
+                    continue
+                try:
+                    with open(running_path) as f:
+                        job = json.load(f)
+                    task_id = job['task_id']
+                except (OSError, ValueError, KeyError):
+                    # Malformed job files are dropped
+                    os.remove(running_path)
+                    continue
+                
+                # A job that does not fit in the memory budget goes back to the queue, and the later jobs wait behind it
+                memory = None
+                if memory_budget is not None:
+                    memory = waiting_memory.pop(task_id, None) or job_memory(job, memory_budget)
+                    if not fits_memory_budget(sum(running_job[2] for running_job in running.values()), memory, memory_budget):
+                        waiting_memory[task_id] = memory
+                        os.rename(running_path, job_path)
+                        break
+                process = context.Process(target=run_job, args=(dps_tool, job, memory))
+                process.start()
+                running[task_id] = (process, running_path, memory)
+
+        time.sleep(poll_interval)
+
+def main():
+    parser = argparse.ArgumentParser(description='DPS-Tool worker: runs the tasks queued by upload.php')
+    parser.add_argument('--root', default='.', help='Web root containing task_queue/ and task_status/ (optional)')
+    parser.add_argument('--queue_dir', default='task_queue', help='Spool directory of the queued tasks, relative to the root (optional)')
+    parser.add_argument('--max_jobs', type=int, default=2, help='Number of tasks run at the same time (optional)')
+    parser.add_argument('--memory_mb', type=float, default=None, help='Memory budget shared by the running tasks in MB (optional)')
+    parser.add_argument('--poll_interval', type=float, default=1.0, help='Seconds between two scans of the queue (optional)')
+
+    args = parser.parse_args()
+
+    # The task status files are written relative to the web root, as by DPS-Tool.py
+    os.chdir(args.root)
+    os.makedirs(args.queue_dir, exist_ok=True)
+    os.makedirs('task_status', exist_ok=True)
+
+    memory_budget = None if args.memory_mb is None else int(args.memory_mb * 1024 ** 2)
+    serve(preload_dps_tool(), args.queue_dir, args.max_jobs, memory_budget, args.poll_interval)
+
+if __name__ == '__main__':
+    main()
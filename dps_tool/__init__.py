@@ -0,0 +1,42 @@
+"""
+dps_tool: Python API of DPS-Tool, e.g.
+
+    from dps_tool import DPS_Analysis
+    result = DPS_Analysis(expr_df, sample_df, 'ND', 'T2D')
+    result.gene_pairs, result.scores, result.importance, result.timings
+
+DPS-Tool.py is not an importable module name, so it is loaded from its path once as dps_tool.dps_tool_main and its entry points are
+re-exported; DPS-Worker.py and DPS-Benchmark.py load it with load_dps_tool. The module is registered in sys.modules under this name,
+which importing the package recreates, so that its process pools can pickle its functions with any start method (fork, spawn or
+forkserver).
+"""
+import importlib.util
+import os
+import sys
+
+DPS_TOOL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DPS-Tool.py')
+
+# Module name of DPS-Tool.py, which is also the package attribute holding it
+DPS_TOOL_MODULE = __name__ + '.dps_tool_main'
+
+def load_dps_tool():
+    """
+    load_dps_tool: Function to import DPS-Tool.py as a module, or get it if it was already imported
+    """
+    if DPS_TOOL_MODULE in sys.modules:
+        return sys.modules[DPS_TOOL_MODULE]
+    spec = importlib.util.spec_from_file_location(DPS_TOOL_MODULE, DPS_TOOL_PATH)
+    dps_tool = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = dps_tool
+    spec.loader.exec_module(dps_tool)
+    return dps_tool
+
+dps_tool_main = load_dps_tool()
+DPS_Analysis = dps_tool_main.DPS_Analysis
+DPSResult = dps_tool_main.DPSResult
+DPS_Tool = dps_tool_main.DPS_Tool
+DPS_Tool_batch = dps_tool_main.DPS_Tool_batch
+DPS_Bootstrap = dps_tool_main.DPS_Bootstrap
+DPS_Score = dps_tool_main.DPS_Score
+
+__all__ = ['DPS_Analysis', 'DPSResult', 'DPS_Tool', 'DPS_Tool_batch', 'DPS_Bootstrap', 'DPS_Score']
@@ -0,0 +1,255 @@
+"""
+baseline: Original single-threaded DPS-Tool implementation, kept unchanged as the reference the optimized pipeline must reproduce
+
+The reversed gene pairs search, the duplicate removal, DP_Score and the ImportanceScore below are copied from the first version of
+DPS-Tool.py (plots excluded). The tests and DPS-Benchmark.py compare the outputs of every backend against them; do not edit them.
+"""
+import pandas as pd
+import numpy as np
+
+# ==============================
+#       Reverse_gene_pairs
+# ==============================
+def Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, reversal_ratio_threshold, remove_duplicate_gene_pairs, gene_set_input):
+    """
+    Reverse_gene_pairs: Function to extract reversed gene pairs
+    
+    Input Parameters:
+    expr_df: An expression matrix sorted by Symbol, negative samples, and positive samples
+    negative_samples_num: Number of negative samples
+    positive_samples_num: Number of positive samples
+    reversal_ratio_threshold: Reversal proportion threshold
+    remove_duplicate_gene_pairs: Remove duplicates or not
+    gene_set_input: Path to gene set data
+    
+    Output:
+    reverse_gene_pairs_reslut: Includes the columns: 'Gene1', 'Gene2', and 'ReversalRatio' (reversal ratio)
+    """
+    expr_df = expr_df.set_index(expr_df.columns[0])  # Set the first column as the index
+    
+    def get_reverse_gene_pairs(row):
+        # Get the index of the current row
+        current_index = row.name
+    
+        # Get all rows below the current row
+        below_matrix = expr_df.loc[current_index:].iloc[1:]
+    
+        # Calculate the difference between the current row and all rows in below_matrix
+        diff = row - below_matrix
+
+        # Compute the proportion difference
+        neg_columns = diff.iloc[:, :negative_samples_num]
+        pos_columns = diff.iloc[:, negative_samples_num:]
+        neg_value = neg_columns < 0  
+        pos_value = pos_columns < 0 
+        neg_counts = neg_value.sum(axis=1) 
+        pos_counts = pos_value.sum(axis=1) 
+        neg_ratios = neg_counts / negative_samples_num
+        pos_ratios = pos_counts / positive_samples_num
+        diff_ratios = neg_ratios - pos_ratios
+
+        # Generate the gene pair dataframe
+        diff_ratios_df = pd.DataFrame({
+            'Gene1': row.name,              
+            'Gene2': diff.index.values     
+        })
+        diff_ratios = diff_ratios.reset_index(drop=True)
+        diff_ratios_df['ReversalRatio'] = diff_ratios
+
+        # Swap genes in rows with negative values to ensure the smaller gene is listed first
+        neg_rows = diff_ratios_df['ReversalRatio'] < 0
+        diff_ratios_df.loc[neg_rows, ['Gene1', 'Gene2']] = diff_ratios_df.loc[neg_rows, ['Gene2', 'Gene1']].values
+        diff_ratios_df['ReversalRatio'] = diff_ratios_df['ReversalRatio'].abs()
+
+        # Filter by threshold
+        diff_ratios_df = diff_ratios_df[diff_ratios_df['ReversalRatio'] > reversal_ratio_threshold]
+        
+        return diff_ratios_df
+
+    result_list = expr_df.apply(get_reverse_gene_pairs, axis=1)
+    
+    # Merge the list into the final result dataframe
+    reverse_gene_pairs_reslut = pd.concat(result_list.tolist(), ignore_index=True)
+    reverse_gene_pairs_reslut = reverse_gene_pairs_reslut.sort_values(by='ReversalRatio', ascending=False)
+
+    # Check the number of gene pairs
+    if reverse_gene_pairs_reslut.shape[0] < 100:
+        raise ValueError("The reversal ratio threshold is too high or there is no difference between the two sample groups. Please adjust the threshold accordingly!")
+
+    # Gene set processing
+    if gene_set_input is not None:
+        gene_set_df = pd.read_csv(gene_set_input, sep=',')
+        
+        # Check whether the gene set contains only one column
+        if gene_set_df.shape[1] != 1:
+            raise ValueError("Incorrect gene set data format!")
+        
+        # Check whether all gene symbols are present in the 'Symbol' column of the expression dataframe
+        gene_list = gene_set_df.iloc[:, 0].dropna().astype(str).tolist()
+        missing_genes = [g for g in gene_list if g not in expr_df.index.tolist()]
+        if missing_genes:
+            raise ValueError("Some genes in the gene set do not exist in the expression dataframe!")
+        
+        # Select reversed gene pairs where at least one gene is present in the provided gene set
+        reverse_gene_pairs_reslut = reverse_gene_pairs_reslut[
+            reverse_gene_pairs_reslut['Gene1'].isin(gene_list) | reverse_gene_pairs_reslut['Gene2'].isin(gene_list)
+        ]
+
+        # Check if there are any gene pairs after filtering
+        if reverse_gene_pairs_reslut.shape[0] < 1:
+            raise ValueError("No reversed gene pairs were obtained, indicating that this gene set shows no difference between the two sample groups!")
+       
+    # Define function for removing duplicate gene pairs
+    def duplicate_removal(matrix):
+        seen_genes = set()
+        result_matrix = []
+    
+        for idx, row in matrix.iterrows():
+            gene1, gene2 = row.iloc[:2]
+    
+            if gene1 not in seen_genes and gene2 not in seen_genes:
+                result_matrix.append(row)
+                seen_genes.update([gene1, gene2])
+    
+        return pd.DataFrame(result_matrix, columns=matrix.columns)
+
+    # Remove duplicate gene pairs
+    if remove_duplicate_gene_pairs:
+        reverse_gene_pairs_reslut = duplicate_removal(reverse_gene_pairs_reslut)
+        
+    # Return the result
+    return reverse_gene_pairs_reslut
+
+
+# ==============================
+#            DP_Score
+# ==============================
+def DP_Score(reversal_gene_pairs, expression_matrix, sample_info_matrix):
+    """
+    DP_Score: Function to calculate disease perturbation score
+    
+    Input Parameters:
+    reversal_gene_pairs: Data of reversed gene pairs
+    expression_matrix: Gene expression matrix (including the first column as symbol, others as sample expression levels)
+    sample_info_matrix: Sample information matrix
+    
+    Output: 
+    Disease_perturbation_scoring: A data frame that adds two columns [DP_Score, Outlier] based on the sample information matrix
+    diff_matrix: Used for calculating the importance of gene pairs
+    """
+    
+    # 1. Extract corresponding data from the expression matrix based on Gene1 and Gene2
+    # Gene1 is usually lowly expressed in negative samples, Gene2 is usually highly expressed in negative samples
+    small_gene_matrix = expression_matrix.loc[reversal_gene_pairs['Gene1']].reset_index(drop=True)
+    big_gene_matrix = expression_matrix.loc[reversal_gene_pairs['Gene2']].reset_index(drop=True)
+
+    # 2. Calculate the difference matrix
+    diff_matrix = small_gene_matrix - big_gene_matrix
+ 
+    # 3. For each column (sample), count how many values are greater than or equal to 0, then divide by the logarithm of the number of gene pairs as the score for each sample
+    scores = (diff_matrix >= 0).sum(axis=0)
+    gene_pairs_num = reversal_gene_pairs.shape[0]
+    normalized_scores = scores / gene_pairs_num
+    
+    # 4. Create the result data frame
+    scores_result = pd.DataFrame({
+        'Sample': normalized_scores.index,
+        'DP_Score': normalized_scores.values
+    })
+    result_matrix = pd.merge(sample_info_matrix, scores_result, on='Sample', how='inner')
+
+    # 5. Retrieve the 'Outlier' column
+    def mark_outliers(sample_info_matrix):
+        # Get the unique values of the 'Rank' column and their corresponding counts
+        rank_counts = sample_info_matrix['Rank'].value_counts().sort_index()
+    
+        # Initialize the 'Outlier' column with the default value 'No'
+        sample_info_matrix['Outlier'] = 'No'
+     
+        # Iterate over the ranks in order
+        start_idx = 0
+        for rank_value, count in rank_counts.items():
+            # Get the index range for the current rank segment
+            end_idx = start_idx + count
+            subset = sample_info_matrix.iloc[start_idx:end_idx]
+    
+            # Find rows where the Rank value is not equal to the current rank_value and mark them as "Yes"
+            sample_info_matrix.loc[subset.index[subset['Rank'] != rank_value], 'Outlier'] = 'Yes'
+            
+            # Update the starting index
+            start_idx = end_idx
+
+        return sample_info_matrix
+        
+    # Sort by DP_Score
+    result_matrix_sorted = result_matrix.sort_values(by='DP_Score').reset_index(drop=True)
+    
+    # Mark outliers
+    Disease_perturbation_scoring = mark_outliers(result_matrix_sorted)
+
+    return Disease_perturbation_scoring, diff_matrix
+
+
+# ==============================
+#        Baseline tables
+# ==============================
+def baseline_tables(expr_df, sample_df, negative_category, positive_category, reversal_ratio_threshold=0.5, remove_duplicate_gene_pairs=False,
+                    gene_set_input=None):
+    """
+    baseline_tables: Function to compute the tables of the original DPS_Tool (steps 3 to 6), without writing files or plotting
+    
+    Input Parameters:
+    expr_df: Expression matrix (Symbol, then one column per sample), as read from the expression matrix file
+    sample_df: Sample information matrix
+    (other parameters: see DPS_Tool)
+    
+    Output:
+    reverse_gene_pairs_reslut: Gene pairs table, as written to Gene_pairs_table.csv
+    Disease_perturbation_scoring: DP_score table, as written to DP_score_table.csv
+    """
+    # ------------------------------
+    # 3. Adjust matrix order and obtain negative and positive sample counts
+    # ------------------------------
+    negative_samples = sample_df[sample_df['Class'] == negative_category]['Sample'].tolist()
+    positive_samples = sample_df[sample_df['Class'] == positive_category]['Sample'].tolist()
+    
+    # Extract expression matrix for negative and positive samples
+    expr_df1 = expr_df[['Symbol'] + negative_samples + positive_samples]
+    negative_samples_num = len(negative_samples)
+    positive_samples_num = len(positive_samples)
+
+    # ------------------------------
+    # 4. Extract reversed gene pairs
+    # ------------------------------
+    reverse_gene_pairs_reslut = Reverse_gene_pairs(expr_df1, negative_samples_num, positive_samples_num, reversal_ratio_threshold, remove_duplicate_gene_pairs, gene_set_input)
+
+    # ------------------------------
+    # 5. Calculate disease perturbation scores
+    # ------------------------------
+    expr_df = expr_df.set_index(expr_df.columns[0]) 
+    Disease_perturbation_scoring, diff_matrix = DP_Score(reverse_gene_pairs_reslut, expr_df, sample_df)
+
+    # ------------------------------
+    # 6. Calculate ImportanceScore of gene pairs
+    # ------------------------------
+    # 1. Get sample names where Rank == 0
+    rank_0_samples = Disease_perturbation_scoring.loc[Disease_perturbation_scoring['Rank'] == 0, 'Sample']
+    
+    # 2. Subset expression matrix
+    matrix_A = diff_matrix[rank_0_samples] 
+    matrix_B = diff_matrix.drop(columns=rank_0_samples)  
+    
+    # 3. Compute ImportanceScore
+    count_A = (matrix_A < 0).sum(axis=1)  
+    count_B = (matrix_B >= 0).sum(axis=1)  
+    total_samples = expr_df.shape[1]  
+    importance_score = (count_A + count_B) / total_samples  
+    
+    # 4. Add ImportanceScore to reverse_gene_pairs_result
+    reverse_gene_pairs_reslut = reverse_gene_pairs_reslut.reset_index(drop=True)
+    reverse_gene_pairs_reslut['ImportanceScore'] = importance_score
+    
+    # 5. Sort by ImportanceScore in descending order
+    reverse_gene_pairs_reslut = reverse_gene_pairs_reslut.sort_values(by='ImportanceScore', ascending=False).reset_index(drop=True)
+    
+    return reverse_gene_pairs_reslut, Disease_perturbation_scoring
@@ -0,0 +1,73 @@
+"""
+Shared fixtures of the DPS-Tool tests: the DPS-Tool module and small synthetic cohorts with many tied values
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The tests import the dps_tool package from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dps_tool
+from dps_tool import baseline
+
+def tie_heavy_cohort(genes_num=150, negative_samples_num=14, positive_samples_num=16, seed=0, rounded=False, other_samples_num=0):
+    """
+    tie_heavy_cohort: Function to generate a cohort whose expression values repeat a lot, so that comparisons and reversal ratios tie
+    
+    Input Parameters:
+    genes_num: Number of genes
+    negative_samples_num, positive_samples_num: Number of negative ('ND') and positive ('T2D') samples
+    seed: Random seed
+    rounded: Draw normal values rounded to one decimal instead of integers from 0 to 3
+    other_samples_num: Number of samples of a third class ('Pre', Rank 1), scored but not contrasted
+    
+    Output:
+    expr_df: Expression matrix (Symbol, then one column per sample)
+    sample_df: Sample information matrix (Sample, Class, Rank)
+    """
+    rng = np.random.default_rng(seed)
+    samples_num = negative_samples_num + positive_samples_num + other_samples_num
+    if rounded:
+        values = np.round(rng.normal(size=(genes_num, samples_num)), 1)
+    else:
+        values = rng.integers(0, 4, size=(genes_num, samples_num)).astype(float)
+    
+    # The first genes are higher in positive samples, so that many pairs are reversed
+    values[:genes_num // 5, negative_samples_num:negative_samples_num + positive_samples_num] += 1.5 if rounded else 2
+    samples = [f"S{sample:03d}" for sample in range(samples_num)]
+    expr_df = pd.DataFrame(values, columns=samples)
+    expr_df.insert(0, 'Symbol', [f"G{gene:03d}" for gene in range(genes_num)])
+    sample_df = pd.DataFrame({
+        'Sample': samples,
+        'Class': ['ND'] * negative_samples_num + ['T2D'] * positive_samples_num + ['Pre'] * other_samples_num,
+        'Rank': [0] * negative_samples_num + [2] * positive_samples_num + [1] * other_samples_num
+    })
+    return expr_df, sample_df
+
+@pytest.fixture(scope='session')
+def dps():
+    return dps_tool.dps_tool_main
+
+@pytest.fixture(scope='session')
+def reference():
+    return baseline
+
+@pytest.fixture(scope='session')
+def make_cohort():
+    return tie_heavy_cohort
+
+@pytest.fixture
+def write_cohort(tmp_path):
+    """
+    write_cohort: Fixture writing a cohort to expression and sample information CSV files, returning their paths
+    """
+    def write(expr_df, sample_df):
+        expression_path, sample_info_path = tmp_path / 'expr.csv', tmp_path / 'info.csv'
+        expr_df.to_csv(expression_path, index=False)
+        sample_df.to_csv(sample_info_path, index=False)
+        return str(expression_path), str(sample_info_path)
+    return write
@@ -0,0 +1,89 @@
+"""
+Tests of the multi-contrast batch mode (DPS_Tool_batch) against DPS_Tool run on every contrast
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.io
+import scipy.sparse
+
+CONTRASTS = [('ND', 'T2D'), ('Pre', 'T2D')]
+
+def write_sparse_cohort(tmp_path, expr_df, sample_df):
+    matrix_path, symbols_path, samples_path, sample_info_path = (str(tmp_path / name) for name in ('matrix.mtx', 'symbols.txt', 'samples.txt', 'info.csv'))
+    scipy.io.mmwrite(matrix_path, scipy.sparse.coo_matrix(expr_df.iloc[:, 1:].to_numpy()))
+    pd.Series(expr_df['Symbol']).to_csv(symbols_path, index=False, header=False)
+    pd.Series(expr_df.columns[1:]).to_csv(samples_path, index=False, header=False)
+    sample_df.to_csv(sample_info_path, index=False)
+    return matrix_path, sample_info_path, symbols_path, samples_path
+
+def assert_same_tables(batch_path, tool_path):
+    for table_name in ('Gene_pairs_table.csv', 'DP_score_table.csv'):
+        pd.testing.assert_frame_equal(pd.read_csv(os.path.join(batch_path, table_name)), pd.read_csv(os.path.join(tool_path, table_name)))
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_sparse_batch_matches_dps_tool(dps, make_cohort, tmp_path, monkeypatch, n_jobs):
+    matrix_path, sample_info_path, symbols_path, samples_path = write_sparse_cohort(tmp_path, *make_cohort(seed=41, other_samples_num=12))
+    sparse_contrasts = []
+    def record(function):
+        def recorded(expr_df, *args, **kwargs):
+            sparse_contrasts.append(dps.is_sparse_frame(expr_df.iloc[:, 1:]))
+            return function(expr_df, *args, **kwargs)
+        return recorded
+    monkeypatch.setattr(dps, 'run_contrast', record(dps.run_contrast))
+    batch_summary = dps.DPS_Tool_batch(matrix_path, sample_info_path, CONTRASTS, str(tmp_path / 'batch'), 0.3, plots=False, n_jobs=n_jobs,
+                                       symbols_input=symbols_path, samples_input=samples_path)
+    assert batch_summary['Status'].tolist() == ['completed'] * len(CONTRASTS)
+    assert sparse_contrasts == [True] * len(CONTRASTS)
+    for negative_category, positive_category in CONTRASTS:
+        tool_path = tmp_path / f"{negative_category}_{positive_category}"
+        os.makedirs(tool_path)
+        dps.DPS_Tool(matrix_path, sample_info_path, negative_category, positive_category, str(tool_path), 0.3, plots=False,
+                     symbols_input=symbols_path, samples_input=samples_path)
+        assert_same_tables(tmp_path / 'batch' / dps.contrast_folder_name(negative_category, positive_category), tool_path)
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_batch_result_cache(dps, make_cohort, write_cohort, tmp_path, monkeypatch, n_jobs):
+    expression_path, sample_info_path = write_cohort(*make_cohort(seed=42, other_samples_num=12))
+    result_cache_dir = str(tmp_path / 'result_cache')
+    first_summary = dps.DPS_Tool_batch(expression_path, sample_info_path, CONTRASTS[:1], str(tmp_path / 'first'), 0.3, plots=False, n_jobs=n_jobs,
+                                       result_cache_dir=result_cache_dir)
+    
+    # The cached contrast is restored, only the added one is run
+    run_contrasts = []
+    def record(function):
+        def recorded(expr_df, sample_df, negative_category, positive_category, *args, **kwargs):
+            run_contrasts.append((negative_category, positive_category))
+            return function(expr_df, sample_df, negative_category, positive_category, *args, **kwargs)
+        return recorded
+    monkeypatch.setattr(dps, 'run_contrast', record(dps.run_contrast))
+    second_summary = dps.DPS_Tool_batch(expression_path, sample_info_path, CONTRASTS, str(tmp_path / 'second'), 0.3, plots=False,
+                                        result_cache_dir=result_cache_dir)
+    assert run_contrasts == [CONTRASTS[1]]
+    pd.testing.assert_frame_equal(second_summary.iloc[:1], first_summary)
+    assert_same_tables(tmp_path / 'second' / 'ND_vs_T2D', tmp_path / 'first' / 'ND_vs_T2D')
+    
+    # All contrasts are cached: the expression matrix is not loaded, and DPS_Tool reuses the entries of the batch
+    def fail(*args, **kwargs):
+        raise AssertionError("The expression matrix was loaded")
+    monkeypatch.setattr(dps, 'load_expression_matrix', fail)
+    third_summary = dps.DPS_Tool_batch(expression_path, sample_info_path, CONTRASTS, str(tmp_path / 'third'), 0.3, plots=False,
+                                       result_cache_dir=result_cache_dir)
+    pd.testing.assert_frame_equal(third_summary, second_summary)
+    gene_pairs, _ = dps.DPS_Tool(expression_path, sample_info_path, 'Pre', 'T2D', str(tmp_path / 'third'), 0.3, plots=False, result_cache_dir=result_cache_dir)
+    pd.testing.assert_frame_equal(gene_pairs, pd.read_csv(tmp_path / 'second' / 'Pre_vs_T2D' / 'Gene_pairs_table.csv', index_col=0))
+
+def test_batch_incremental_state_per_contrast(dps, make_cohort, write_cohort, tmp_path):
+    expr_df, sample_df = make_cohort(seed=43, other_samples_num=12)
+    expression_path, sample_info_path = write_cohort(expr_df, sample_df)
+    incremental_dir = tmp_path / 'incremental'
+    dps.DPS_Tool_batch(expression_path, sample_info_path, CONTRASTS, str(tmp_path / 'batch'), 0.3, plots=False, incremental_dir=str(incremental_dir))
+    assert sorted(os.listdir(incremental_dir)) == ['ND_vs_T2D', 'Pre_vs_T2D']
+    for negative_category, positive_category in CONTRASTS:
+        folder_name = dps.contrast_folder_name(negative_category, positive_category)
+        tool_path = tmp_path / folder_name
+        os.makedirs(tool_path)
+        dps.DPS_Tool(expression_path, sample_info_path, negative_category, positive_category, str(tool_path), 0.3, plots=False)
+        assert_same_tables(tmp_path / 'batch' / folder_name, tool_path)
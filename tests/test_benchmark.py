@@ -0,0 +1,45 @@
+"""
+Tests of DPS-Benchmark.py, which checks every backend against the tables of the original implementation
+"""
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+BENCHMARK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dps_tool', 'DPS-Benchmark.py')
+
+def run_benchmark(tmp_path, *options):
+    output_path = tmp_path / 'benchmark.json'
+    completed = subprocess.run([sys.executable, BENCHMARK_PATH, '--genes', '150', '--samples', '24', '--planted_pairs', '20', '--deduplicate',
+                                '--work_dir', str(tmp_path), '--output', str(output_path), *options], capture_output=True, text=True, timeout=600)
+    assert completed.returncode == 0, completed.stderr
+    return json.loads(output_path.read_text())['cohorts'][0]
+
+def test_backends_match_original_tables(tmp_path):
+    cohort = run_benchmark(tmp_path, '--backends', 'reference,tiled,bitpacked')
+    assert cohort['baseline_wall_time'] is not None
+    assert [result['backend'] for result in cohort['results']] == ['reference', 'tiled', 'bitpacked']
+    assert all(result['error'] is None and result['matches_baseline'] for result in cohort['results'])
+
+def test_changed_tables_do_not_match(tmp_path):
+    run_benchmark(tmp_path, '--backends', 'tiled')
+    spec = importlib.util.spec_from_file_location('dps_benchmark', BENCHMARK_PATH)
+    benchmark = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(benchmark)
+    run_folder_path = tmp_path / 'cohort_150x24' / 'tiled_0'
+    baseline_folder_path = tmp_path / 'cohort_150x24' / 'baseline'
+    assert benchmark.compare_outputs(run_folder_path, baseline_folder_path) is None
+    
+    # A golden table that differs in one ImportanceScore is reported
+    gene_pairs = pd.read_csv(baseline_folder_path / 'Gene_pairs_table.csv', index_col=0)
+    gene_pairs.loc[0, 'ImportanceScore'] += 1e-9
+    gene_pairs.to_csv(baseline_folder_path / 'Gene_pairs_table.csv')
+    assert benchmark.compare_outputs(run_folder_path, baseline_folder_path).startswith('Gene_pairs_table.csv')
+
+def test_large_cohorts_skip_the_original_tables(tmp_path):
+    cohort = run_benchmark(tmp_path, '--backends', 'tiled', '--baseline_max_genes', '100')
+    assert cohort['baseline_wall_time'] is None
+    assert 'matches_baseline' not in cohort['results'][0]
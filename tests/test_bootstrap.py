@@ -0,0 +1,32 @@
+"""
+Tests of the bootstrap stability of the reversed gene pairs (DPS_Bootstrap)
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_importance_matches_dps_tool(dps, make_cohort, write_cohort, tmp_path, n_jobs):
+    # The last samples of the expression matrix are missing from the sample information matrix, but count in the ImportanceScore
+    expr_df, sample_df = make_cohort(seed=21, other_samples_num=6)
+    expression_path, sample_info_path = write_cohort(expr_df, sample_df.iloc[:-4])
+    tool_path, bootstrap_path = tmp_path / 'tool', tmp_path / 'bootstrap'
+    os.makedirs(tool_path)
+    os.makedirs(bootstrap_path)
+    gene_pairs, scores = dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(tool_path), 0.3, plots=False)
+    pair_stability, score_stability = dps.DPS_Bootstrap(expression_path, sample_info_path, 'ND', 'T2D', str(bootstrap_path), resamples_num=4,
+                                                        reversal_ratio_threshold=0.3, n_jobs=n_jobs)
+    
+    selected = pair_stability[pair_stability['Selected']].set_index(['Gene1', 'Gene2'])['ImportanceScore']
+    expected = gene_pairs.set_index(['Gene1', 'Gene2'])['ImportanceScore']
+    pd.testing.assert_series_equal(selected.loc[expected.index], expected)
+    expected_scores = scores.set_index('Sample')['DP_Score']
+    np.testing.assert_allclose(score_stability.set_index('Sample')['DP_Score'].loc[expected_scores.index], expected_scores)
+    
+    # Every resample ImportanceScore is a fraction of all the expression matrix samples
+    samples_num = expr_df.shape[1] - 1
+    resample_scores = pair_stability['ImportanceScoreMean'].dropna().to_numpy()
+    assert len(resample_scores) and ((resample_scores >= 0) & (resample_scores <= 1)).all()
+    assert np.allclose(np.round(pair_stability['ImportanceScore'].dropna() * samples_num), pair_stability['ImportanceScore'].dropna() * samples_num)
@@ -0,0 +1,39 @@
+"""
+Tests of the greedy duplicate removal against the original implementation (dps_tool/baseline.py)
+"""
+import pandas as pd
+import pytest
+
+from test_pair_search import contrast
+
+def greedy_selection(dps, sorted_pairs, block_pairs):
+    pairs_num = sorted_pairs.shape[0]
+    gene_codes, genes = pd.factorize(pd.concat([sorted_pairs['Gene1'], sorted_pairs['Gene2']], ignore_index=True))
+    return sorted_pairs.iloc[dps.select_disjoint_pairs(gene_codes[:pairs_num], gene_codes[pairs_num:], len(genes), block_pairs)]
+
+@pytest.mark.parametrize('block_pairs', [1, 7, 65536])
+@pytest.mark.parametrize('rounded', [False, True])
+def test_greedy_selection_matches_baseline(dps, reference, make_cohort, rounded, block_pairs):
+    # Same sorted input as the original duplicate removal, with many tied ratios, screened in blocks of every size
+    expr_df, negative_samples_num, positive_samples_num = contrast(*make_cohort(seed=6, rounded=rounded))
+    sorted_pairs = reference.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.3, False, None)
+    expected = reference.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.3, True, None)
+    assert sorted_pairs['ReversalRatio'].duplicated().sum() > sorted_pairs.shape[0] // 2
+    pd.testing.assert_frame_equal(greedy_selection(dps, sorted_pairs, block_pairs), expected)
+
+@pytest.mark.parametrize('block_pairs', [1, 65536])
+def test_greedy_selection_stops_when_genes_are_used(dps, reference, make_cohort, block_pairs):
+    # With few genes every gene is used well before the end of the sorted pairs, so the selection stops early
+    expr_df, negative_samples_num, positive_samples_num = contrast(*make_cohort(genes_num=20, seed=7, rounded=True))
+    sorted_pairs = reference.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.1, False, None)
+    expected = reference.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.1, True, None)
+    assert expected.shape[0] == 10
+    assert sorted_pairs.index.get_loc(expected.index[-1]) < sorted_pairs.shape[0] - 1
+    pd.testing.assert_frame_equal(greedy_selection(dps, sorted_pairs, block_pairs), expected)
+
+@pytest.mark.parametrize('backend', ['reference', 'tiled', 'bitpacked'])
+def test_deduplicated_pairs_match_baseline(dps, reference, make_cohort, backend):
+    expr_df, negative_samples_num, positive_samples_num = contrast(*make_cohort(genes_num=120, seed=8, rounded=True))
+    expected = reference.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.2, True, None)
+    result = dps.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.2, True, None, backend)
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))
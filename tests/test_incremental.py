@@ -0,0 +1,89 @@
+"""
+Tests of the incremental pair search (incremental_dir) against a search on all samples
+"""
+import os
+
+import pandas as pd
+import pytest
+
+from test_pair_search import contrast, write_gene_set
+
+# Samples missing from the first run: two negative and three positive samples
+ADDED_SAMPLES = ['S003', 'S010', 'S015', 'S020', 'S029']
+
+def search(dps, expr_df, sample_df, threshold=0.3, remove_duplicate_gene_pairs=False, gene_set_input=None, incremental_dir=None, **options):
+    """
+    search: Function to search the reversed gene pairs of the ND/T2D contrast, returning them with the incremental report (None without incremental_dir)
+    """
+    recorder = dps.StageRecorder()
+    contrast_df, negative_samples_num, positive_samples_num = contrast(expr_df, sample_df)
+    result = dps.Reverse_gene_pairs(contrast_df, negative_samples_num, positive_samples_num, threshold, remove_duplicate_gene_pairs, gene_set_input,
+                                    recorder=recorder, incremental_dir=None if incremental_dir is None else str(incremental_dir), **options)
+    report = next(stage.get('incremental') for stage in recorder.stages if stage['stage'] == 'pair_search')
+    return result, report
+
+@pytest.mark.parametrize('max_pairs', [None, 150])
+@pytest.mark.parametrize('remove_duplicate_gene_pairs', [False, True])
+@pytest.mark.parametrize('rounded', [False, True])
+@pytest.mark.parametrize('backend', ['tiled', 'bitpacked'])
+def test_update_matches_full_search(dps, reference, make_cohort, tmp_path, backend, rounded, remove_duplicate_gene_pairs, max_pairs):
+    expr_df, sample_df = make_cohort(seed=51, rounded=rounded)
+    options = {'remove_duplicate_gene_pairs': remove_duplicate_gene_pairs, 'backend': backend, 'max_pairs': max_pairs}
+    _, report = search(dps, expr_df, sample_df[~sample_df['Sample'].isin(ADDED_SAMPLES)], incremental_dir=tmp_path / 'state', **options)
+    assert report['mode'] == 'full' and report['reason'] == 'no incremental state'
+    
+    result, report = search(dps, expr_df, sample_df, incremental_dir=tmp_path / 'state', **options)
+    assert report['mode'] == 'update' and report['samples_added'] == len(ADDED_SAMPLES)
+    pd.testing.assert_frame_equal(result, search(dps, expr_df, sample_df, **options)[0])
+    if max_pairs is None:
+        contrast_df, negative_samples_num, positive_samples_num = contrast(expr_df, sample_df)
+        expected = reference.Reverse_gene_pairs(contrast_df, negative_samples_num, positive_samples_num, 0.3, remove_duplicate_gene_pairs, None)
+        pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))
+
+def test_update_with_gene_set(dps, make_cohort, tmp_path):
+    expr_df, sample_df = make_cohort(seed=52)
+    gene_set_path = write_gene_set(tmp_path, expr_df['Symbol'].iloc[::3])
+    search(dps, expr_df, sample_df[~sample_df['Sample'].isin(ADDED_SAMPLES)], gene_set_input=gene_set_path, incremental_dir=tmp_path / 'state')
+    result, report = search(dps, expr_df, sample_df, gene_set_input=gene_set_path, incremental_dir=tmp_path / 'state')
+    assert report['mode'] == 'update'
+    pd.testing.assert_frame_equal(result, search(dps, expr_df, sample_df, gene_set_input=gene_set_path)[0])
+
+@pytest.mark.parametrize('change', ['removed', 'changed', 'moved', 'too_many', 'threshold'])
+def test_rebuild_matches_full_search(dps, make_cohort, tmp_path, change):
+    expr_df, sample_df = make_cohort(seed=53)
+    # The state of the first run allows two added samples for too_many, eight otherwise
+    threshold, incremental_samples = 0.3, 2 if change == 'too_many' else 8
+    search(dps, expr_df, sample_df[~sample_df['Sample'].isin(ADDED_SAMPLES)], incremental_dir=tmp_path / 'state', incremental_samples=incremental_samples)
+    if change == 'removed':
+        sample_df = sample_df[sample_df['Sample'] != 'S000']
+    elif change == 'changed':
+        expr_df = expr_df.copy()
+        expr_df['S001'] = expr_df['S001'].to_numpy()[::-1]
+    elif change == 'moved':
+        sample_df = sample_df.copy()
+        sample_df.loc[sample_df['Sample'] == 'S013', 'Class'] = 'T2D'
+    elif change == 'threshold':
+        # A higher threshold keeps a subset of the candidate pairs, so the state is still updated
+        threshold = 0.35
+    
+    result, report = search(dps, expr_df, sample_df, threshold, incremental_dir=tmp_path / 'state', incremental_samples=incremental_samples)
+    assert report['mode'] == ('update' if change == 'threshold' else 'full')
+    pd.testing.assert_frame_equal(result, search(dps, expr_df, sample_df, threshold)[0])
+
+def test_dps_tool_update_matches_full_run(dps, make_cohort, write_cohort, tmp_path):
+    # The ranks of a sample do not depend on the other samples, so the state of the first run holds for the ranked cohort with added samples
+    expr_df, sample_df = make_cohort(seed=54, rounded=True, other_samples_num=6)
+    incremental_dir, full_path = str(tmp_path / 'state'), tmp_path / 'full'
+    os.makedirs(full_path)
+    expression_path, sample_info_path = write_cohort(expr_df.drop(columns=ADDED_SAMPLES), sample_df[~sample_df['Sample'].isin(ADDED_SAMPLES)])
+    dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(tmp_path), 0.3, plots=False, incremental_dir=incremental_dir)
+    
+    expression_path, sample_info_path = write_cohort(expr_df, sample_df)
+    progress_file = str(tmp_path / 'progress.json')
+    gene_pairs, scores = dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(tmp_path), 0.3, plots=False, incremental_dir=incremental_dir,
+                                      progress_file=progress_file)
+    expected_pairs, expected_scores = dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(full_path), 0.3, plots=False)
+    pd.testing.assert_frame_equal(gene_pairs, expected_pairs)
+    pd.testing.assert_frame_equal(scores, expected_scores)
+    with open(progress_file) as f:
+        assert '"mode": "update"' in f.read()
@@ -0,0 +1,63 @@
+"""
+Tests of the reversed gene pairs search against the original implementation (dps_tool/baseline.py)
+"""
+import pandas as pd
+import pytest
+
+BACKENDS = ['reference', 'tiled', 'bitpacked']
+
+def contrast(expr_df, sample_df):
+    negative_samples = sample_df.loc[sample_df['Class'] == 'ND', 'Sample'].tolist()
+    positive_samples = sample_df.loc[sample_df['Class'] == 'T2D', 'Sample'].tolist()
+    return expr_df[['Symbol'] + negative_samples + positive_samples], len(negative_samples), len(positive_samples)
+
+def write_gene_set(tmp_path, genes):
+    gene_set_path = tmp_path / 'gene_set.csv'
+    pd.DataFrame({'GeneSet': genes}).to_csv(gene_set_path, index=False)
+    return str(gene_set_path)
+
+@pytest.mark.parametrize('rounded', [False, True])
+@pytest.mark.parametrize('remove_duplicate_gene_pairs', [False, True])
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_whole_matrix_matches_baseline(dps, reference, make_cohort, backend, remove_duplicate_gene_pairs, rounded):
+    expr_df, negative_samples_num, positive_samples_num = contrast(*make_cohort(seed=1, rounded=rounded))
+    expected = reference.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.3, remove_duplicate_gene_pairs, None)
+    result = dps.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.3, remove_duplicate_gene_pairs, None, backend)
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))
+
+@pytest.mark.parametrize('remove_duplicate_gene_pairs', [False, True])
+def test_gene_set_reference_matches_baseline(dps, reference, make_cohort, tmp_path, remove_duplicate_gene_pairs):
+    expr_df, negative_samples_num, positive_samples_num = contrast(*make_cohort(seed=2))
+    gene_set_path = write_gene_set(tmp_path, expr_df['Symbol'].iloc[::9])
+    expected = reference.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.3, remove_duplicate_gene_pairs, gene_set_path)
+    result = dps.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.3, remove_duplicate_gene_pairs, gene_set_path, 'reference')
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))
+
+@pytest.mark.parametrize('backend', ['tiled', 'bitpacked'])
+def test_gene_set_search_matches_baseline_pairs(dps, reference, make_cohort, tmp_path, backend):
+    # Only the order of tied pairs may differ: the gene set search sorts its own pairs, the original sorted all pairs before filtering
+    expr_df, negative_samples_num, positive_samples_num = contrast(*make_cohort(seed=2))
+    gene_set_path = write_gene_set(tmp_path, expr_df['Symbol'].iloc[::9])
+    expected = reference.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.3, False, gene_set_path)
+    result = dps.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.3, False, gene_set_path, backend)
+    assert result['ReversalRatio'].tolist() == expected['ReversalRatio'].tolist()
+    pd.testing.assert_frame_equal(result.sort_values(['Gene1', 'Gene2']).reset_index(drop=True),
+                                  expected.sort_values(['Gene1', 'Gene2']).reset_index(drop=True))
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_minimum_pairs_counts_the_whole_matrix(dps, reference, make_cohort, tmp_path, backend):
+    # The gene has fewer than 100 reversed pairs, the whole matrix has more: the original accepts it, so must every backend
+    expr_df, negative_samples_num, positive_samples_num = contrast(*make_cohort(seed=3))
+    gene_set_path = write_gene_set(tmp_path, [expr_df['Symbol'].iloc[-1]])
+    expected = reference.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.3, False, gene_set_path)
+    assert 0 < expected.shape[0] < 100
+    result = dps.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.3, False, gene_set_path, backend)
+    assert sorted(zip(result['Gene1'], result['Gene2'])) == sorted(zip(expected['Gene1'], expected['Gene2']))
+
+@pytest.mark.parametrize('gene_set', [False, True])
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_too_few_pairs_fail_on_every_backend(dps, make_cohort, tmp_path, backend, gene_set):
+    expr_df, negative_samples_num, positive_samples_num = contrast(*make_cohort(seed=3))
+    gene_set_path = write_gene_set(tmp_path, expr_df['Symbol'].iloc[:3]) if gene_set else None
+    with pytest.raises(ValueError, match="threshold is too high"):
+        dps.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.95, False, gene_set_path, backend)
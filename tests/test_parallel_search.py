@@ -0,0 +1,61 @@
+"""
+Tests of the process pool pair search against the serial search and the original implementation (dps_tool/baseline.py)
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from test_pair_search import contrast
+
+def search_values(dps, make_cohort):
+    expr_df, negative_samples_num, positive_samples_num = contrast(*make_cohort(genes_num=120, seed=4))
+    return dps.expression_values(expr_df.set_index('Symbol')), negative_samples_num, positive_samples_num
+
+def assert_same_pairs(result, expected):
+    assert result[-1] == expected[-1]
+    for result_array, expected_array in zip(result[:-1], expected[:-1]):
+        np.testing.assert_array_equal(result_array, expected_array)
+
+@pytest.mark.parametrize('pruning', [None, 'exact'])
+@pytest.mark.parametrize('max_pairs', [None, 50])
+@pytest.mark.parametrize('backend', ['tiled', 'bitpacked'])
+def test_pool_search_matches_serial_search(dps, make_cohort, backend, max_pairs, pruning):
+    values, negative_samples_num, positive_samples_num = search_values(dps, make_cohort)
+    expected = dps.tiled_pair_search(values, negative_samples_num, positive_samples_num, 0.3, backend, tile_size=16, max_pairs=max_pairs, pruning=pruning)
+    result = dps.tiled_pair_search(values, negative_samples_num, positive_samples_num, 0.3, backend, tile_size=16, n_jobs=2, max_pairs=max_pairs, pruning=pruning)
+    assert_same_pairs(result, expected)
+
+def test_pool_search_blocks_stay_in_row_order(dps, make_cohort):
+    values, negative_samples_num, positive_samples_num = search_values(dps, make_cohort)
+    blocks = list(dps.iter_pair_search(values, negative_samples_num, positive_samples_num, 0.3, tile_size=16, n_jobs=2))
+    assert len(blocks) == 8
+    row_genes = np.concatenate([block[0] for block in blocks])
+    assert np.all(np.diff(row_genes) >= 0)
+
+def test_ordered_pool_results_bounds_pending_tasks(dps):
+    submitted, yielded, pending_max = [], [], [0]
+    lock = threading.Lock()
+    def square(task):
+        with lock:
+            pending_max[0] = max(pending_max[0], len(submitted) - len(yielded))
+        return task * task
+    def tasks():
+        for task in range(20):
+            submitted.append(task)
+            yield task
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for task, result in dps.ordered_pool_results(executor, square, tasks(), 3):
+            yielded.append(task)
+            assert result == task * task
+    assert yielded == list(range(20))
+    assert pending_max[0] <= 3
+
+@pytest.mark.parametrize('remove_duplicate_gene_pairs', [False, True])
+def test_pool_search_matches_baseline(dps, reference, make_cohort, remove_duplicate_gene_pairs):
+    expr_df, negative_samples_num, positive_samples_num = contrast(*make_cohort(seed=5, rounded=True))
+    expected = reference.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.3, remove_duplicate_gene_pairs, None)
+    result = dps.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, 0.3, remove_duplicate_gene_pairs, None, 'tiled', n_jobs=2)
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))
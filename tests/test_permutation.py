@@ -0,0 +1,62 @@
+"""
+Tests of the permutation test, which repeats the pair search for every label permutation
+"""
+import itertools
+
+import numpy as np
+import pytest
+
+from test_pair_search import contrast, write_gene_set
+
+def brute_force_p_values(dps, expr_df, gene_pairs, negative_samples_num, positive_samples_num, permutations_num, seed, gene_list=None):
+    # Largest reversal ratio over all searched pairs of every permutation, one pair at a time
+    values = expr_df.drop(columns='Symbol').to_numpy()
+    symbols = expr_df['Symbol'].tolist()
+    masks = np.concatenate([dps.permutation_masks(seed_sequence, negative_samples_num, positive_samples_num, batch_permutations_num)
+                            for seed_sequence, batch_permutations_num in dps.permutation_seeds(seed, permutations_num)], axis=1).astype(bool)
+    null_max = np.zeros(permutations_num)
+    for row_gene, col_gene in itertools.combinations(range(len(symbols)), 2):
+        if gene_list is not None and symbols[row_gene] not in gene_list and symbols[col_gene] not in gene_list:
+            continue
+        lower = values[row_gene] < values[col_gene]
+        for permutation in range(permutations_num):
+            mask = masks[:, permutation]
+            null_max[permutation] = max(null_max[permutation], abs(lower[mask].mean() - lower[~mask].mean()))
+    return np.array([(1 + (null_max >= ratio - 1e-12).sum()) / (1 + permutations_num) for ratio in gene_pairs['ReversalRatio'].abs()])
+
+def permutation_p_values(dps, expr_df, sample_df, n_jobs=1, gene_set_input=None, remove_duplicate_gene_pairs=False):
+    negative_samples = sample_df.loc[sample_df['Class'] == 'ND', 'Sample'].tolist()
+    positive_samples = sample_df.loc[sample_df['Class'] == 'T2D', 'Sample'].tolist()
+    gene_pairs = dps.Reverse_gene_pairs(expr_df[['Symbol'] + negative_samples + positive_samples], len(negative_samples), len(positive_samples), 0.3,
+                                        remove_duplicate_gene_pairs, gene_set_input)
+    p_values = dps.permutation_test(gene_pairs, expr_df.set_index('Symbol'), negative_samples, positive_samples, 60, 3, n_jobs, gene_set_input)
+    return gene_pairs, p_values
+
+@pytest.mark.parametrize('gene_set', [False, True])
+def test_p_values_match_brute_force_search(dps, make_cohort, tmp_path, gene_set):
+    expr_df, sample_df = make_cohort(genes_num=40, seed=9, rounded=True)
+    gene_list = expr_df['Symbol'].iloc[::4].tolist() if gene_set else None
+    gene_set_input = write_gene_set(tmp_path, gene_list) if gene_set else None
+    gene_pairs, p_values = permutation_p_values(dps, expr_df, sample_df, gene_set_input=gene_set_input)
+    contrast_df, negative_samples_num, positive_samples_num = contrast(expr_df, sample_df)
+    expected = brute_force_p_values(dps, contrast_df, gene_pairs, negative_samples_num, positive_samples_num, 60, 3, gene_list)
+    np.testing.assert_allclose(p_values, expected)
+    # The pairs share one null distribution, so a stronger pair never has a larger p-value
+    order = np.argsort(-gene_pairs['ReversalRatio'].abs().to_numpy(), kind='stable')
+    assert np.all(np.diff(p_values[order]) >= 0)
+
+def test_p_values_do_not_depend_on_n_jobs_or_selection(dps, make_cohort):
+    expr_df, sample_df = make_cohort(genes_num=300, seed=10)
+    gene_pairs, p_values = permutation_p_values(dps, expr_df, sample_df)
+    _, pool_p_values = permutation_p_values(dps, expr_df, sample_df, n_jobs=2)
+    np.testing.assert_array_equal(pool_p_values, p_values)
+    # The null covers the whole search, so a pair keeps its p-value whichever pairs were selected with it
+    deduplicated_pairs, deduplicated_p_values = permutation_p_values(dps, expr_df, sample_df, remove_duplicate_gene_pairs=True)
+    all_p_values = dict(zip(zip(gene_pairs['Gene1'], gene_pairs['Gene2']), p_values))
+    assert deduplicated_p_values.tolist() == [all_p_values[pair] for pair in zip(deduplicated_pairs['Gene1'], deduplicated_pairs['Gene2'])]
+
+def test_analysis_reports_adjusted_p_values(dps, make_cohort):
+    expr_df, sample_df = make_cohort(genes_num=60, seed=11)
+    result = dps.DPS_Analysis(expr_df, sample_df, 'ND', 'T2D', reversal_ratio_threshold=0.3, permutations_num=20)
+    assert list(result.gene_pairs.columns) == ['Gene1', 'Gene2', 'ReversalRatio', 'ImportanceScore', 'AdjustedPValue']
+    assert result.gene_pairs['AdjustedPValue'].between(1 / 21, 1).all()
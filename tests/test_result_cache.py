@@ -0,0 +1,129 @@
+"""
+Tests of the content-addressed result cache (result_cache_dir) of DPS_Tool
+"""
+import json
+import os
+
+import pandas as pd
+import pytest
+
+@pytest.fixture
+def calls(dps, monkeypatch):
+    """
+    calls: Fixture counting the expression matrix loads and the figure renderings; figures are replaced by a file naming their dpi
+    """
+    counts = {'load': 0, 'plot': 0}
+    load_expression_matrix = dps.load_expression_matrix
+    def load(*args, **kwargs):
+        counts['load'] += 1
+        return load_expression_matrix(*args, **kwargs)
+    def plot(reverse_gene_pairs_reslut, Disease_perturbation_scoring, folder_path, sample_info_category=None, sample_category=None, data_type=None,
+             figure_formats=None, dpi=None, n_jobs=1, recorder=None):
+        counts['plot'] += 1
+        with open(os.path.join(folder_path, 'DP_score_boxplot.png'), 'w') as f:
+            f.write(f"dpi {dpi}, {reverse_gene_pairs_reslut.shape[0]} gene pairs")
+    monkeypatch.setattr(dps, 'load_expression_matrix', load)
+    monkeypatch.setattr(dps, 'plot_results', plot)
+    return counts
+
+def run(dps, expression_path, sample_info_path, folder_path, result_cache_dir, **options):
+    os.makedirs(folder_path, exist_ok=True)
+    options = dict({'reversal_ratio_threshold': 0.3, 'plots': False}, **options)
+    return dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(folder_path), result_cache_dir=str(result_cache_dir), **options)
+
+def read_tables(folder_path):
+    return [pd.read_csv(os.path.join(folder_path, table_name)) for table_name in ('Gene_pairs_table.csv', 'DP_score_table.csv')]
+
+def test_repeated_run_is_restored(dps, make_cohort, write_cohort, tmp_path, calls):
+    expression_path, sample_info_path = write_cohort(*make_cohort(seed=61))
+    gene_pairs, scores = run(dps, expression_path, sample_info_path, tmp_path / 'first', tmp_path / 'cache')
+    cached_pairs, cached_scores = run(dps, expression_path, sample_info_path, tmp_path / 'second', tmp_path / 'cache')
+    assert calls['load'] == 1
+    pd.testing.assert_frame_equal(cached_pairs, gene_pairs)
+    pd.testing.assert_frame_equal(cached_scores, scores)
+    for cached_table, table in zip(read_tables(tmp_path / 'second'), read_tables(tmp_path / 'first')):
+        pd.testing.assert_frame_equal(cached_table, table)
+    
+    # The exact pruning does not change the results, so it reuses the entry
+    run(dps, expression_path, sample_info_path, tmp_path / 'third', tmp_path / 'cache', pruning='exact')
+    assert calls['load'] == 1
+
+@pytest.mark.parametrize('change', ['threshold', 'deduplicate', 'expression', 'sample_info'])
+def test_changed_run_is_a_miss(dps, make_cohort, write_cohort, tmp_path, calls, change):
+    expr_df, sample_df = make_cohort(seed=62)
+    expression_path, sample_info_path = write_cohort(expr_df, sample_df)
+    run(dps, expression_path, sample_info_path, tmp_path / 'first', tmp_path / 'cache')
+    options = {}
+    if change == 'threshold':
+        options['reversal_ratio_threshold'] = 0.35
+    elif change == 'deduplicate':
+        options['remove_duplicate_gene_pairs'] = True
+    elif change == 'expression':
+        expr_df.loc[0, 'S000'] += 1
+        expression_path, sample_info_path = write_cohort(expr_df, sample_df)
+    else:
+        sample_df.loc[0, 'Rank'] = 1
+        expression_path, sample_info_path = write_cohort(expr_df, sample_df)
+    gene_pairs, scores = run(dps, expression_path, sample_info_path, tmp_path / 'second', tmp_path / 'cache', **options)
+    assert calls['load'] == 2
+    expected_pairs, expected_scores = dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(tmp_path), plots=False,
+                                                   **dict({'reversal_ratio_threshold': 0.3}, **options))
+    pd.testing.assert_frame_equal(gene_pairs, expected_pairs)
+    pd.testing.assert_frame_equal(scores, expected_scores)
+
+def test_plotting_options_reuse_the_tables(dps, make_cohort, write_cohort, tmp_path, calls):
+    expression_path, sample_info_path = write_cohort(*make_cohort(seed=63))
+    gene_pairs, _ = run(dps, expression_path, sample_info_path, tmp_path / 'first', tmp_path / 'cache', plots=True, dpi=100)
+    assert (calls['load'], calls['plot']) == (1, 1)
+    
+    # Another dpi only plots the figures again, from the cached results
+    cached_pairs, _ = run(dps, expression_path, sample_info_path, tmp_path / 'second', tmp_path / 'cache', plots=True, dpi=200)
+    assert (calls['load'], calls['plot']) == (1, 2)
+    pd.testing.assert_frame_equal(cached_pairs, gene_pairs)
+    
+    # Both figure sets are cached next to the same tables
+    for dpi in (100, 200):
+        run(dps, expression_path, sample_info_path, tmp_path / f"dpi_{dpi}", tmp_path / 'cache', plots=True, dpi=dpi)
+        with open(tmp_path / f"dpi_{dpi}" / 'DP_score_boxplot.png') as f:
+            assert f.read() == f"dpi {dpi}, {gene_pairs.shape[0]} gene pairs"
+    assert (calls['load'], calls['plot']) == (1, 2)
+    
+    # Tables only: the cached tables are restored without figures
+    run(dps, expression_path, sample_info_path, tmp_path / 'tables', tmp_path / 'cache')
+    assert (calls['load'], calls['plot']) == (1, 2)
+    assert not os.path.exists(tmp_path / 'tables' / 'DP_score_boxplot.png')
+
+def test_unreadable_entry_is_a_miss(dps, make_cohort, write_cohort, tmp_path, calls):
+    expression_path, sample_info_path = write_cohort(*make_cohort(seed=64))
+    gene_pairs, _ = run(dps, expression_path, sample_info_path, tmp_path / 'first', tmp_path / 'cache')
+    entry_dir, = [entry.path for entry in os.scandir(tmp_path / 'cache') if entry.is_dir()]
+    with open(os.path.join(entry_dir, 'tables', dps.RESULT_CACHE_RESULTS_FILE), 'w') as f:
+        f.write('{"results": [')
+    
+    # The run is computed again and the entry stored again
+    cached_pairs, _ = run(dps, expression_path, sample_info_path, tmp_path / 'second', tmp_path / 'cache')
+    assert calls['load'] == 2
+    pd.testing.assert_frame_equal(cached_pairs, gene_pairs)
+    with open(os.path.join(entry_dir, 'tables', dps.RESULT_CACHE_RESULTS_FILE)) as f:
+        assert len(json.load(f)['results']) == 2
+    run(dps, expression_path, sample_info_path, tmp_path / 'third', tmp_path / 'cache')
+    assert calls['load'] == 2
+
+def test_sweep_is_restored(dps, make_cohort, write_cohort, tmp_path, calls):
+    expression_path, sample_info_path = write_cohort(*make_cohort(seed=65))
+    assert run(dps, expression_path, sample_info_path, tmp_path / 'first', tmp_path / 'cache', reversal_ratio_threshold=[0.3, 0.4]) is None
+    assert run(dps, expression_path, sample_info_path, tmp_path / 'second', tmp_path / 'cache', reversal_ratio_threshold=[0.3, 0.4]) is None
+    assert calls['load'] == 1
+    for relative_path in ('Threshold_sweep_summary.csv', 'threshold_0.3/Gene_pairs_table.csv', 'threshold_0.4/DP_score_table.csv'):
+        pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'second' / relative_path), pd.read_csv(tmp_path / 'first' / relative_path))
+
+def test_cache_size_limit_evicts_least_recently_used(dps, make_cohort, write_cohort, tmp_path, calls):
+    expression_path, sample_info_path = write_cohort(*make_cohort(seed=66))
+    run(dps, expression_path, sample_info_path, tmp_path / 'first', tmp_path / 'cache')
+    entry_size = dps.directory_size(tmp_path / 'cache')
+    # Room for one entry only: the second run evicts the first
+    run(dps, expression_path, sample_info_path, tmp_path / 'second', tmp_path / 'cache', reversal_ratio_threshold=0.35,
+        result_cache_size_limit=int(entry_size * 1.5))
+    assert len([entry for entry in os.scandir(tmp_path / 'cache') if entry.is_dir()]) == 1
+    run(dps, expression_path, sample_info_path, tmp_path / 'third', tmp_path / 'cache', result_cache_size_limit=int(entry_size * 1.5))
+    assert calls['load'] == 3
@@ -0,0 +1,43 @@
+"""
+Tests of the sample and gene pair scoring against the original implementation (dps_tool/baseline.py)
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+@pytest.mark.parametrize('rounded', [False, True])
+@pytest.mark.parametrize('remove_duplicate_gene_pairs', [False, True])
+def test_tables_match_baseline(dps, reference, make_cohort, write_cohort, tmp_path, remove_duplicate_gene_pairs, rounded):
+    # The Pre samples are scored and counted in the ImportanceScore without being part of the contrast
+    expression_path, sample_info_path = write_cohort(*make_cohort(seed=12, rounded=rounded, other_samples_num=8))
+    # As the original DPS_Tool, the baseline reads the values back from the file
+    expected_pairs, expected_scores = reference.baseline_tables(pd.read_csv(expression_path), pd.read_csv(sample_info_path), 'ND', 'T2D', 0.3,
+                                                                remove_duplicate_gene_pairs)
+    output_path = tmp_path / 'output'
+    os.makedirs(output_path)
+    gene_pairs, scores = dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(output_path), 0.3, remove_duplicate_gene_pairs, plots=False)
+    pd.testing.assert_frame_equal(gene_pairs, expected_pairs.reset_index(drop=True))
+    pd.testing.assert_frame_equal(scores, expected_scores)
+
+def test_analysis_matches_baseline(dps, reference, make_cohort):
+    expr_df, sample_df = make_cohort(seed=13, rounded=True, other_samples_num=8)
+    expected_pairs, expected_scores = reference.baseline_tables(expr_df, sample_df, 'ND', 'T2D', 0.3)
+    result = dps.DPS_Analysis(expr_df, sample_df, 'ND', 'T2D', reversal_ratio_threshold=0.3)
+    pd.testing.assert_frame_equal(result.gene_pairs, expected_pairs.reset_index(drop=True))
+    pd.testing.assert_frame_equal(result.scores, expected_scores)
+
+def test_scoring_runs_on_ranks(dps, make_cohort, write_cohort, tmp_path, monkeypatch):
+    scored_dtypes = []
+    def record(function):
+        def recorded(reversal_gene_pairs, expression_matrix, *args):
+            scored_dtypes.append((function.__name__, set(expression_matrix.dtypes), expression_matrix.shape[1]))
+            return function(reversal_gene_pairs, expression_matrix, *args)
+        return recorded
+    monkeypatch.setattr(dps, 'DP_Score', record(dps.DP_Score))
+    monkeypatch.setattr(dps, 'permutation_test', record(dps.permutation_test))
+    expr_df, sample_df = make_cohort(seed=14, other_samples_num=8)
+    expression_path, sample_info_path = write_cohort(expr_df, sample_df)
+    dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(tmp_path), 0.3, plots=False, permutations_num=5)
+    assert scored_dtypes == [('DP_Score', {np.dtype(np.uint16)}, 38), ('permutation_test', {np.dtype(np.uint16)}, 38)]
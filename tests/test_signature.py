@@ -0,0 +1,49 @@
+"""
+Tests of the signature saved by DPS_Tool and of the scoring of new samples with it (DPS_Score)
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_score_round_trip(dps, make_cohort, write_cohort, tmp_path, cached):
+    expr_df, sample_df = make_cohort(seed=31, rounded=True, other_samples_num=6)
+    expression_path, sample_info_path = write_cohort(expr_df, sample_df)
+    tool_path, score_path = tmp_path / 'tool', tmp_path / 'score'
+    os.makedirs(tool_path)
+    os.makedirs(score_path)
+    gene_pairs, scores = dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(tool_path), 0.3, plots=False, signature=True)
+    
+    # The new expression matrix has its genes in another order, a duplicated symbol (the first row is used) and only some of the samples
+    new_expr_df = expr_df.iloc[::-1, :-5]
+    duplicate_row = new_expr_df[new_expr_df['Symbol'] == gene_pairs['Gene1'][0]].assign(S000=-100.0)
+    new_expr_df = pd.concat([new_expr_df, duplicate_row], ignore_index=True)
+    new_expression_path = tmp_path / 'new_expr.csv'
+    new_expr_df.to_csv(new_expression_path, index=False)
+    cache_dir = str(tmp_path / 'cache') if cached else None
+    new_scores = dps.DPS_Score(str(tool_path / 'DPS_signature.npz'), str(new_expression_path), str(score_path), sample_info_path, cache_dir=cache_dir)
+    
+    expected = scores.set_index('Sample')['DP_Score']
+    new_scores = new_scores.set_index('Sample')['DP_Score']
+    assert len(new_scores) == len(expected) - 5
+    np.testing.assert_allclose(new_scores, expected.loc[new_scores.index])
+    
+    signature = dps.load_signature(str(tool_path / 'DPS_signature.npz'))
+    np.testing.assert_array_equal(signature['symbols'][signature['gene1']], gene_pairs['Gene1'])
+    np.testing.assert_array_equal(signature['importance_score'], gene_pairs['ImportanceScore'])
+
+def test_signature_written_on_request(dps, make_cohort, write_cohort, tmp_path):
+    expression_path, sample_info_path = write_cohort(*make_cohort(seed=32))
+    dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(tmp_path), 0.3, plots=False)
+    assert not os.path.exists(tmp_path / 'DPS_signature.npz')
+
+def test_missing_signature_genes(dps, make_cohort, write_cohort, tmp_path):
+    expr_df, sample_df = make_cohort(seed=33)
+    expression_path, sample_info_path = write_cohort(expr_df, sample_df)
+    gene_pairs, _ = dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(tmp_path), 0.3, plots=False, signature=True)
+    missing_path = tmp_path / 'missing.csv'
+    expr_df[expr_df['Symbol'] != gene_pairs['Gene1'][0]].to_csv(missing_path, index=False)
+    with pytest.raises(ValueError, match="1 genes of the signature are missing"):
+        dps.DPS_Score(str(tmp_path / 'DPS_signature.npz'), str(missing_path), str(tmp_path))
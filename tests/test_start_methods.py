@@ -0,0 +1,33 @@
+"""
+Tests of the process pools with every multiprocessing start method
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# Runs the pair search in a pool of the given start method and prints the number of pairs; spawn and forkserver workers import
+# dps_tool again to unpickle the worker functions
+POOL_SCRIPT = '''
+import multiprocessing, sys
+sys.path.insert(0, {tests_path!r})
+if __name__ == '__main__':
+    multiprocessing.set_start_method({start_method!r})
+    import conftest, dps_tool
+    expr_df, sample_df = conftest.tie_heavy_cohort()
+    result = dps_tool.DPS_Analysis(expr_df, sample_df, 'ND', 'T2D', reversal_ratio_threshold=0.3, n_jobs=2)
+    print(result.gene_pairs.shape[0])
+'''
+
+@pytest.mark.parametrize('start_method', ['fork', 'spawn', 'forkserver'])
+def test_pools_work_with_every_start_method(dps, make_cohort, tmp_path, start_method):
+    script_path = tmp_path / 'pool.py'
+    script_path.write_text(POOL_SCRIPT.format(tests_path=TESTS_PATH, start_method=start_method))
+    completed = subprocess.run([sys.executable, str(script_path)], capture_output=True, text=True, timeout=600)
+    assert completed.returncode == 0, completed.stderr
+    expr_df, sample_df = make_cohort()
+    expected = dps.DPS_Analysis(expr_df, sample_df, 'ND', 'T2D', reversal_ratio_threshold=0.3)
+    assert int(completed.stdout.split()[-1]) == expected.gene_pairs.shape[0]
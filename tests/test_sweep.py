@@ -0,0 +1,58 @@
+"""
+Tests of the threshold sweep (one pair search for several reversal ratio thresholds) against single-threshold runs
+"""
+import os
+
+import pandas as pd
+import pytest
+
+from test_pair_search import contrast, write_gene_set
+
+THRESHOLDS = [0.3, 0.4, 0.5]
+
+@pytest.mark.parametrize('gene_set', [False, True])
+@pytest.mark.parametrize('remove_duplicate_gene_pairs', [False, True])
+@pytest.mark.parametrize('backend', ['reference', 'tiled', 'bitpacked'])
+def test_sweep_matches_single_thresholds(dps, make_cohort, tmp_path, backend, remove_duplicate_gene_pairs, gene_set):
+    expr_df, negative_samples_num, positive_samples_num = contrast(*make_cohort(seed=71, rounded=True))
+    gene_set_path = write_gene_set(tmp_path, expr_df['Symbol'].iloc[::2]) if gene_set else None
+    sweep_results = dps.Reverse_gene_pairs_sweep(expr_df, negative_samples_num, positive_samples_num, THRESHOLDS, remove_duplicate_gene_pairs, gene_set_path,
+                                                 backend)
+    assert [threshold for threshold, _, _ in sweep_results] == THRESHOLDS
+    for threshold, result, pairs_num in sweep_results:
+        try:
+            expected = dps.Reverse_gene_pairs(expr_df, negative_samples_num, positive_samples_num, threshold, remove_duplicate_gene_pairs, gene_set_path,
+                                              backend)
+        except ValueError as e:
+            assert isinstance(result, ValueError) and str(result) == str(e)
+            continue
+        pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))
+        if not remove_duplicate_gene_pairs:
+            assert pairs_num == expected.shape[0]
+
+def test_dps_tool_sweep_matches_single_runs(dps, make_cohort, write_cohort, tmp_path):
+    expression_path, sample_info_path = write_cohort(*make_cohort(seed=72, other_samples_num=6))
+    thresholds = THRESHOLDS + [0.9]
+    assert dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(tmp_path / 'sweep'), thresholds, plots=False) is None
+    summary = pd.read_csv(tmp_path / 'sweep' / 'Threshold_sweep_summary.csv')
+    assert summary['Threshold'].tolist() == thresholds
+    # Too few gene pairs reach the highest threshold: the sweep records the failure and runs the other thresholds
+    assert summary['Status'].tolist()[:-1] == ['completed'] * len(THRESHOLDS)
+    assert summary['Status'].iloc[-1].startswith('failed: ')
+    assert summary['PairsAboveThreshold'].is_monotonic_decreasing
+    
+    for threshold, summary_row in zip(THRESHOLDS, summary.itertuples()):
+        single_path = tmp_path / f"single_{threshold:g}"
+        os.makedirs(single_path)
+        gene_pairs, scores = dps.DPS_Tool(expression_path, sample_info_path, 'ND', 'T2D', str(single_path), threshold, plots=False)
+        assert summary_row.GenePairsNum == summary_row.PairsAboveThreshold == gene_pairs.shape[0]
+        separation = dps.score_separation(scores, 'ND', 'T2D')
+        for column, value in separation.items():
+            assert getattr(summary_row, column) == pytest.approx(value)
+        for table_name in ('Gene_pairs_table.csv', 'DP_score_table.csv'):
+            pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'sweep' / f"threshold_{threshold:g}" / table_name), pd.read_csv(single_path / table_name))
+
+def test_parse_thresholds(dps):
+    assert dps.parse_thresholds('0.35') == [0.35]
+    assert dps.parse_thresholds('0.3,0.4,0.5') == [0.3, 0.4, 0.5]
+    assert dps.parse_thresholds('0.3:0.5:0.1') == [0.3, 0.4, 0.5]
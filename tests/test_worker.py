@@ -0,0 +1,58 @@
+"""
+Tests of the memory budget of DPS-Worker.py
+"""
+import importlib.util
+import multiprocessing
+import os
+
+import pytest
+import scipy.io
+import scipy.sparse
+
+@pytest.fixture
+def worker():
+    spec = importlib.util.spec_from_file_location('dps_worker', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                                             'dps_tool', 'DPS-Worker.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def job_argv(expression_path, sample_info_path, output_dir):
+    return ['--expression_matrix', expression_path, '--sample_info', sample_info_path, '--negative_class', 'ND', '--positive_class', 'T2D',
+            '--output_dir', output_dir, '--reversion_threshold', '0.3', '--deduplicate', 'False']
+
+def test_expression_values_num(worker, make_cohort, write_cohort, tmp_path):
+    expression_path, _ = write_cohort(*make_cohort(genes_num=120))
+    assert worker.expression_values_num(expression_path) == 120 * 30
+    matrix = scipy.sparse.random(200, 40, density=0.1, format='csr', random_state=0)
+    scipy.io.mmwrite(str(tmp_path / 'matrix.mtx'), matrix)
+    scipy.sparse.save_npz(str(tmp_path / 'matrix.npz'), matrix)
+    assert worker.expression_values_num(str(tmp_path / 'matrix.mtx')) == matrix.nnz
+    assert worker.expression_values_num(str(tmp_path / 'matrix.npz')) == matrix.nnz
+
+def test_job_memory(worker, make_cohort, write_cohort, tmp_path):
+    expression_path, sample_info_path = write_cohort(*make_cohort(genes_num=120))
+    job = {'task_id': 'task', 'argv': job_argv(expression_path, sample_info_path, str(tmp_path))}
+    assert worker.job_memory(job, 2 ** 40) == worker.JOB_MEMORY_BASE + worker.JOB_MEMORY_PER_VALUE * 120 * 30
+    assert worker.job_memory(job, 2 ** 20) == 2 ** 20
+    missing_job = {'task_id': 'task', 'argv': job_argv(str(tmp_path / 'missing.csv'), sample_info_path, str(tmp_path))}
+    assert worker.job_memory(missing_job, 2 ** 40) == worker.JOB_MEMORY_BASE
+
+def test_jobs_are_admitted_within_the_budget(worker):
+    assert worker.fits_memory_budget(0, 300, 200)
+    assert worker.fits_memory_budget(100, 100, 200)
+    assert not worker.fits_memory_budget(150, 100, 200)
+
+def test_out_of_memory_job_reports_it(worker, make_cohort, write_cohort, tmp_path, monkeypatch):
+    # The job gets a MemoryError once it allocates beyond its reserved memory, and DPS-Tool.py writes it in the task status
+    expression_path, sample_info_path = write_cohort(*make_cohort(genes_num=3000, negative_samples_num=100, positive_samples_num=100))
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('task_status')
+    os.makedirs('task')
+    job = {'task_id': 'task', 'argv': job_argv(expression_path, sample_info_path, 'task')}
+    process = multiprocessing.get_context('fork').Process(target=worker.run_job, args=(worker.load_dps_tool(), job, 5 * 1024 ** 2))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    with open('task_status/task.status') as f:
+        assert f.read() == 'failed: out of memory'
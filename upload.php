@@ -63,14 +63,25 @@ if ($data_type) {
     $command[] = '--data_type';
     $command[] = $data_type;
 }
+// 如果存在 result_cache 目录，相同输入和参数的任务直接复用缓存的结果
+if (is_dir("result_cache")) {
+    $command[] = '--result_cache_dir';
+    $command[] = 'result_cache';
+}
 
 // 设置任务状态
 $task_id = $unique_id; // 使用相同的唯一标识符作为 task_id
 file_put_contents("task_status/{$task_id}.status", "processing");
 
-// 在后台执行 Python 脚本
-$background_command = implode(' ', $command) . " > /dev/null 2>&1 &";
-shell_exec($background_command);
+// 如果 DPS-Worker.py 正在运行（存在 task_queue 目录），将任务加入队列；否则在后台执行 Python 脚本
+if (is_dir("task_queue")) {
+    $job = json_encode(['task_id' => $task_id, 'argv' => array_slice($command, 2)]);
+    file_put_contents("task_queue/.{$task_id}.json.tmp", $job);
+    rename("task_queue/.{$task_id}.json.tmp", "task_queue/{$task_id}.json");
+} else {
+    $background_command = implode(' ', $command) . " > /dev/null 2>&1 &";
+    shell_exec($background_command);
+}
 
 // 立即返回任务ID
 header('Content-Type: application/json');
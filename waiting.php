@@ -47,6 +47,7 @@ $task_id = $_GET['task_id'];
         <div class="loading-circle"></div>
         <div class="waiting-text">
             <p>It will take 3 to 7 minutes to get the results. Please wait patiently...</p>
+            <p id="progress-text"></p>
         </div>
         <script src="https://code.jquery.com/jquery-3.6.0.min.js"></script>
     <script src="./js/bootstrap.bundle.min.js"></script>
@@ -68,7 +69,38 @@ $task_id = $_GET['task_id'];
             });
         }
 
+        // Names of the stages written by DPS-Tool.py to the progress file
+        var stageNames = {
+            "load": "Loading the expression matrix",
+            "pair_search": "Searching reversed gene pairs",
+            "dedup": "Removing duplicate gene pairs",
+            "dp_score": "Calculating disease perturbation scores",
+            "importance": "Ranking gene pairs by importance",
+            "plot_TOP10_gene_pairs_bar_chart": "Plotting figures",
+            "plot_DP_score_bar_chart": "Plotting figures",
+            "plot_DP_score_boxplot": "Plotting figures",
+            "plot_DP_score_with_sample_information": "Plotting figures"
+        };
+
+        function checkTaskProgress() {
+            $.ajax({
+                url: "check_progress.php?task_id=" + taskId,
+                dataType: "json",
+                success: function (data) {
+                    if (!data.stage) {
+                        return;
+                    }
+                    var text = stageNames[data.stage] || data.stage;
+                    if (data.stage === "pair_search") {
+                        text += " (" + Math.round(data.fraction * 100) + "%)";
+                    }
+                    $("#progress-text").text(text + "...");
+                }
+            });
+        }
+
         setInterval(checkTaskStatus, 5000);
+        setInterval(checkTaskProgress, 5000);
     </script>
     </body>
 </html>
\ No newline at end of file